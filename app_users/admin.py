@@ -1,12 +1,14 @@
 from django.contrib import admin
 from app_users.models import AppUser
 from django.contrib.auth.admin import UserAdmin
+from app_users.api.search import SEARCH_FIELDS, filter_by_search, get_search_terms
 
 
 class CustomAppUser(UserAdmin):
     # Specify the fields to display in the admin list view
     list_display = (
         "email",
+        "username",
         "mobile",
         "first_name",
         "last_name",
@@ -17,7 +19,7 @@ class CustomAppUser(UserAdmin):
     list_filter = ("is_staff", "is_superuser", "is_active", "groups")
     # Specify the fieldsets for the add and change forms
     fieldsets = (
-        (None, {"fields": ("email", "password")}),
+        (None, {"fields": ("email", "username", "password")}),
         ("Personal Info", {"fields": ("first_name", "last_name", "mobile")}),
         (
             "Permissions",
@@ -41,6 +43,7 @@ class CustomAppUser(UserAdmin):
                 "classes": ("wide",),
                 "fields": (
                     "email",
+                    "username",
                     "mobile",
                     "password1",
                     "password2",
@@ -50,11 +53,19 @@ class CustomAppUser(UserAdmin):
             },
         ),
     )
-    # Specify the search fields for the admin search bar
-    search_fields = ("email", "first_name", "last_name", "mobile")
+    # Specify the search fields for the admin search bar, the same ones the
+    # full-text index covers, used as is for terms too short for it
+    search_fields = SEARCH_FIELDS
     # Specify the ordering of objects in the admin list view
     ordering = ("email",)
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of icontains on every search field
+        terms = get_search_terms(search_term)
+        if not terms:
+            return super().get_search_results(request, queryset, search_term)
+        return filter_by_search(queryset, terms), False
+
 
 # Register your models here.
-admin.site.register(AppUser)
+admin.site.register(AppUser, CustomAppUser)
@@ -0,0 +1,453 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotModified, JsonResponse, QueryDict
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+from rest_framework.exceptions import (
+    AuthenticationFailed,
+    NotAuthenticated,
+    NotFound,
+    PermissionDenied,
+    ValidationError,
+)
+from rest_framework.request import Request
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenVerifySerializer
+from rest_framework_simplejwt.tokens import UntypedToken
+
+from app_users.api.authentication import aauthenticate
+from app_users.api.hashing import (
+    HashingPoolSaturated,
+    acheck_password,
+    amake_password,
+)
+from app_users.api.read_serializers import compile_read_serializer
+from app_users.api.response_cache import (
+    cache_list,
+    cache_user,
+    etag_matches,
+    get_cached_list,
+    get_cached_user,
+    make_etag,
+)
+from app_users.api.revocation import ais_revoked, get_jti
+from app_users.api.serializers import (
+    AppUserSerializers,
+    CustomTokenObtainPairSerializer,
+    RotatingTokenRefreshSerializer,
+    ais_current_version,
+    save_new_user,
+)
+from app_users.api.tokens import aget_or_create_token
+from app_users.api.views import UserViewSet
+from app_users.models import AppUser
+from app_users.routers import pin_for_user
+from app_users.sharding import (
+    afirst_in_shards,
+    new_user_id,
+)
+
+
+"""
+Native async twins of the user and token views, meant to be served by demo/asgi.py.
+Reads use the async ORM (aget, async iteration), password hashing runs on the
+bounded process pool so the event loop stays free while logins are in progress.
+Serializer validation and the registration transaction are the only sync hops,
+DRF validators and transaction.atomic have no async API.
+Which routes use them is chosen with ASYNC_ROUTES in settings (see urls.py).
+"""
+
+
+def _envelope(success, data, message, status_code):
+    return JsonResponse(
+        {"success": success, "data": data, "message": message},
+        status=status_code,
+    )
+
+
+def _load_body(request):
+    """
+    The body as a dict, None when it can't be parsed. Takes what DRF's default
+    parsers take on the sync views: JSON, form-encoded and multipart bodies.
+    """
+    if request.content_type == "application/x-www-form-urlencoded":
+        return QueryDict(request.body, encoding=request.encoding).dict()
+    if request.content_type == "multipart/form-data":
+        # Django only parses multipart bodies of POST requests
+        return request.POST.dict() if request.method == "POST" else None
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def _authenticate(email, password):
+    """
+    Same rules as ModelBackend, with the hash verified off the event loop.
+    """
+    if not email or not password:
+        return None
+    user = await afirst_in_shards(AppUser.objects.filter(email=email))
+    if user is None:
+        # Keep the timing of unknown emails close to a wrong password
+        await amake_password(password)
+        return None
+    if not await acheck_password(password, user.password):
+        return None
+    return user if user.is_active else None
+
+
+def _saturated_response():
+    return _envelope(
+        False,
+        [],
+        "Too Many Concurrent Logins, Retry Later",
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@csrf_exempt
+@require_POST
+async def async_auth_token(request):
+    try:
+        data = _load_body(request)
+        if data is None:
+            return _envelope(
+                False, [], "Invalid JSON Body", status.HTTP_400_BAD_REQUEST
+            )
+
+        # "username" like DRF's AuthTokenSerializer, it holds the email
+        user = await _authenticate(data.get("username"), data.get("password"))
+        if user is None:
+            return _envelope(
+                False,
+                [],
+                "Unable to log in with provided credentials.",
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Created on the first login when tokens are lazy
+        token = await aget_or_create_token(user)
+        return _envelope(
+            True,
+            [
+                {
+                    "token": token.key,
+                    "userId": user.pk,
+                    "email": user.email,
+                    "username": user.username,
+                    "isAdmin": user.is_superuser,
+                }
+            ],
+            "User Logged In Successfully",
+            status.HTTP_200_OK,
+        )
+    except HashingPoolSaturated:
+        return _saturated_response()
+    except Exception as e:
+        return _envelope(False, [], str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@require_POST
+async def async_jwt_pair_token(request):
+    try:
+        data = _load_body(request)
+        if data is None:
+            return _envelope(
+                False, [], "Invalid JSON Body", status.HTTP_400_BAD_REQUEST
+            )
+
+        user = await _authenticate(data.get("email"), data.get("password"))
+        if user is None:
+            return _envelope(
+                False,
+                [],
+                "Invalid Creds OR No Active User",
+                status.HTTP_404_NOT_FOUND,
+            )
+
+        tokens = await sync_to_async(CustomTokenObtainPairSerializer.get_token_pair)(
+            user
+        )
+        return _envelope(
+            True,
+            {**tokens, **AppUserSerializers(user).data},
+            "Token Generated Successfully",
+            status.HTTP_200_OK,
+        )
+    except HashingPoolSaturated:
+        return _saturated_response()
+    except Exception as e:
+        return _envelope(False, [], str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _validate_registration(data):
+    serializer = AppUserSerializers(data=data)
+    serializer.is_valid()
+    return serializer
+
+
+def _create_registered_user(serializer, encoded_password):
+    # Same as UserViewSet.create, password already hashed
+    validated_data = {**serializer.validated_data, "last_login": timezone.now()}
+    validated_data.pop("password")
+    user = save_new_user(
+        AppUser(id=new_user_id(), password=encoded_password, **validated_data)
+    )
+    tokens = CustomTokenObtainPairSerializer.get_token_pair(user, record_login=False)
+    serializer.instance = user
+    return {**serializer.data, **tokens}
+
+
+@csrf_exempt
+@require_POST
+async def async_jwt_refresh_token(request):
+    try:
+        data = _load_body(request)
+        if data is None:
+            return _envelope(
+                False, [], "Invalid JSON Body", status.HTTP_400_BAD_REQUEST
+            )
+
+        # Rotation revokes the old refresh token, an INSERT
+        serializer = RotatingTokenRefreshSerializer(data=data)
+        try:
+            is_valid = await sync_to_async(serializer.is_valid)()
+        except TokenError:
+            is_valid = False
+        if not is_valid:
+            return _envelope(
+                False,
+                [],
+                "Access Token Generation Failed",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        return _envelope(
+            True,
+            [serializer.validated_data],
+            "Access Token Generated Successfully",
+            status.HTTP_200_OK,
+        )
+    except Exception as e:
+        return _envelope(False, [], str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@require_POST
+async def async_jwt_verify_token(request):
+    try:
+        data = _load_body(request)
+        if data is None:
+            return _envelope(
+                False, [], "Invalid JSON Body", status.HTTP_400_BAD_REQUEST
+            )
+
+        # Signature and expiry here, revocation and auth_version below, with
+        # the async ORM when the filter and the version map can't answer
+        serializer = TokenVerifySerializer(data=data)
+        try:
+            is_valid = serializer.is_valid()
+            if is_valid:
+                token = UntypedToken(data["token"])
+                revoked = await ais_revoked(get_jti(token))
+                is_valid = not revoked and await ais_current_version(token)
+        except TokenError:
+            is_valid = False
+        if not is_valid:
+            return _envelope(
+                False,
+                [],
+                "Access Token Verification Failed",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        return _envelope(True, [], "Token Verified Successfully", status.HTTP_200_OK)
+    except Exception as e:
+        return _envelope(False, [], str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _user_viewset(request, action, **kwargs):
+    """
+    UserViewSet instance for its request-only plumbing (permissions, ?fields=,
+    filters, cursor pagination). No handler of it is called and nothing on it
+    queries the database.
+    """
+    view = UserViewSet(action=action, kwargs=kwargs, format_kwarg=None)
+    view.request = Request(request)
+    view.request.user = request.user
+    return view
+
+
+def _check_permissions(view, request):
+    # request.user was set by aauthenticate, the permission classes only read it
+    for permission in view.get_permissions():
+        if not permission.has_permission(request, view):
+            if not request.user.is_authenticated:
+                raise NotAuthenticated()
+            raise PermissionDenied(getattr(permission, "message", None))
+
+
+def _check_object_permissions(view, request, obj):
+    for permission in view.get_permissions():
+        if not permission.has_object_permission(request, view, obj):
+            raise PermissionDenied(getattr(permission, "message", None))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncUserView(View):
+    """
+    Base of the native async user views. Authentication and permission checks
+    follow UserViewSet (Token and JWT only), errors use the usual envelope.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await aauthenticate(request)
+            pin_for_user(request.user)
+            return await super().dispatch(request, *args, **kwargs)
+        except (AuthenticationFailed, NotAuthenticated) as e:
+            return _envelope(False, [], e.detail, status.HTTP_401_UNAUTHORIZED)
+        except PermissionDenied as e:
+            return _envelope(False, [], e.detail, status.HTTP_403_FORBIDDEN)
+        except ValidationError as e:
+            return _envelope(False, [], e.detail, status.HTTP_400_BAD_REQUEST)
+        except NotFound as e:
+            # e.g. a malformed ?cursor=
+            return _envelope(False, [], e.detail, status.HTTP_404_NOT_FOUND)
+        except AppUser.DoesNotExist:
+            return _envelope(False, [], "User Not Found", status.HTTP_404_NOT_FOUND)
+        except HashingPoolSaturated:
+            return _saturated_response()
+        except Exception as e:
+            return _envelope(False, [], str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AsyncUserList(AsyncUserView):
+    async def get(self, request):
+        view = _user_viewset(request, "list")
+        _check_permissions(view, request)
+
+        cached = get_cached_list(view.request)
+        if cached is not None:
+            etag, payload = cached
+            if etag_matches(request, etag):
+                return HttpResponseNotModified(headers={"ETag": etag})
+            return JsonResponse(payload, headers={"ETag": etag})
+
+        read_serializer = compile_read_serializer(view.get_serializer_class())
+        paginator = view.paginator
+        queryset = read_serializer.values(
+            view.filter_queryset(view.get_queryset()),
+            extra=[field.lstrip("-") for field in paginator.ordering],
+        )
+        page_querysets = paginator.get_page_querysets(queryset, view.request, view)
+        pages = [[row async for row in page] for page in page_querysets]
+        payload = paginator.get_paginated_data(
+            read_serializer.serialize_rows(
+                paginator.set_page(paginator.merge_pages(pages))
+            )
+        )
+        etag = cache_list(view.request, payload)
+        return JsonResponse(payload, headers={"ETag": etag})
+
+    async def post(self, request):
+        data = _load_body(request)
+        if data is None:
+            return _envelope(
+                False, [], "Invalid JSON Body", status.HTTP_400_BAD_REQUEST
+            )
+
+        # Validators may query (uniqueness), DRF runs them synchronously
+        serializer = await sync_to_async(_validate_registration)(data)
+        if serializer.errors:
+            return _envelope(False, [], serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        encoded_password = await amake_password(serializer.validated_data["password"])
+        # Saving stays sync, the INSERTs share one transaction in save_new_user
+        user_data = await sync_to_async(_create_registered_user)(
+            serializer, encoded_password
+        )
+        return _envelope(
+            True, user_data, "User Created Successfully", status.HTTP_201_CREATED
+        )
+
+
+class AsyncUserDetail(AsyncUserView):
+    async def get_object(self, view, pk):
+        user = await view.get_queryset().aget(pk=pk)
+        _check_object_permissions(view, self.request, user)
+        return user
+
+    async def get(self, request, pk):
+        view = _user_viewset(request, "retrieve", pk=pk)
+        _check_permissions(view, request)
+        fieldset = view.get_fieldset()
+
+        cached = get_cached_user(pk)
+        if cached is not None:
+            etag, instance, data = cached
+            _check_object_permissions(view, request, instance)
+            if fieldset is not None:
+                data = {name: data[name] for name in fieldset}
+                etag = make_etag(data)
+        else:
+            instance = await self.get_object(view, pk)
+            data = view.get_serializer(instance=instance).data
+            if fieldset is not None:
+                etag = make_etag(data)
+            else:
+                etag = cache_user(instance, data)
+
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={"ETag": etag})
+        response = _envelope(
+            True, [data], "User Fetched Successfully", status.HTTP_200_OK
+        )
+        response["ETag"] = etag
+        return response
+
+    async def patch(self, request, pk):
+        view = _user_viewset(request, "partial_update", pk=pk)
+        _check_permissions(view, request)
+        user = await self.get_object(view, pk)
+
+        data = _load_body(request)
+        if data is None:
+            return _envelope(
+                False, [], "Invalid JSON Body", status.HTTP_400_BAD_REQUEST
+            )
+        serializer = AppUserSerializers(instance=user, data=data, partial=True)
+        if not await sync_to_async(serializer.is_valid)():
+            return _envelope(False, [], serializer.errors, status.HTTP_400_BAD_REQUEST)
+
+        # Same as AppUserSerializers.update, with the hash done on the pool
+        validated_data = dict(serializer.validated_data)
+        password = validated_data.pop("password", None)
+        for attr, value in validated_data.items():
+            setattr(user, attr, value)
+        if password:
+            user.password = await amake_password(password)
+        await user.asave()
+        return _envelope(
+            True,
+            AppUserSerializers(user).data,
+            "User Updated Successfully",
+            status.HTTP_200_OK,
+        )
+
+    put = patch  # UserViewSet.update is always partial too
+
+    async def delete(self, request, pk):
+        view = _user_viewset(request, "destroy", pk=pk)
+        _check_permissions(view, request)
+        user = await self.get_object(view, pk)
+        await user.adelete()
+        return _envelope(
+            True, [], "User Deleted Successfully", status.HTTP_204_NO_CONTENT
+        )
@@ -0,0 +1,367 @@
+import copy
+import hashlib
+import hmac
+import os
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import (
+    BasicAuthentication,
+    TokenAuthentication,
+    get_authorization_header,
+)
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import (
+    JWTAuthentication,
+    JWTStatelessUserAuthentication,
+)
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from app_users.api.caches import LRUCache
+from app_users.api.revocation import ais_revoked, get_jti, is_revoked
+from app_users.api.tokens import record_token_use
+from app_users.models import AppUser
+from app_users.routers import is_replica, pin_for_user_id, read_database
+from app_users.sharding import (
+    afirst_in_shards,
+    first_in_shards,
+    for_user_shard,
+    user_database,
+)
+
+
+"""
+Drop-in replacements for the DRF / simplejwt authentication classes that
+avoid a database hit on every request. Invalidation is driven by the
+receivers in app_users.api.signals.
+"""
+
+
+def _token_cache_settings():
+    return {
+        "MAXSIZE": 10000,
+        "TTL": 60,
+        "SHARED_CACHE": None,
+        **getattr(settings, "AUTH_TOKEN_CACHE", {}),
+    }
+
+
+_token_settings = _token_cache_settings()
+token_cache = LRUCache(maxsize=_token_settings["MAXSIZE"], ttl=_token_settings["TTL"])
+
+
+def _shared_token_cache():
+    alias = _token_settings["SHARED_CACHE"]
+    return caches[alias] if alias else None
+
+
+def _shared_key(key):
+    return f"auth-token:{key}"
+
+
+def invalidate_token(key):
+    token_cache.delete(key)
+    shared = _shared_token_cache()
+    if shared is not None:
+        shared.delete(_shared_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    # Any process may have put the user's token in the shared cache, its key is
+    # read from the primary (one Token per user) rather than remembered here
+    keys = (
+        Token.objects.using(user_database(user_id))
+        .filter(user_id=user_id)
+        .values_list("key", flat=True)
+    )
+    for key in keys:
+        invalidate_token(key)
+
+
+def _get_cached_token(key):
+    cached = token_cache.get(key)
+    if cached is None:
+        shared = _shared_token_cache()
+        if shared is not None:
+            cached = shared.get(_shared_key(key))
+            if cached is not None:
+                token_cache.set(key, cached)
+    return cached
+
+
+def _cache_token(key, cached):
+    token_cache.set(key, cached)
+    shared = _shared_token_cache()
+    if shared is not None:
+        shared.set(_shared_key(key), cached, _token_settings["TTL"])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication with token key -> (user, token) kept in an in-process
+    LRU, optionally backed by a shared django cache (AUTH_TOKEN_CACHE["SHARED_CACHE"]).
+    Saving or deleting a Token / AppUser evicts the entry in this process and in
+    the shared cache, other processes drop their local copy after TTL seconds.
+    Uses are recorded for prune_auth_tokens, see app_users.api.tokens.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = _get_cached_token(key)
+        if cached is None:
+            # The key says nothing about the shard, every shard is asked
+            model = self.get_model()
+            queryset = read_database(
+                model.objects.select_related("user").filter(key=key)
+            )
+            token = first_in_shards(queryset)
+            if self.read_again(queryset, token):
+                token = first_in_shards(queryset.using(DEFAULT_DB_ALIAS))
+            cached = self.check_token(token)
+            _cache_token(key, cached)
+
+        user, token = cached
+        record_token_use(user.pk)
+        # Every request gets its own copy, the cached instance is shared
+        return (copy.copy(user), token)
+
+    async def aauthenticate_credentials(self, key):
+        cached = _get_cached_token(key)
+        if cached is None:
+            model = self.get_model()
+            queryset = read_database(
+                model.objects.select_related("user").filter(key=key)
+            )
+            token = await afirst_in_shards(queryset)
+            if self.read_again(queryset, token):
+                token = await afirst_in_shards(queryset.using(DEFAULT_DB_ALIAS))
+            cached = self.check_token(token)
+            _cache_token(key, cached)
+
+        user, token = cached
+        record_token_use(user.pk)
+        return (copy.copy(user), token)
+
+    def read_again(self, queryset, token):
+        # From a replica, a token created or a user changed within its lag may
+        # be missing or stale there, the primary has the last word
+        return is_replica(queryset.db) and (
+            token is None or pin_for_user_id(token.user_id)
+        )
+
+    def check_token(self, token):
+        # Same failures as TokenAuthentication.authenticate_credentials
+        if token is None:
+            raise AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_("User inactive or deleted."))
+        return (token.user, token)
+
+
+# user id -> current auth_version, None for deleted / inactive users.
+# Kept fresh by the AppUser signals, the TTL bounds staleness across processes.
+auth_versions = LRUCache(
+    maxsize=getattr(settings, "AUTH_VERSION_CACHE", {}).get("MAXSIZE", 100000),
+    ttl=getattr(settings, "AUTH_VERSION_CACHE", {}).get("TTL", 300),
+)
+_DELETED = -1
+
+
+def set_auth_version(user):
+    auth_versions.set(user.pk, user.auth_version if user.is_active else _DELETED)
+
+
+def forget_auth_version(user_id):
+    auth_versions.set(user_id, _DELETED)
+
+
+def _version_from_row(row):
+    return row[0] if row and row[1] else _DELETED
+
+
+def _auth_version_rows(user_id):
+    # A user that just wrote is read from the primary, pinned before the query
+    pin_for_user_id(user_id)
+    queryset = for_user_shard(AppUser.objects.filter(pk=user_id), user_id)
+    return read_database(queryset.values_list("auth_version", "is_active"))
+
+
+def get_auth_version(user_id):
+    version = auth_versions.get(user_id)
+    if version is None:
+        rows = _auth_version_rows(user_id)
+        version = _version_from_row(rows.first())
+        if version == _DELETED and is_replica(rows.db):
+            # Never cached from a replica, a new user may not have reached it
+            version = _version_from_row(rows.using(DEFAULT_DB_ALIAS).first())
+        auth_versions.set(user_id, version)
+    return version
+
+
+async def aget_auth_version(user_id):
+    version = auth_versions.get(user_id)
+    if version is None:
+        rows = _auth_version_rows(user_id)
+        version = _version_from_row(await rows.afirst())
+        if version == _DELETED and is_replica(rows.db):
+            version = _version_from_row(await rows.using(DEFAULT_DB_ALIAS).afirst())
+        auth_versions.set(user_id, version)
+    return version
+
+
+class ClaimsUser(TokenUser):
+    """
+    Request user built from the claims of CustomTokenObtainPairSerializer.get_token.
+    Compares equal to the AppUser with the same id so owner checks keep working.
+    """
+
+    @property
+    def email(self):
+        return self.token.get("email", "")
+
+    @property
+    def is_staff(self):
+        return self.token.get("isStaff", False)
+
+    @property
+    def is_superuser(self):
+        return self.token.get("isAdmin", False)
+
+    def __eq__(self, other):
+        if isinstance(other, AppUser):
+            return str(self.id) == str(other.pk)
+        return super().__eq__(other)
+
+    __hash__ = TokenUser.__hash__
+
+
+class VersionedJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Resolves the request user from the token claims instead of loading AppUser.
+    The "ver" claim must match the user's current auth_version, which lives in
+    an in-memory map, so password / is_active / staff changes revoke old tokens.
+    Tokens minted before the claim existed fall back to a database lookup.
+    Single revoked tokens are ruled out by the filter of app_users.api.revocation.
+    """
+
+    def get_user(self, validated_token):
+        if is_revoked(get_jti(validated_token)):
+            raise self.revoked()
+        if "ver" not in validated_token:
+            pin_for_user_id(validated_token.get(jwt_settings.USER_ID_CLAIM))
+            return JWTAuthentication.get_user(self, validated_token)
+
+        user = super().get_user(validated_token)
+        self.check_version(validated_token, get_auth_version(user.id))
+        return user
+
+    async def aget_user(self, validated_token):
+        if await ais_revoked(get_jti(validated_token)):
+            raise self.revoked()
+        if "ver" not in validated_token:
+            pin_for_user_id(validated_token.get(jwt_settings.USER_ID_CLAIM))
+            return await sync_to_async(JWTAuthentication.get_user)(
+                self, validated_token
+            )
+
+        user = super().get_user(validated_token)
+        self.check_version(validated_token, await aget_auth_version(user.id))
+        return user
+
+    def check_version(self, validated_token, version):
+        if validated_token["ver"] != version:
+            raise self.revoked()
+
+    def revoked(self):
+        return AuthenticationFailed(
+            _("Token is no longer valid for this user"), code="token_revoked"
+        )
+
+
+_basic_settings = {
+    "MAXSIZE": 10000,
+    "TTL": 30,
+    **getattr(settings, "BASIC_AUTH_CACHE", {}),
+}
+basic_auth_cache = LRUCache(
+    maxsize=_basic_settings["MAXSIZE"], ttl=_basic_settings["TTL"]
+)
+# Per-process key, the cache only ever holds HMACs of the credentials
+_basic_auth_key = os.urandom(32)
+_basic_digests_by_user = defaultdict(set)
+_basic_digests_lock = threading.Lock()
+
+
+def _credentials_digest(userid, password):
+    message = b"\0".join((userid.encode(), password.encode()))
+    return hmac.new(_basic_auth_key, message, hashlib.sha256).digest()
+
+
+def invalidate_basic_credentials(user_id):
+    with _basic_digests_lock:
+        digests = _basic_digests_by_user.pop(user_id, ())
+    for digest in digests:
+        basic_auth_cache.delete(digest)
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Opt-in BasicAuthentication that remembers successful verifications for a
+    short TTL (BASIC_AUTH_CACHE), keyed by an HMAC of (email, password).
+    Each entry also records the user's auth_version, so a password, is_active
+    or staff change invalidates it even before the AppUser signal evicts it.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        digest = _credentials_digest(userid, password)
+        cached = basic_auth_cache.get(digest)
+        if cached is not None:
+            user, version = cached
+            if version == get_auth_version(user.pk):
+                return (copy.copy(user), None)
+            basic_auth_cache.delete(digest)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        basic_auth_cache.set(digest, (user, user.auth_version))
+        with _basic_digests_lock:
+            _basic_digests_by_user[user.pk].add(digest)
+        return (copy.copy(user), auth)
+
+
+async def aauthenticate(request):
+    """
+    Authenticate a plain django request for the native async views.
+    Only the stateless API schemes are supported (Token and JWT, with the same
+    caches as the classes above), anything else is anonymous.
+    Raises AuthenticationFailed for bad credentials.
+    """
+    header = get_authorization_header(request)
+    auth = header.split()
+    if not auth:
+        return AnonymousUser()
+
+    token_auth = CachedTokenAuthentication()
+    if auth[0].lower() == token_auth.keyword.lower().encode():
+        if len(auth) != 2:
+            raise AuthenticationFailed(_("Invalid token header."))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed(_("Invalid token header."))
+        user, token = await token_auth.aauthenticate_credentials(key)
+        return user
+
+    jwt_auth = VersionedJWTAuthentication()
+    raw_token = jwt_auth.get_raw_token(header)
+    if raw_token is None:
+        return AnonymousUser()
+    # Signature and claims checks are CPU only, no thread hop needed
+    validated_token = jwt_auth.get_validated_token(raw_token)
+    return await jwt_auth.aget_user(validated_token)
@@ -0,0 +1,170 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+from rest_framework.validators import UniqueValidator, qs_exists
+
+from app_users.api.caches import BloomFilter
+from app_users.models import AppUser
+from app_users.sharding import get_claimed_values, shard_querysets, sharding_enabled
+
+
+"""
+In-process membership index for the unique AppUser fields (email, username).
+A Bloom filter per field answers "definitely free" without touching the
+database, only a possible hit is confirmed with a query. Values are never
+removed, a deleted or renamed user just costs one extra query.
+The index is rebuilt in the background every REFRESH seconds to pick up rows
+written by other processes or bulk inserts that skipped the signals.
+
+"Free" is therefore only a hint: a value another process took in the last
+REFRESH seconds still reads as free here. Nothing relies on it for correctness,
+the unique constraints decide (UserUniqueValue's across the shards when users
+are sharded) and save_new_user / bulk_register report the IntegrityError of a
+lost race like the validator would have.
+Builds never run on a request, the first one is started by warm() (wsgi.py /
+asgi.py) or the first lookup, until it finishes every lookup goes to the
+database.
+"""
+
+INDEXED_FIELDS = ("email", "username")
+
+_settings = {
+    "CAPACITY": 1_000_000,
+    "ERROR_RATE": 0.001,
+    "REFRESH": 300,
+    **getattr(settings, "AVAILABILITY_INDEX", {}),
+}
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self._filters = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        # Values added while a rebuild is running, replayed onto the new filters
+        self._pending = []
+
+    def _build(self):
+        shards = shard_querysets(AppUser.objects.all())
+        count = sum(shard.count() for shard in shards)
+        capacity = max(_settings["CAPACITY"], count * 2)
+        filters = {
+            field: BloomFilter(capacity, _settings["ERROR_RATE"])
+            for field in INDEXED_FIELDS
+        }
+        for shard in shards:
+            rows = shard.values_list(*INDEXED_FIELDS).iterator(chunk_size=5000)
+            for row in rows:
+                for field, value in zip(INDEXED_FIELDS, row):
+                    filters[field].add(value)
+        return filters
+
+    def _rebuild_in_background(self):
+        def rebuild():
+            try:
+                filters = self._build()
+                with self._lock:
+                    for values in self._pending:
+                        for field, value in zip(INDEXED_FIELDS, values):
+                            filters[field].add(value)
+                    self._pending = []
+                    self._filters = filters
+                    self._built_at = time.monotonic()
+            finally:
+                self._rebuilding = False
+                connections.close_all()
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def get_filters(self):
+        """The filters, None until the first build has finished."""
+        if self._filters is None or (
+            time.monotonic() - self._built_at > _settings["REFRESH"]
+        ):
+            self._rebuild_in_background()
+        return self._filters
+
+    def warm(self):
+        # Called at startup, builds in the background so the server isn't held up
+        if self._filters is None:
+            self._rebuild_in_background()
+
+    def might_contain(self, field, value):
+        filters = self.get_filters()
+        return filters is None or value in filters[field]
+
+    def add(self, user):
+        values = [getattr(user, field) for field in INDEXED_FIELDS]
+        with self._lock:
+            if self._rebuilding:
+                self._pending.append(values)
+            if self._filters is None:
+                return  # picked up by the first build
+            for field, value in zip(INDEXED_FIELDS, values):
+                self._filters[field].add(value)
+            full = any(bloom.count > bloom.capacity for bloom in self._filters.values())
+        if full:
+            self._rebuild_in_background()
+
+    def is_taken(self, field, value):
+        """False is exact, True is confirmed against the database."""
+        if not self.might_contain(field, value):
+            return False
+        return any(
+            shard.exists()
+            for shard in shard_querysets(AppUser.objects.filter(**{field: value}))
+        )
+
+    def reset(self):
+        with self._lock:
+            self._filters = None
+
+
+availability_index = AvailabilityIndex()
+
+
+class IndexedUniqueValidator(UniqueValidator):
+    """
+    UniqueValidator that only queries when the index says the value may be taken.
+    Sharded users are looked up in their UserUniqueValue claims, which cover
+    every shard.
+    """
+
+    def __call__(self, value, serializer_field):
+        field_name = serializer_field.source_attrs[-1]
+        if field_name in INDEXED_FIELDS and not availability_index.might_contain(
+            field_name, value
+        ):
+            return
+        instance = getattr(serializer_field.parent, "instance", None)
+        if field_name in INDEXED_FIELDS and sharding_enabled():
+            if get_claimed_values(field_name, [value], getattr(instance, "pk", None)):
+                raise ValidationError(self.message, code="unique")
+            return
+        queryset = self.filter_queryset(value, self.queryset, field_name)
+        queryset = self.exclude_current_instance(queryset, instance)
+        if any(qs_exists(shard) for shard in shard_querysets(queryset)):
+            raise ValidationError(self.message, code="unique")
+
+
+def get_taken_fields(values):
+    """Indexed fields of `values` that already exist in the database."""
+    return [
+        field
+        for field in INDEXED_FIELDS
+        if field in values and _exists(field, values[field])
+    ]
+
+
+def _exists(field, value):
+    if sharding_enabled():
+        return bool(get_claimed_values(field, [value]))
+    return qs_exists(AppUser.objects.filter(**{field: value}))
@@ -0,0 +1,146 @@
+from collections import defaultdict
+
+from django.db import IntegrityError
+from django.db.models.base import ModelState
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+
+from app_users.api.availability import availability_index
+from app_users.api.hashing import hash_passwords
+from app_users.api.response_cache import invalidate_user_lists
+from app_users.api.serializers import (
+    AppUserBulkSerializers,
+    AppUserSerializers,
+    save_new_user,
+)
+from app_users.api.tokens import create_on_signup
+from app_users.models import AppUser
+from app_users.outbox import USER_CREATED, publish, user_payload
+from app_users.sharding import (
+    claim_unique_values,
+    get_claimed_values,
+    new_user_id,
+    sharding_enabled,
+    user_database,
+    user_transaction,
+)
+
+
+BULK_BATCH_SIZE = 500
+
+
+def _existing_values(field, values):
+    # Values the availability index rules out need no lookup at all
+    values = [
+        value for value in values if availability_index.might_contain(field, value)
+    ]
+    existing = set()
+    for start in range(0, len(values), BULK_BATCH_SIZE):
+        chunk = values[start : start + BULK_BATCH_SIZE]
+        if sharding_enabled():
+            # Claimed on the default database, no query per shard
+            existing.update(get_claimed_values(field, chunk))
+        else:
+            queryset = AppUser.objects.filter(**{f"{field}__in": chunk})
+            existing.update(queryset.values_list(field, flat=True))
+    return existing
+
+
+def bulk_register(items):
+    """
+    Validate, hash and insert a list of users.
+    Returns one result per item, in the same order as the input.
+    """
+    results = [None] * len(items)
+    valid = []
+
+    for index, item in enumerate(items):
+        serializer = AppUserBulkSerializers(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {
+                "index": index,
+                "success": False,
+                "errors": serializer.errors,
+            }
+
+    # Uniqueness against the table and inside the batch, a couple of queries in total
+    taken = {
+        "email": _existing_values("email", [data["email"] for _, data in valid]),
+        "username": _existing_values(
+            "username", [data["username"] for _, data in valid]
+        ),
+    }
+    accepted = []
+    for index, data in valid:
+        errors = {
+            field: [
+                f"user with this {AppUser._meta.get_field(field).verbose_name} "
+                "already exists."
+            ]
+            for field in taken
+            if data[field] in taken[field]
+        }
+        if errors:
+            results[index] = {"index": index, "success": False, "errors": errors}
+            continue
+        for field in taken:
+            taken[field].add(data[field])
+        accepted.append((index, data))
+
+    hashed = hash_passwords([data["password"] for _, data in accepted])
+    by_database = defaultdict(list)
+    for (index, data), password in zip(accepted, hashed):
+        fields = {key: value for key, value in data.items() if key != "password"}
+        user = AppUser(id=new_user_id(), password=password, **fields)
+        by_database[user_database(user.pk)].append((index, user))
+
+    # One transaction per shard, a single one without sharding
+    inserted = []
+    for using, shard_users in by_database.items():
+        users = [user for _, user in shard_users]
+        ids = [user.pk for user in users]
+        try:
+            with user_transaction(using):
+                _insert_batch(users, using)
+        except IntegrityError:
+            # A registration committed since the checks above took a value,
+            # every user is saved on its own again so that only its item fails
+            for (index, user), user_id in zip(shard_users, ids):
+                user.pk, user._state = user_id, ModelState()
+                try:
+                    inserted.append((index, save_new_user(user)))
+                except ValidationError as e:
+                    results[index] = {
+                        "index": index,
+                        "success": False,
+                        "errors": e.detail,
+                    }
+            continue
+        inserted.extend(shard_users)
+        for user in users:
+            availability_index.add(user)
+    # Nor the cache eviction of the AppUser receivers
+    invalidate_user_lists()
+
+    for index, user in inserted:
+        results[index] = {
+            "index": index,
+            "success": True,
+            "data": AppUserSerializers(user).data,
+        }
+    return results
+
+
+def _insert_batch(users, using):
+    claim_unique_values(users)
+    AppUser.objects.using(using).bulk_create(users, batch_size=BULK_BATCH_SIZE)
+    if create_on_signup():
+        # bulk_create skips post_save, so the auth tokens are created here
+        Token.objects.using(using).bulk_create(
+            [Token(key=Token.generate_key(), user=user) for user in users],
+            batch_size=BULK_BATCH_SIZE,
+        )
+    # No post_save either, the side effects are queued here as well
+    publish(USER_CREATED, [user_payload(user) for user in users], using)
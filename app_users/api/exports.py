@@ -0,0 +1,60 @@
+import csv
+from operator import itemgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from app_users.api.read_serializers import compile_read_serializer
+from app_users.api.serializers import AppUserSerializers
+from app_users.sharding import merge_streams, shard_querysets
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer, hands each written line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def get_export_fields():
+    # Same columns the API exposes, without password and other write-only ones
+    return compile_read_serializer(AppUserSerializers).names
+
+
+def iter_user_items(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Users as dicts of `fields`, formatted exactly like the API output. Sharded
+    users are streamed from every shard at once, merged back into id order.
+    """
+    read_serializer = compile_read_serializer(AppUserSerializers)
+    streams = [
+        read_serializer.values_list(shard.order_by("id")).iterator(
+            chunk_size=chunk_size
+        )
+        for shard in shard_querysets(queryset)
+    ]
+    rows = merge_streams(streams, key=itemgetter(read_serializer.sources.index("id")))
+    for item in read_serializer.iter_tuples(rows):
+        yield {name: item[name] for name in fields}
+
+
+def stream_ndjson(queryset, fields):
+    encoder = DjangoJSONEncoder()
+    for item in iter_user_items(queryset, fields):
+        yield encoder.encode(item) + "\n"
+
+
+def _csv_value(value):
+    # The JSON spelling of booleans, like the API and the NDJSON export
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def stream_csv(queryset, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for item in iter_user_items(queryset, fields):
+        yield writer.writerow([_csv_value(item[name]) for name in fields])
@@ -0,0 +1,49 @@
+from django_filters import rest_framework as filters
+from rest_framework.filters import OrderingFilter
+
+from app_users.models import AppUser
+
+
+"""
+Only filters with a matching index are exposed, see AppUser.Meta.indexes.
+The selective values (is_staff=true, is_active=false) read partial indexes that
+hold just those rows in cursor order, the common ones (is_staff=false,
+is_active=true) walk the (date_joined, id) index and match almost every row.
+QueryPlanTests in app_users/tests.py runs EXPLAIN QUERY PLAN over every
+supported filter value + ordering combination.
+"""
+
+
+class AppUserFilterSet(filters.FilterSet):
+    # ?date_joined_after=...&date_joined_before=... (ISO 8601)
+    date_joined = filters.IsoDateTimeFromToRangeFilter()
+
+    class Meta:
+        model = AppUser
+        fields = {
+            "is_staff": ["exact"],
+            "is_active": ["exact"],
+            "email": ["exact"],
+            "username": ["exact"],
+            "mobile": ["exact"],
+        }
+
+
+class UserOrderingFilter(OrderingFilter):
+    """
+    ?ordering=date_joined / -date_joined, always with id as tie-breaker so the
+    cursor position is stable and the (…, date_joined, id) indexes apply.
+    """
+
+    orderings = {
+        "date_joined": ("date_joined", "id"),
+        "-date_joined": ("-date_joined", "-id"),
+    }
+    default_ordering = "-date_joined"
+
+    def get_ordering(self, request, queryset, view):
+        param = request.query_params.get(self.ordering_param, "").strip()
+        return self.orderings.get(param, self.orderings[self.default_ordering])
+
+    def get_valid_fields(self, queryset, view, context={}):
+        return [(key, key) for key in self.orderings]
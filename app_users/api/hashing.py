@@ -0,0 +1,121 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+
+class HashingPoolSaturated(Exception):
+    pass
+
+
+def _init_worker():
+    # Workers may be spawned instead of forked, make sure django is ready
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "demo.settings")
+    import django
+
+    django.setup()
+
+
+class HashingPool:
+    """
+    Process pool for password hashing with a bounded backlog.
+    At most `workers + queue_depth` jobs are accepted at once, anything
+    beyond that is rejected with HashingPoolSaturated instead of queueing up.
+    """
+
+    def __init__(self, workers=None, queue_depth=64):
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker
+        )
+        self.workers = self.executor._max_workers
+        self.queue_depth = queue_depth
+        self._slots = threading.BoundedSemaphore(self.workers + queue_depth)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, block=False):
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self.rejected += 1
+            raise HashingPoolSaturated("Password hashing pool is saturated")
+
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+            if future is not None:
+                self.completed += 1
+        self._slots.release()
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def metrics(self):
+        with self._lock:
+            capacity = self.workers + self.queue_depth
+            return {
+                "workers": self.workers,
+                "queueDepth": self.queue_depth,
+                "inFlight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "peakInFlight": self.peak_in_flight,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "saturation": round(self.in_flight / capacity, 3),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashingPool(
+                workers=getattr(settings, "PASSWORD_HASHING_WORKERS", None),
+                queue_depth=getattr(settings, "PASSWORD_HASHING_QUEUE_DEPTH", 64),
+            )
+    return _pool
+
+
+def hash_passwords(passwords):
+    """
+    Hash a list of raw passwords on the process pool, keeping order.
+    Bulk callers wait for free slots instead of being rejected.
+    """
+    if len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    pool = get_hashing_pool()
+    futures = [
+        pool.submit(make_password, password, block=True) for password in passwords
+    ]
+    return [future.result() for future in futures]
+
+
+async def amake_password(password):
+    return await get_hashing_pool().run(make_password, password)
+
+
+async def acheck_password(password, encoded):
+    return await get_hashing_pool().run(check_password, password, encoded)
@@ -0,0 +1,136 @@
+from itertools import islice
+
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+from rest_framework.response import Response
+
+from app_users.sharding import merge_streams, shard_querysets
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the (date_joined, id) index.
+    Never runs COUNT(*) and every page is a single index range scan,
+    so latency stays flat no matter how deep the client pages.
+
+    paginate_queryset is split up so the async views can fetch the page
+    with async iteration: get_page_querysets() builds the sliced querysets
+    without touching the database, merge_pages() and set_page() take the
+    fetched rows. With sharded users there is one queryset per shard and the
+    page is merged from their already ordered rows.
+    """
+
+    ordering = ("-date_joined", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        querysets = self.get_page_querysets(queryset, request, view)
+        if querysets is None:
+            return None
+        return self.set_page(self.merge_pages([list(page) for page in querysets]))
+
+    def get_page_querysets(self, queryset, request, view=None):
+        # Same steps as CursorPagination.paginate_queryset up to the fetch
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+        self._page_state = (offset, reverse, current_position)
+
+        if reverse:
+            self._query_ordering = _reverse_ordering(self.ordering)
+        else:
+            self._query_ordering = self.ordering
+        queryset = queryset.order_by(*self._query_ordering)
+
+        if str(current_position) != "None":
+            order = self.ordering[0]
+            is_reversed = order.startswith("-")
+            order_attr = order.lstrip("-")
+
+            if self.cursor.reverse != is_reversed:
+                kwargs = {order_attr + "__lt": current_position}
+            else:
+                kwargs = {order_attr + "__gt": current_position}
+
+            filter_query = Q(**kwargs)
+            if (reverse and not is_reversed) or is_reversed:
+                filter_query |= Q(**{order_attr + "__isnull": True})
+            queryset = queryset.filter(filter_query)
+
+        # One extra row tells whether there is a following page
+        shards = shard_querysets(queryset)
+        if len(shards) == 1:
+            return [queryset[offset : offset + self.page_size + 1]]
+        # Any shard may hold the whole page, each one is read from the position
+        return [shard[: offset + self.page_size + 1] for shard in shards]
+
+    def merge_pages(self, pages):
+        if len(pages) == 1:
+            return pages[0]
+        offset = self._page_state[0]
+        fields = [field.lstrip("-") for field in self._query_ordering]
+        rows = merge_streams(
+            pages,
+            key=lambda row: tuple(row[field] for field in fields),
+            reverse=self._query_ordering[0].startswith("-"),
+        )
+        return list(islice(rows, offset, offset + self.page_size + 1))
+
+    def set_page(self, results):
+        offset, reverse, current_position = self._page_state
+        self.page = list(results[: self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_paginated_data(self, data):
+        return {
+            "success": True,
+            "data": data,
+            "message": "Users Fetched Successfully",
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data), status=status.HTTP_200_OK)
@@ -0,0 +1,121 @@
+from functools import lru_cache
+
+from rest_framework import ISO_8601, fields as drf_fields
+from rest_framework.settings import api_settings
+
+
+"""
+Read-only fast path for many=True output.
+The column plan is derived once from a ModelSerializer's fields (write-only and
+excluded fields are already gone there) and rows come straight from
+.values() / .values_list(), skipping DRF's per-field machinery per row.
+The output matches `SerializerClass(queryset, many=True).data` exactly.
+"""
+
+# Fields whose to_representation is the identity for values read from the DB
+_PASSTHROUGH_FIELDS = (
+    drf_fields.IntegerField,
+    drf_fields.CharField,
+    drf_fields.BooleanField,
+)
+
+
+def _make_datetime_formatter(field):
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+
+    field_timezone = (
+        field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    )
+    if field_timezone is None:
+        return field.to_representation
+
+    def format_datetime(value):
+        # DateTimeField.to_representation for ISO 8601 with the timezone resolved once
+        if value.tzinfo is None:
+            value = field.enforce_timezone(value)
+        elif value.tzinfo is not field_timezone:
+            value = value.astimezone(field_timezone)
+        value = value.isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+
+    return format_datetime
+
+
+def _make_converter(field):
+    if isinstance(field, drf_fields.DateTimeField):
+        return _make_datetime_formatter(field)
+    if isinstance(field, _PASSTHROUGH_FIELDS):
+        return None
+    return field.to_representation
+
+
+class CompiledReadSerializer:
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        self.names = []
+        self.sources = []
+        self.fields = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if field.source == "*" or "." in field.source:
+                raise ValueError(f"Field {name!r} can't be read from a single column")
+            self.names.append(name)
+            self.sources.append(field.source)
+            self.fields.append(field)
+
+    def get_converters(self):
+        # Built per call, the active timezone can differ between requests
+        return [_make_converter(field) for field in self.fields]
+
+    def values(self, queryset, extra=()):
+        # extra columns (e.g. the cursor ordering) are fetched but not serialized
+        return queryset.values(*dict.fromkeys([*self.sources, *extra]))
+
+    def values_list(self, queryset):
+        return queryset.values_list(*self.sources)
+
+    def serialize_rows(self, rows):
+        """Rows are dicts from .values()"""
+        plan = list(zip(self.names, self.sources, self.get_converters()))
+        output = []
+        for row in rows:
+            item = {}
+            for name, source, convert in plan:
+                value = row[source]
+                item[name] = (
+                    value if convert is None or value is None else convert(value)
+                )
+            output.append(item)
+        return output
+
+    def iter_tuples(self, rows):
+        """Rows are tuples from .values_list(), yields one dict per row"""
+        names = self.names
+        conversions = [
+            (index, convert)
+            for index, convert in enumerate(self.get_converters())
+            if convert is not None
+        ]
+        for row in rows:
+            if conversions:
+                row = list(row)
+                for index, convert in conversions:
+                    if row[index] is not None:
+                        row[index] = convert(row[index])
+            yield dict(zip(names, row))
+
+    def serialize_tuples(self, rows):
+        return list(self.iter_tuples(rows))
+
+    def serialize_queryset(self, queryset):
+        return self.serialize_tuples(self.values_list(queryset).iterator())
+
+
+@lru_cache(maxsize=None)
+def compile_read_serializer(serializer_class):
+    return CompiledReadSerializer(serializer_class)
@@ -0,0 +1,100 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+"""
+Faster drop-in renderers for the API.
+orjson / msgpack are optional, without them the renderers fall back to DRF's
+stdlib json path (FastJSONRenderer) or are left out of the settings (msgpack).
+"""
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    # Decimals, lazy strings, UUIDs... anything orjson / msgpack can't do natively
+    return _encoder.default(obj)
+
+
+def to_columnar(data):
+    """
+    {"data": [{...}, {...}]} -> {"data": {"header": [...], "rows": [[...], [...]]}}
+    Only list payloads whose rows all share the same keys are converted.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("data"), list):
+        return data
+    rows = data["data"]
+    if not rows or not all(isinstance(row, dict) for row in rows):
+        return data
+    header = list(rows[0])
+    if any(len(row) != len(header) or list(row) != header for row in rows):
+        return data
+    return {
+        **data,
+        "data": {"header": header, "rows": [list(row.values()) for row in rows]},
+    }
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson, same bytes as DRF's compact output.
+    Pretty printing (`; indent=N`, browsable API) still goes through DRF.
+    """
+
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=_default, option=self.options)
+        # Same strict javascript subset escaping as JSONRenderer
+        if b"\xe2\x80" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+                b"\xe2\x80\xa9", b"\\u2029"
+            )
+        return ret
+
+
+class ColumnarJSONRenderer(FastJSONRenderer):
+    """
+    Header + rows layout for list payloads, requested with
+    `Accept: application/vnd.columnar+json` or `?format=columnar`.
+    """
+
+    media_type = "application/vnd.columnar+json"
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(to_columnar(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Compact binary output, requested with `Accept: application/msgpack`.
+    Needs the optional `msgpack` package.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=_default, datetime=False)
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import parse_etags
+
+from app_users.models import AppUser
+
+
+"""
+Rendered-data cache behind UserViewSet.retrieve / list with strong ETags.
+Entries live in a django cache (USER_RESPONSE_CACHE["CACHE"]) so a shared backend
+keeps workers consistent, and the AppUser signals evict them on every change.
+Writes that send no signals (bulk_create, QuerySet.update()) evict them with
+invalidate_user / invalidate_user_lists themselves.
+"""
+
+_settings = {
+    "CACHE": "default",
+    "TTL": 300,
+    **getattr(settings, "USER_RESPONSE_CACHE", {}),
+}
+LIST_GENERATION_KEY = "user-list:generation"
+
+
+def _cache():
+    return caches[_settings["CACHE"]]
+
+
+def make_etag(data):
+    payload = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    return '"%s"' % hashlib.sha256(payload).hexdigest()[:32]
+
+
+def representation_etag(request, etag):
+    # Each renderer produces different bytes, so the format is part of the tag
+    renderer = getattr(request, "accepted_renderer", None)
+    if renderer is None or renderer.format == "json":
+        return etag
+    return f'{etag[:-1]}-{renderer.format}"'
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag in etags
+
+
+def get_cached_user(pk):
+    """
+    (etag, instance, data) or None. Only the rendered data is cached, the
+    instance is an unsaved AppUser with just its pk, which is all the owner
+    check compares.
+    """
+    cached = _cache().get(f"user-detail:{pk}")
+    if cached is None:
+        return None
+    etag, user_pk, data = cached
+    return etag, AppUser(pk=user_pk), data
+
+
+def cache_user(instance, data):
+    etag = make_etag(data)
+    _cache().set(
+        f"user-detail:{instance.pk}", (etag, instance.pk, data), _settings["TTL"]
+    )
+    return etag
+
+
+def _list_key(request):
+    generation = _cache().get_or_set(LIST_GENERATION_KEY, uuid.uuid4().hex, None)
+    uri = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+    return f"user-list:{generation}:{uri}"
+
+
+def get_cached_list(request):
+    # (etag, payload) or None
+    return _cache().get(_list_key(request))
+
+
+def cache_list(request, payload):
+    etag = make_etag(payload)
+    _cache().set(_list_key(request), (etag, payload), _settings["TTL"])
+    return etag
+
+
+def invalidate_user(pk):
+    _cache().delete(f"user-detail:{pk}")
+    invalidate_user_lists()
+
+
+def invalidate_user_lists():
+    """
+    Every cached list page goes stale at once, old entries just expire.
+    Called on its own by writes that send no AppUser signals, e.g. bulk_create.
+    """
+    _cache().set(LIST_GENERATION_KEY, uuid.uuid4().hex, None)
@@ -0,0 +1,190 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    DatabaseError,
+    IntegrityError,
+    close_old_connections,
+    transaction,
+)
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from app_users.api.caches import BackgroundThread, BloomFilter, LRUCache
+from app_users.models import RevokedToken
+
+
+"""
+Revoked JWTs (RevokedToken rows, one per jti) checked without a query on the
+common path. Every process keeps a Bloom filter of the revoked jtis: a jti it
+doesn't contain is certainly not revoked, the rare hits (revoked tokens and
+about ERROR_RATE of the others) are confirmed in the database.
+A background thread adds the rows other processes revoked every SYNC_INTERVAL
+seconds, so a revocation takes at most that long to reach every process.
+Rows are found by revoked_at rather than by id, ids don't follow commit order
+on every database. Each sync re-reads the last SYNC_OVERLAP seconds, a row
+committed later than that after its revoked_at (slow transaction, clock skew
+between hosts) would be missed until the next rebuild.
+Filters can't forget, it is rebuilt without the expired rows every
+REBUILD_INTERVAL seconds, sooner when more than CAPACITY jtis are revoked.
+Until the first load the database answers for the filter.
+"""
+
+logger = logging.getLogger(__name__)
+
+_settings = {
+    "CAPACITY": 100000,
+    "ERROR_RATE": 0.001,
+    "SYNC_INTERVAL": 5,
+    "SYNC_OVERLAP": 60,
+    "REBUILD_INTERVAL": 3600,
+    **getattr(settings, "JWT_REVOCATION", {}),
+}
+
+
+class RevocationFilter:
+    """The per-process filter of the RevokedToken rows and its sync thread."""
+
+    def __init__(
+        self, capacity, error_rate, sync_interval, sync_overlap, rebuild_interval
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self.rebuild_interval = rebuild_interval
+        self._filter = None
+        self._synced_at = None
+        # jti -> revoked_at of the rows the next sync reads again, added once
+        self._recent = {}
+        self._rebuilt_at = 0
+        self._syncer = BackgroundThread(self._run, name="jwt-revocation")
+
+    def might_contain(self, jti):
+        self._syncer.ensure_started()
+        bloom = self._filter
+        return bloom is None or jti in bloom
+
+    def add(self, jti):
+        bloom = self._filter
+        if bloom is not None:
+            bloom.add(jti)
+
+    def _run(self):
+        while True:
+            close_old_connections()
+            try:
+                self.sync()
+            except DatabaseError:
+                logger.warning("Revoked JWTs sync failed, retrying", exc_info=True)
+            time.sleep(self.sync_interval)
+
+    def sync(self):
+        bloom = self._filter
+        if (
+            bloom is None
+            or bloom.count > bloom.capacity
+            or time.monotonic() - self._rebuilt_at > self.rebuild_interval
+        ):
+            self.rebuild()
+        self._add_new_rows()
+
+    def rebuild(self):
+        # Taken first, rows committed meanwhile come with the next _add_new_rows
+        synced_at = timezone.now()
+        rows = (
+            RevokedToken.objects.using(DEFAULT_DB_ALIAS)
+            .filter(expires_at__gt=synced_at)
+            .values_list("jti", "revoked_at")
+        )
+        bloom = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+        recent = {}
+        for jti, revoked_at in rows:
+            bloom.add(jti)
+            if revoked_at >= synced_at - self.sync_overlap:
+                recent[jti] = revoked_at
+        self._filter, self._synced_at, self._recent = bloom, synced_at, recent
+        self._rebuilt_at = time.monotonic()
+
+    def _add_new_rows(self):
+        synced_at = timezone.now()
+        rows = (
+            RevokedToken.objects.using(DEFAULT_DB_ALIAS)
+            .filter(revoked_at__gte=self._synced_at - self.sync_overlap)
+            .values_list("jti", "revoked_at")
+        )
+        for jti, revoked_at in rows:
+            if jti not in self._recent:
+                self._filter.add(jti)
+                self._recent[jti] = revoked_at
+        # The next sync starts from here, older rows won't come back
+        since = synced_at - self.sync_overlap
+        self._recent = {
+            jti: revoked_at
+            for jti, revoked_at in self._recent.items()
+            if revoked_at >= since
+        }
+        self._synced_at = synced_at
+
+
+revoked_jtis = RevocationFilter(
+    capacity=_settings["CAPACITY"],
+    error_rate=_settings["ERROR_RATE"],
+    sync_interval=_settings["SYNC_INTERVAL"],
+    sync_overlap=_settings["SYNC_OVERLAP"],
+    rebuild_interval=_settings["REBUILD_INTERVAL"],
+)
+
+# jti -> True once the database confirmed it, replayed revoked tokens skip it
+_confirmed = LRUCache(maxsize=10000, ttl=_settings["REBUILD_INTERVAL"])
+
+
+def _revoked_rows(jti):
+    return RevokedToken.objects.using(DEFAULT_DB_ALIAS).filter(
+        jti=jti, expires_at__gt=timezone.now()
+    )
+
+
+def get_jti(token):
+    return token.get(jwt_settings.JTI_CLAIM)
+
+
+def is_revoked(jti):
+    if jti is None or not revoked_jtis.might_contain(jti):
+        return False
+    if _confirmed.get(jti) or _revoked_rows(jti).exists():
+        _confirmed.set(jti, True)
+        return True
+    return False
+
+
+async def ais_revoked(jti):
+    if jti is None or not revoked_jtis.might_contain(jti):
+        return False
+    if _confirmed.get(jti) or await _revoked_rows(jti).aexists():
+        _confirmed.set(jti, True)
+        return True
+    return False
+
+
+def revoke(token):
+    """
+    Revoke the validated `token` everywhere, returns False when it already
+    was. Only one of concurrent callers revoking the same token gets True,
+    which makes refresh tokens single use.
+    """
+    jti = get_jti(token)
+    try:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            RevokedToken.objects.using(DEFAULT_DB_ALIAS).create(
+                jti=jti, expires_at=datetime_from_epoch(token["exp"])
+            )
+    except IntegrityError:
+        return False
+    revoked_jtis.add(jti)
+    _confirmed.set(jti, True)
+    return True
@@ -0,0 +1,84 @@
+from itertools import islice
+from operator import itemgetter
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from app_users.models import AppUser
+from app_users.sharding import get_user_databases, merge_streams
+
+
+"""
+Substring search over email, username, first / last name and mobile.
+On SQLite it reads the FTS5 trigram index app_users_appuser_fts (migration 0005),
+other backends fall back to icontains.
+"""
+
+SEARCH_FIELDS = ("email", "username", "first_name", "last_name", "mobile")
+MIN_TERM_LENGTH = 3  # shortest term a trigram can match
+
+
+def get_search_terms(query):
+    return [term for term in query.split() if len(term) >= MIN_TERM_LENGTH]
+
+
+def _match_expression(terms):
+    # Every term must match somewhere, each one quoted as an FTS5 string
+    return " ".join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+def use_fts(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == "sqlite"
+
+
+def filter_by_search(queryset, terms, using=DEFAULT_DB_ALIAS):
+    """
+    Unranked filter, used by the admin changelist.
+    """
+    if use_fts(using):
+        return queryset.filter(
+            pk__in=RawSQL(
+                "SELECT rowid FROM app_users_appuser_fts "
+                "WHERE app_users_appuser_fts MATCH %s",
+                [_match_expression(terms)],
+            )
+        )
+    for term in terms:
+        condition = Q()
+        for field in SEARCH_FIELDS:
+            condition |= Q(**{f"{field}__icontains": term})
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def _ranked_rows(terms, limit, offset, using):
+    # (sort key, id) pairs of one database, best first
+    if not use_fts(using):
+        queryset = filter_by_search(AppUser.objects.using(using), terms, using)
+        return list(
+            queryset.order_by("-date_joined", "-id").values_list("date_joined", "id")[
+                offset : offset + limit
+            ]
+        )
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT rank, rowid FROM app_users_appuser_fts "
+            "WHERE app_users_appuser_fts MATCH %s ORDER BY rank LIMIT %s OFFSET %s",
+            [_match_expression(terms), limit, offset],
+        )
+        return cursor.fetchall()
+
+
+def ranked_user_ids(terms, limit, offset=0):
+    """
+    Ids of matching users, best bm25 rank first.
+    Sharded users are ranked per shard and the top rows merged.
+    """
+    databases = get_user_databases()
+    if len(databases) == 1:
+        rows = _ranked_rows(terms, limit, offset, databases[0])
+        return [row[1] for row in rows]
+    pages = [_ranked_rows(terms, offset + limit, 0, using) for using in databases]
+    rows = merge_streams(pages, key=itemgetter(0), reverse=not use_fts(databases[0]))
+    return [row[1] for row in islice(rows, offset, offset + limit)]
@@ -1,12 +1,123 @@
-from rest_framework.serializers import ModelSerializer
+from functools import lru_cache
+
+from django.db import IntegrityError, router
+from django.db.models.base import ModelState
+from django.db.models.signals import post_save
+from rest_framework.authtoken.models import Token
+from rest_framework.serializers import ModelSerializer, ValidationError
+from rest_framework.utils.field_mapping import get_unique_error_message
+from rest_framework.validators import UniqueValidator
+from app_users.api.availability import IndexedUniqueValidator, get_taken_fields
 from app_users.models import AppUser
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from app_users.sharding import (
+    claim_unique_values,
+    new_user_id,
+    user_database,
+    user_transaction,
+)
+from app_users.api.write_behind import update_last_login
+from app_users.api.tokens import create_on_signup
+from app_users.api.writer import get_writer, use_writer
+from app_users.api.revocation import get_jti, is_revoked, revoke
+from app_users.api.authentication import aget_auth_version, get_auth_version
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenObtainSerializer,
+    TokenRefreshSerializer,
+    TokenVerifySerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+
+
+def save_new_user(user):
+    """
+    INSERT a new user. The uniqueness checks skip the DB when the availability
+    index says a value is free, so a row written meanwhile by another process
+    surfaces here as an IntegrityError and is reported like the validator would.
+    Sharded users get it from their UserUniqueValue claims on the default
+    database, their shard alone can't see the other shards' rows.
+    On SQLite the INSERTs are group committed by the database's single writer.
+    """
+    if user.pk is None:
+        user.pk = new_user_id()  # None without sharding
+    using = user_database(user.pk)
+    if use_writer(using):
+        return get_writer(using).run(_insert_users, user)
+    return _insert_user(user, using)
+
+
+def _insert_users(jobs):
+    """
+    Registrations group committed by the single writer, a multi-row INSERT for
+    the users and one for their tokens (eager tokens only). When one of them
+    lost a uniqueness race every user is saved on its own again, so that only
+    this one fails.
+    """
+    users = [user for _, user in jobs]
+    using = user_database(users[0].pk)
+    ids = [user.pk for user in users]
+    try:
+        with user_transaction(using):
+            claim_unique_values(users)
+            AppUser.objects.using(using).bulk_create(users)
+            if create_on_signup():
+                Token.objects.using(using).bulk_create(
+                    [Token(key=Token.generate_key(), user=user) for user in users]
+                )
+    except IntegrityError:
+        results = []
+        for (context, user), user_id in zip(jobs, ids):
+            # Unsaved again, without the token cached by the rolled back INSERT
+            user.pk, user._state = user_id, ModelState()
+            try:
+                results.append(context.run(_insert_user, user, using))
+            except Exception as e:
+                results.append(e)
+        return results
+    for context, user in jobs:
+        context.run(_send_created, user, using)
+    return users
+
+
+def _send_created(user, using):
+    # What save() does around the INSERT that bulk_create skips. The receivers
+    # see the token already cached on the user, create_auth_token skips it.
+    router.db_for_write(AppUser, instance=user)
+    user._loaded_auth_state = user._get_auth_state()
+    post_save.send(
+        sender=AppUser,
+        instance=user,
+        created=True,
+        update_fields=None,
+        raw=False,
+        using=using,
+    )
+
+
+def _insert_user(user, using):
+    try:
+        with user_transaction(using):
+            user.save(force_insert=True)
+    except IntegrityError:
+        taken = get_taken_fields(
+            {field: getattr(user, field) for field in ("email", "username")}
+        )
+        if not taken:
+            raise
+        raise ValidationError(
+            {
+                field: [get_unique_error_message(AppUser._meta.get_field(field))]
+                for field in taken
+            }
+        )
+    return user
 
 
 class AppUserSerializers(ModelSerializer):
     class Meta:
         model = AppUser
-        exclude = ["user_permissions", "groups"]
+        exclude = ["user_permissions", "groups", "auth_version"]
         extra_kwargs = {
             "password": {"write_only": True},
             "is_superuser": {"read_only": True},
@@ -15,12 +126,26 @@ class AppUserSerializers(ModelSerializer):
             "date_joined": {"read_only": True},
         }
 
-    def create(self, validated_data, **kwargs):
+    def build_standard_field(self, field_name, model_field):
+        # Unique fields are checked through the availability index first
+        field_class, field_kwargs = super().build_standard_field(
+            field_name, model_field
+        )
+        field_kwargs["validators"] = [
+            (
+                IndexedUniqueValidator(validator.queryset, validator.message)
+                if type(validator) is UniqueValidator
+                else validator
+            )
+            for validator in field_kwargs.get("validators", [])
+        ]
+        return field_class, field_kwargs
+
+    def create(self, validated_data):
         password = validated_data.pop("password")  # Remove password from validated_data
-        user = AppUser.objects.create(**validated_data)
-        user.set_password(password)  # Set the password separately
-        user.save(**kwargs)
-        return user
+        user = AppUser(**validated_data)
+        user.set_password(password)  # Hash before the first save, single INSERT
+        return save_new_user(user)
 
     def update(self, instance, validated_data):
         password = validated_data.pop("password", None)
@@ -32,6 +157,16 @@ class AppUserSerializers(ModelSerializer):
         return instance
 
 
+@lru_cache(maxsize=256)
+def get_fieldset_serializer(serializer_class, fields):
+    """
+    Subclass of serializer_class limited to `fields` (a tuple), built once per
+    field set. Used by the ?fields= / ?exclude= sparse fieldsets.
+    """
+    meta = type("Meta", (serializer_class.Meta,), {"fields": fields, "exclude": None})
+    return type(serializer_class.__name__, (serializer_class,), {"Meta": meta})
+
+
 # This will add other info into token payload
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
@@ -41,4 +176,95 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         token["username"] = user.username
         # token["firstname"] = user.first_name
         token["isAdmin"] = user.is_superuser
+        token["isStaff"] = user.is_staff
+        token["ver"] = user.auth_version
         return token
+
+    @classmethod
+    def get_token_pair(cls, user, record_login=True):
+        # Mint the pair for an already authenticated user, no password check.
+        # Registrations pass record_login=False, last_login is in their INSERT.
+        refresh = cls.get_token(user)
+        if record_login and api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
+        return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+    def validate(self, attrs):
+        # TokenObtainPairSerializer.validate, with the buffered last_login update
+        data = TokenObtainSerializer.validate(self, attrs)
+        data.update(self.get_token_pair(self.user))
+        return data
+
+
+def is_current_version(token):
+    """
+    Whether the "ver" claim of `token` is still its user's auth_version, the
+    rule of VersionedJWTAuthentication.check_version. Tokens minted before the
+    claim existed have nothing to compare.
+    """
+    if "ver" not in token:
+        return True
+    return token["ver"] == get_auth_version(token[api_settings.USER_ID_CLAIM])
+
+
+async def ais_current_version(token):
+    if "ver" not in token:
+        return True
+    return token["ver"] == await aget_auth_version(token[api_settings.USER_ID_CLAIM])
+
+
+class RotatingTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    TokenRefreshSerializer rejecting revoked refresh tokens and the ones of an
+    older auth_version. With ROTATE_REFRESH_TOKENS each one is single use,
+    refreshing revokes it (app_users.api.revocation) instead of the simplejwt
+    blacklist app.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        if is_revoked(get_jti(refresh)):
+            raise ValidationError("Token is blacklisted")
+        if not is_current_version(refresh):
+            raise ValidationError("Token is no longer valid for this user")
+
+        data = {"access": str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            # Two requests racing with the same token, only one gets a new pair
+            if not revoke(refresh):
+                raise ValidationError("Token is blacklisted")
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+        return data
+
+
+class RevocableTokenVerifySerializer(TokenVerifySerializer):
+    """
+    TokenVerifySerializer rejecting revoked tokens (app_users.api.revocation)
+    and the ones of an older auth_version, like VersionedJWTAuthentication.
+    """
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs["token"])
+        if is_revoked(get_jti(token)):
+            raise ValidationError("Token is blacklisted")
+        if not is_current_version(token):
+            raise ValidationError("Token is no longer valid for this user")
+        return {}
+
+
+# Uniqueness is checked for the whole batch at once in bulk_register
+class AppUserBulkSerializers(AppUserSerializers):
+    def build_standard_field(self, field_name, model_field):
+        # Keep the other field validators (e.g. the username characters)
+        field_class, field_kwargs = super().build_standard_field(
+            field_name, model_field
+        )
+        field_kwargs["validators"] = [
+            validator
+            for validator in field_kwargs["validators"]
+            if not isinstance(validator, UniqueValidator)
+        ]
+        return field_class, field_kwargs
@@ -1,10 +1,88 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
+from app_users.api.authentication import (
+    forget_auth_version,
+    invalidate_basic_credentials,
+    invalidate_token,
+    invalidate_user_tokens,
+    set_auth_version,
+)
+from app_users.api.availability import availability_index
+from app_users.api.response_cache import invalidate_user
+from app_users.api.tokens import create_on_signup
+from app_users.outbox import USER_CREATED, publish, user_payload
+from app_users.routers import note_user_write
+from app_users.sharding import release_unique_values
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_auth_token(sender, instance=None, created=False, using=None, **kwargs):
+    if not created or not create_on_signup():
+        return  # lazy tokens come from the first CustomAuthToken login
+    # Registrations group committed by the single writer come with their token
+    if Token.user.field.remote_field.get_cached_value(instance, None) is None:
+        # Same database as the user, its shard when users are sharded
+        Token.objects.using(using).create(user=instance)
+
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
-def create_auth_token(sender, instance=None, created=False, **kwargs):
+def publish_user_created(sender, instance=None, created=False, using=None, **kwargs):
+    # Inside the registration transaction, see save_new_user and app_users.outbox
     if created:
-        Token.objects.create(user=instance)
+        publish(USER_CREATED, [user_payload(instance)], using)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def evict_cached_token(sender, instance=None, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def evict_cached_user_tokens(sender, instance=None, created=False, **kwargs):
+    if not created:
+        invalidate_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def refresh_auth_version(sender, instance=None, **kwargs):
+    set_auth_version(instance)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def drop_auth_version(sender, instance=None, **kwargs):
+    forget_auth_version(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def evict_cached_basic_credentials(sender, instance=None, created=False, **kwargs):
+    if not created:
+        invalidate_basic_credentials(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def evict_cached_user_response(sender, instance=None, **kwargs):
+    invalidate_user(instance.pk)
+
+
+# Deleted users stay in the index, see app_users/api/availability.py
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_user_availability(sender, instance=None, **kwargs):
+    availability_index.add(instance)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def release_user_unique_values(sender, instance=None, using=None, **kwargs):
+    # Not for the copies rebalance_user_shards deletes, the user lives on
+    release_unique_values(instance.pk, using)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def stick_user_to_primary(sender, instance=None, **kwargs):
+    note_user_write(instance.pk)
@@ -0,0 +1,71 @@
+import atexit
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from app_users.api.caches import LRUCache
+from app_users.api.write_behind import UpsertBuffer
+from app_users.models import TokenUse
+from app_users.sharding import for_user_shard, user_database
+
+
+"""
+DRF auth tokens (rest_framework.authtoken) only for the users that use them,
+most clients only ever use JWTs. With CREATE "lazy" a user gets a token from
+its first CustomAuthToken login instead of at signup, "eager" keeps the
+post_save receiver creating one for every new user.
+When a token authenticates a request is kept in TokenUse, written behind at
+most once per USE_RESOLUTION seconds and user, so `manage.py prune_auth_tokens`
+can delete the tokens nobody used for PRUNE_AFTER_DAYS.
+"""
+
+_settings = {
+    "CREATE": "lazy",
+    "USE_RESOLUTION": 3600,
+    "FLUSH_INTERVAL": 5,
+    "PRUNE_AFTER_DAYS": 30,
+    **getattr(settings, "AUTH_TOKENS", {}),
+}
+
+
+def create_on_signup():
+    return _settings["CREATE"] == "eager"
+
+
+def get_prune_after():
+    return timedelta(days=_settings["PRUNE_AFTER_DAYS"])
+
+
+def get_or_create_token(user):
+    token, created = for_user_shard(Token.objects.all(), user.pk).get_or_create(
+        user=user
+    )
+    return token
+
+
+async def aget_or_create_token(user):
+    token, created = await for_user_shard(Token.objects.all(), user.pk).aget_or_create(
+        user=user
+    )
+    return token
+
+
+token_use_buffer = UpsertBuffer(
+    TokenUse,
+    interval=_settings["FLUSH_INTERVAL"],
+    max_pending=1000,
+    batch_size=500,
+    get_database=user_database,
+)
+atexit.register(token_use_buffer.flush)
+
+# user id -> True while its last recorded use is recent enough
+_recent_uses = LRUCache(maxsize=100000, ttl=_settings["USE_RESOLUTION"])
+
+
+def record_token_use(user_id):
+    if _recent_uses.get(user_id) is None:
+        _recent_uses.set(user_id, True)
+        token_use_buffer.set(user_id, last_used=timezone.now())
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from app_users.api.views import (
@@ -6,23 +7,86 @@ from app_users.api.views import (
     CustomJWTPairToken,
     CustomJWTPairRefresh,
     CustomJWTTokenVerify,
+    HashingPoolMetrics,
+)
+from app_users.api.async_views import (
+    AsyncUserDetail,
+    AsyncUserList,
+    async_auth_token,
+    async_jwt_pair_token,
+    async_jwt_refresh_token,
+    async_jwt_verify_token,
 )
 
 router = DefaultRouter(trailing_slash=False)
 router.register(r"users", UserViewSet, basename="users")
 
+# Route names listed in ASYNC_ROUTES are served by the native async view
+ASYNC_ROUTES = set(getattr(settings, "ASYNC_ROUTES", ()))
+
+
+def select_path(route, view, async_view, name):
+    if name in ASYNC_ROUTES:
+        return path(route, async_view, name=name)
+    return path(route, view, name=name)
+
+
+# Stand-ins for the UserViewSet list / detail routes of the router
+async_user_paths = [
+    path("users", AsyncUserList.as_view(), name="users-list"),
+    path("users/<int:pk>", AsyncUserDetail.as_view(), name="users-detail"),
+]
+
 urlpatterns = [
-    path("", include(router.urls)),
-    path("api-token-auth/", CustomAuthToken.as_view(), name="api_token_auth"),
-    path("api/token/", CustomJWTPairToken.as_view(), name="token_obtain_pair"),
+    *[pattern for pattern in async_user_paths if pattern.name in ASYNC_ROUTES],
     path(
+        "",
+        include(
+            [pattern for pattern in router.urls if pattern.name not in ASYNC_ROUTES]
+        ),
+    ),
+    select_path(
+        "api-token-auth/",
+        CustomAuthToken.as_view(),
+        async_auth_token,
+        name="api_token_auth",
+    ),
+    select_path(
+        "api/token/",
+        CustomJWTPairToken.as_view(),
+        async_jwt_pair_token,
+        name="token_obtain_pair",
+    ),
+    select_path(
         "api/token/refresh/",
         CustomJWTPairRefresh.as_view(),
+        async_jwt_refresh_token,
         name="token_refresh",
     ),
-    path(
+    select_path(
         "api/token/verify/",
         CustomJWTTokenVerify.as_view(),
+        async_jwt_verify_token,
         name="token_verify",
     ),
+    # Async variants are always reachable here (serve with demo/asgi.py)
+    path("async/users", AsyncUserList.as_view(), name="async_users"),
+    path("async/users/<int:pk>", AsyncUserDetail.as_view(), name="async_users_detail"),
+    path("async/api-token-auth/", async_auth_token, name="async_api_token_auth"),
+    path("async/api/token/", async_jwt_pair_token, name="async_token_obtain_pair"),
+    path(
+        "async/api/token/refresh/",
+        async_jwt_refresh_token,
+        name="async_token_refresh",
+    ),
+    path(
+        "async/api/token/verify/",
+        async_jwt_verify_token,
+        name="async_token_verify",
+    ),
+    path(
+        "api/hashing-pool/metrics/",
+        HashingPoolMetrics.as_view(),
+        name="hashing_pool_metrics",
+    ),
 ]
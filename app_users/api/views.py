@@ -1,10 +1,14 @@
-from django.contrib.auth import authenticate
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 
 # From drf and drf-jwt
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, NotFound, ValidationError
 from rest_framework.response import Response
-from rest_framework.authtoken.models import Token
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.authtoken.views import ObtainAuthToken
@@ -13,20 +17,44 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView,
 )
-from rest_framework_simplejwt.serializers import (
-    TokenRefreshSerializer,
-    TokenVerifySerializer,
-)
+from rest_framework_simplejwt.exceptions import TokenError
 
 # From system app
 from app_users.models import AppUser
 from app_users.api import (
     signals,
 )  # This one is intentionlly imported to trigger signals
+from app_users.api.availability import INDEXED_FIELDS, availability_index
+from app_users.api.bulk import bulk_register
+from app_users.api.exports import get_export_fields, stream_csv, stream_ndjson
+from app_users.api.filters import AppUserFilterSet, UserOrderingFilter
+from app_users.api.hashing import get_hashing_pool
+from app_users.api.pagination import UserCursorPagination
 from app_users.api.permissions import CustomIsOwnerOrIsAdmin
+from app_users.api.read_serializers import compile_read_serializer
+from app_users.api.response_cache import (
+    cache_list,
+    cache_user,
+    etag_matches,
+    get_cached_list,
+    get_cached_user,
+    make_etag,
+    representation_etag,
+)
+from app_users.api.search import get_search_terms, ranked_user_ids
 from app_users.api.serializers import (
     AppUserSerializers,
     CustomTokenObtainPairSerializer,
+    RevocableTokenVerifySerializer,
+    RotatingTokenRefreshSerializer,
+    get_fieldset_serializer,
+)
+from app_users.api.tokens import get_or_create_token
+from app_users.routers import pin_for_user
+from app_users.sharding import (
+    for_user_shard,
+    new_user_id,
+    shard_querysets,
 )
 
 
@@ -40,12 +68,15 @@ from app_users.api.serializers import (
 class UserViewSet(ModelViewSet):
     queryset = AppUser.objects.all()
     serializer_class = AppUserSerializers
+    pagination_class = UserCursorPagination
+    filter_backends = [DjangoFilterBackend, UserOrderingFilter]
+    filterset_class = AppUserFilterSet
 
     def get_permissions(self):
         if self.action in ["list"]:
             permission_classes = [IsAuthenticated, IsAdminUser]
 
-        elif self.action in ["create"]:
+        elif self.action in ["create", "availability"]:
             permission_classes = [AllowAny]
 
         elif self.action in ["retrieve", "update", "partial_update", "destroy"]:
@@ -60,22 +91,119 @@ class UserViewSet(ModelViewSet):
         result = [permission() for permission in permission_classes]
         return result
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Users that just wrote read their own rows from the primary
+        pin_for_user(request.user)
+
+    def get_fieldset(self):
+        """
+        Fields asked for with ?fields=a,b and/or ?exclude=c on list, retrieve and search,
+        as a tuple in serializer order, or None for the full representation.
+        """
+        if hasattr(self, "_fieldset"):
+            return self._fieldset
+
+        self._fieldset = None
+        if self.action not in ["list", "retrieve", "search"]:
+            return None
+        fields = self.request.query_params.get("fields")
+        exclude = self.request.query_params.get("exclude")
+        if not fields and not exclude:
+            return None
+
+        available = compile_read_serializer(self.serializer_class).names
+        requested = set(fields.split(",")) if fields else set(available)
+        excluded = set(exclude.split(",")) if exclude else set()
+        unknown = (requested | excluded) - set(available)
+        if unknown:
+            raise ValidationError(
+                {"fields": [f"Unknown field(s): {', '.join(sorted(unknown))}"]}
+            )
+        fieldset = tuple(
+            name for name in available if name in requested and name not in excluded
+        )
+        if not fieldset:
+            raise ValidationError({"fields": ["At least one field must be kept"]})
+
+        self._fieldset = fieldset
+        return fieldset
+
+    def get_serializer_class(self):
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            return get_fieldset_serializer(self.serializer_class, fieldset)
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            # get_object reads the one shard the user id hashes to
+            queryset = for_user_shard(queryset, self.kwargs[lookup_url_kwarg])
+        if self.action == "retrieve" and self.get_fieldset() is not None:
+            # list narrows through .values() already
+            read_serializer = compile_read_serializer(self.get_serializer_class())
+            queryset = queryset.only(*read_serializer.sources)
+        return queryset
+
     def list(self, request, *args, **kwargs):
         try:
-            queryset = self.filter_queryset(self.get_queryset())
+            cached = get_cached_list(request)
+            if cached is not None:
+                etag, payload = cached
+                etag = representation_etag(request, etag)
+                if etag_matches(request, etag):
+                    return Response(
+                        status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+                    )
+                return Response(
+                    payload, status=status.HTTP_200_OK, headers={"ETag": etag}
+                )
+
+            # Rows come from .values() and skip DRF's per-field machinery,
+            # the cursor needs the ordering columns even when not requested
+            read_serializer = compile_read_serializer(self.get_serializer_class())
+            queryset = read_serializer.values(
+                self.filter_queryset(self.get_queryset()),
+                extra=[field.lstrip("-") for field in self.paginator.ordering],
+            )
             page = self.paginate_queryset(queryset)
             if page is not None:
-                serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
-
-            serializer = self.get_serializer(queryset, many=True)
+                response = self.get_paginated_response(
+                    read_serializer.serialize_rows(page)
+                )
+            else:
+                response = Response(
+                    {
+                        "success": True,
+                        "data": read_serializer.serialize_rows(queryset),
+                        "message": "Users Fetched Successfully",
+                    },
+                    status=status.HTTP_200_OK,
+                )
+            response["ETag"] = representation_etag(
+                request, cache_list(request, response.data)
+            )
+            return response
+        except ValidationError as e:
             return Response(
                 {
-                    "success": True,
-                    "data": serializer.data,
-                    "message": "Users Fetched Successfully",
+                    "success": False,
+                    "data": [],
+                    "message": e.detail,
                 },
-                status=status.HTTP_200_OK,
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except NotFound as e:
+            # Malformed ?cursor=, raised by the paginator
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": e.detail,
+                },
+                status=status.HTTP_404_NOT_FOUND,
             )
         except Exception as e:
             return Response(
@@ -89,15 +217,46 @@ class UserViewSet(ModelViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         try:
-            instance = self.get_object()
-            serializer = self.get_serializer(instance=instance)
+            fieldset = self.get_fieldset()
+            cached = get_cached_user(kwargs[self.lookup_url_kwarg or self.lookup_field])
+            if cached is not None:
+                etag, instance, data = cached
+                self.check_object_permissions(request, instance)
+                if fieldset is not None:
+                    data = {name: data[name] for name in fieldset}
+                    etag = make_etag(data)
+            elif fieldset is not None:
+                # Narrowed rows are not cached, only() keeps the SELECT small
+                instance = self.get_object()
+                data = self.get_serializer(instance=instance).data
+                etag = make_etag(data)
+            else:
+                instance = self.get_object()
+                data = self.get_serializer(instance=instance).data
+                etag = cache_user(instance, data)
+
+            etag = representation_etag(request, etag)
+            if etag_matches(request, etag):
+                return Response(
+                    status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+                )
             return Response(
                 {
                     "success": True,
-                    "data": [serializer.data],
+                    "data": [data],
                     "message": "User Fetched Successfully",
                 },
                 status=status.HTTP_200_OK,
+                headers={"ETag": etag},
+            )
+        except ValidationError as e:
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": e.detail,
+                },
+                status=status.HTTP_400_BAD_REQUEST,
             )
         except Exception as e:
             return Response(
@@ -113,32 +272,24 @@ class UserViewSet(ModelViewSet):
         try:
             serializer = self.serializer_class(data=self.request.data)
             if serializer.is_valid():
-                user = serializer.save(last_login=timezone.now())
-                token_serializer = CustomTokenObtainPairSerializer(
-                    data=self.request.data
+                # User row and its auth Token (post_save, eager tokens only) share
+                # one transaction in save_new_user, on the user's shard when sharded
+                user = serializer.save(last_login=timezone.now(), id=new_user_id())
+                tokens = CustomTokenObtainPairSerializer.get_token_pair(
+                    user, record_login=False
                 )
 
-                if token_serializer.is_valid():
-                    return Response(
-                        {
-                            "success": True,
-                            "data": {
-                                **serializer.data,
-                                **token_serializer.validated_data,
-                            },
-                            "message": "User Created Successfully",
-                        },
-                        status=status.HTTP_201_CREATED,
-                    )
-                else:
-                    return Response(
-                        {
-                            "success": False,
-                            "data": [],
-                            "message": token_serializer.errors,
+                return Response(
+                    {
+                        "success": True,
+                        "data": {
+                            **serializer.data,
+                            **tokens,
                         },
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
+                        "message": "User Created Successfully",
+                    },
+                    status=status.HTTP_201_CREATED,
+                )
             else:
                 return Response(
                     {
@@ -148,6 +299,210 @@ class UserViewSet(ModelViewSet):
                     },
                     status=status.HTTP_400_BAD_REQUEST,
                 )
+        except ValidationError as e:
+            # Lost a uniqueness race at INSERT time, see save_new_user
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": e.detail,
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except Exception as e:
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": str(e),
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+    @action(detail=False, methods=["get"], url_path="availability")
+    def availability(self, request, *args, **kwargs):
+        # Signup form check, answered from the in-process index when possible.
+        # A hint only, see app_users/api/availability.py, registering decides.
+        try:
+            values = {
+                field: request.query_params[field]
+                for field in INDEXED_FIELDS
+                if request.query_params.get(field)
+            }
+            if not values:
+                return Response(
+                    {
+                        "success": False,
+                        "data": [],
+                        "message": "Pass an email and/or a username",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            return Response(
+                {
+                    "success": True,
+                    "data": {
+                        field: not availability_index.is_taken(field, value)
+                        for field, value in values.items()
+                    },
+                    "message": "Availability Checked Successfully",
+                },
+                status=status.HTTP_200_OK,
+            )
+        except Exception as e:
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": str(e),
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+    @action(detail=False, methods=["get"], url_path="search")
+    def search(self, request, *args, **kwargs):
+        # Admin only, falls into the default branch of get_permissions
+        try:
+            terms = get_search_terms(request.query_params.get("q", ""))
+            if not terms:
+                return Response(
+                    {
+                        "success": False,
+                        "data": [],
+                        "message": "Search needs a term of at least 3 characters",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            try:
+                page = max(int(request.query_params.get("page", 1)), 1)
+                page_size = self.paginator.get_page_size(request)
+            except ValueError:
+                return Response(
+                    {
+                        "success": False,
+                        "data": [],
+                        "message": "Invalid page",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            # One extra id tells whether there is a next page, no COUNT needed
+            ids = ranked_user_ids(
+                terms, limit=page_size + 1, offset=(page - 1) * page_size
+            )
+            has_next = len(ids) > page_size
+            ids = ids[:page_size]
+
+            read_serializer = compile_read_serializer(self.get_serializer_class())
+            rows = {
+                row["id"]: row
+                for shard in shard_querysets(AppUser.objects.filter(pk__in=ids))
+                for row in read_serializer.values(shard, extra=["id"])
+            }
+            url = request.build_absolute_uri()
+            next_url = replace_query_param(url, "page", page + 1) if has_next else None
+            previous_url = None
+            if page == 2:
+                previous_url = remove_query_param(url, "page")
+            elif page > 2:
+                previous_url = replace_query_param(url, "page", page - 1)
+            return Response(
+                {
+                    "success": True,
+                    "data": read_serializer.serialize_rows(
+                        [rows[pk] for pk in ids if pk in rows]
+                    ),
+                    "message": "Users Fetched Successfully",
+                    "next": next_url,
+                    "previous": previous_url,
+                },
+                status=status.HTTP_200_OK,
+            )
+        except ValidationError as e:
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": e.detail,
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        except Exception as e:
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": str(e),
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request, *args, **kwargs):
+        # Admin only, falls into the default branch of get_permissions
+        try:
+            if not isinstance(request.data, list):
+                return Response(
+                    {
+                        "success": False,
+                        "data": [],
+                        "message": "Expected a list of users",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            results = bulk_register(request.data)
+            created = sum(1 for result in results if result["success"])
+            return Response(
+                {
+                    "success": created == len(results),
+                    "data": results,
+                    "message": f"{created} of {len(results)} Users Created",
+                },
+                status=(
+                    status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+                ),
+            )
+        except Exception as e:
+            return Response(
+                {
+                    "success": False,
+                    "data": [],
+                    "message": str(e),
+                },
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request, *args, **kwargs):
+        # Admin only, falls into the default branch of get_permissions
+        try:
+            export_type = request.query_params.get("type", "ndjson")
+            queryset = self.filter_queryset(self.get_queryset())
+            fields = get_export_fields()
+
+            if export_type == "csv":
+                response = StreamingHttpResponse(
+                    stream_csv(queryset, fields), content_type="text/csv"
+                )
+                response["Content-Disposition"] = 'attachment; filename="users.csv"'
+            elif export_type == "ndjson":
+                response = StreamingHttpResponse(
+                    stream_ndjson(queryset, fields),
+                    content_type="application/x-ndjson",
+                )
+                response["Content-Disposition"] = 'attachment; filename="users.ndjson"'
+            else:
+                return Response(
+                    {
+                        "success": False,
+                        "data": [],
+                        "message": "Export type must be one of ndjson, csv",
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            return response
         except Exception as e:
             return Response(
                 {
@@ -222,7 +577,8 @@ class CustomAuthToken(ObtainAuthToken):
             )
             serializer.is_valid(raise_exception=True)
             user = serializer.validated_data["user"]
-            token, created = Token.objects.get_or_create(user=user)
+            # Created on the first login when tokens are lazy
+            token = get_or_create_token(user)
             return Response(
                 {
                     "success": True,
@@ -255,14 +611,17 @@ class CustomJWTPairToken(TokenObtainPairView):
 
     def post(self, request, *args, **kwargs):
         try:
-            user = authenticate(
-                email=self.request.data["email"], password=self.request.data["password"]
+            # The serializer authenticates once, the pair is minted from that user
+            serializer = self.serializer_class(
+                data=self.request.data, context={"request": request}
             )
-            print("🚀 ~ user:", user)
-            serializer = self.serializer_class(data=self.request.data)
-            user_serializer = AppUserSerializers(user, many=False)
+            try:
+                is_valid = serializer.is_valid()
+            except AuthenticationFailed:
+                is_valid = False
 
-            if user is not None and serializer.is_valid():
+            if is_valid:
+                user_serializer = AppUserSerializers(serializer.user, many=False)
                 return Response(
                     {
                         "success": True,
@@ -292,13 +651,17 @@ class CustomJWTPairToken(TokenObtainPairView):
 
 
 class CustomJWTPairRefresh(TokenRefreshView):
-    serializer_class = TokenRefreshSerializer
+    serializer_class = RotatingTokenRefreshSerializer
 
     def post(self, request, *args, **kwargs):
         try:
             serializer = self.serializer_class(data=self.request.data)
+            try:
+                is_valid = serializer.is_valid()
+            except TokenError:
+                is_valid = False  # bad signature or expired
 
-            if serializer.is_valid():
+            if is_valid:
                 return Response(
                     {
                         "success": True,
@@ -328,13 +691,17 @@ class CustomJWTPairRefresh(TokenRefreshView):
 
 
 class CustomJWTTokenVerify(TokenVerifyView):
-    serializer_class = TokenVerifySerializer
+    serializer_class = RevocableTokenVerifySerializer
 
     def post(self, request, *args, **kwargs):
         try:
             serializer = self.serializer_class(data=self.request.data)
+            try:
+                is_valid = serializer.is_valid()
+            except TokenError:
+                is_valid = False
 
-            if serializer.is_valid():
+            if is_valid:
                 return Response(
                     {
                         "success": True,
@@ -361,3 +728,17 @@ class CustomJWTTokenVerify(TokenVerifyView):
                 },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+
+class HashingPoolMetrics(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(
+            {
+                "success": True,
+                "data": [get_hashing_pool().metrics()],
+                "message": "Hashing Pool Metrics Fetched Successfully",
+            },
+            status=status.HTTP_200_OK,
+        )
@@ -0,0 +1,175 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import update_last_login as save_last_login
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, close_old_connections
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from app_users.api.caches import BackgroundThread
+from app_users.api.response_cache import invalidate_user
+from app_users.models import AppUser
+from app_users.sharding import user_database
+
+
+"""
+Write-behind for row updates that may lag a few seconds, AppUser.last_login
+for now. Logins only record the new value in memory, a background thread
+writes what piled up with one bulk_update per batch, so a login never waits
+for the SQLite write lock. Pending values are lost only if the process dies
+without running its exit handlers.
+"""
+
+logger = logging.getLogger(__name__)
+
+_settings = {
+    "ENABLED": True,
+    "FLUSH_INTERVAL": 5,
+    "MAX_PENDING": 1000,
+    "BATCH_SIZE": 500,
+    **getattr(settings, "LAST_LOGIN_WRITE_BEHIND", {}),
+}
+
+
+def _newest(row, values):
+    for field, value in values.items():
+        if row.get(field) is None or value > row[field]:
+            row[field] = value
+
+
+class WriteBehindBuffer:
+    """
+    Newest pending value per (row, field) of `model`, written at most `interval`
+    seconds later, or as soon as `max_pending` rows wait. Stored values only
+    move forward (GREATEST), a late flush from another process can't undo a
+    newer one. A failed flush keeps its values for the next attempt.
+    """
+
+    def __init__(
+        self,
+        model,
+        interval,
+        max_pending,
+        batch_size,
+        get_database=None,
+        on_flush=None,
+    ):
+        self.model = model
+        self.interval = interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.get_database = get_database or (lambda pk: DEFAULT_DB_ALIAS)
+        self.on_flush = on_flush
+        self._pending = {}  # pk -> {field: value}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = BackgroundThread(self._run, name="write-behind")
+
+    def set(self, pk, **values):
+        with self._lock:
+            _newest(self._pending.setdefault(pk, {}), values)
+            full = len(self._pending) >= self.max_pending
+        self._flusher.ensure_started()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        """Write every pending value now, returns the number of rows written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self._write(pending)
+        except DatabaseError:
+            logger.warning("Write-behind flush failed, retrying later", exc_info=True)
+            with self._lock:
+                for pk, values in pending.items():
+                    _newest(self._pending.setdefault(pk, {}), values)
+            return 0
+        if self.on_flush is not None:
+            self.on_flush(pending)
+        return len(pending)
+
+    def _groups(self, pending):
+        # One bulk write per database and set of fields
+        groups = defaultdict(list)
+        for pk, values in pending.items():
+            groups[self.get_database(pk), tuple(sorted(values))].append(pk)
+        return groups.items()
+
+    def _write(self, pending):
+        # bulk_update sets the same fields on every row of a call
+        for (using, fields), pks in self._groups(pending):
+            rows = []
+            for pk in pks:
+                row = self.model(pk=pk)
+                for field in fields:
+                    value = Value(
+                        pending[pk][field],
+                        output_field=self.model._meta.get_field(field),
+                    )
+                    setattr(row, field, Greatest(Coalesce(F(field), value), value))
+                rows.append(row)
+            self.model.objects.using(using).bulk_update(
+                rows, fields, batch_size=self.batch_size
+            )
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class UpsertBuffer(WriteBehindBuffer):
+    """
+    WriteBehindBuffer for rows that may not exist yet, INSERT ... ON CONFLICT
+    DO UPDATE. The last flush wins, for values where a few seconds don't matter.
+    """
+
+    def _write(self, pending):
+        for (using, fields), pks in self._groups(pending):
+            self.model.objects.using(using).bulk_create(
+                [self.model(pk=pk, **pending[pk]) for pk in pks],
+                update_conflicts=True,
+                unique_fields=[self.model._meta.pk.name],
+                update_fields=fields,
+                batch_size=self.batch_size,
+            )
+
+
+def _evict_cached_users(pending):
+    # bulk_update sends no post_save, drop the cached responses like the receivers do
+    for pk in pending:
+        invalidate_user(pk)
+
+
+last_login_buffer = WriteBehindBuffer(
+    AppUser,
+    interval=_settings["FLUSH_INTERVAL"],
+    max_pending=_settings["MAX_PENDING"],
+    batch_size=_settings["BATCH_SIZE"],
+    get_database=user_database,
+    on_flush=_evict_cached_users,
+)
+atexit.register(last_login_buffer.flush)
+
+
+def update_last_login(sender, user, **kwargs):
+    """
+    django.contrib.auth.models.update_last_login through last_login_buffer,
+    also connected to user_logged_in in place of Django's receiver.
+    """
+    if not _settings["ENABLED"]:
+        return save_last_login(sender, user, **kwargs)
+    user.last_login = timezone.now()
+    last_login_buffer.set(user.pk, last_login=user.last_login)
@@ -0,0 +1,133 @@
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+from app_users.api.caches import BackgroundThread
+
+
+"""
+Single writer for SQLite databases. SQLite lets one connection write at a time,
+concurrent registrations otherwise queue on the file lock (busy_timeout) and
+fail with "database is locked" once they waited too long.
+Writes handed to a database's SingleWriter run on one thread with its own
+connection. Whatever piled up while the previous batch was committing goes into
+the next transaction, up to BATCH_SIZE items per COMMIT (group commit).
+"""
+
+_settings = {
+    "ENABLED": True,
+    "BATCH_SIZE": 64,
+    **getattr(settings, "SQLITE_SINGLE_WRITER", {}),
+}
+
+
+class SingleWriter:
+    """
+    Runs `write(jobs)` on a thread of its own for the items submitted to database
+    `using`, every queued item of the same `write` in one call and transaction.
+    `jobs` are (context, item) pairs, the context a copy of the submitter's to
+    run per-item work in (see app_users/routers.py). `write` returns one result
+    per item, an exception instance fails that item alone. An exception out of
+    `write`, or a failed COMMIT, fails the whole batch.
+    """
+
+    def __init__(self, using, batch_size):
+        self.using = using
+        self.batch_size = batch_size
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = BackgroundThread(self._run, name=f"single-writer-{using}")
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, write, item):
+        future = Future()
+        self._queue.put((write, contextvars.copy_context(), item, future))
+        self._thread.ensure_started()
+        return future
+
+    def run(self, write, item):
+        """Result of `item` once its batch committed."""
+        return self.submit(write, item).result()
+
+    def close(self):
+        """
+        Stop the thread once what is queued is written and close its connection,
+        e.g. before the database file goes away. The next submit starts a new one.
+        """
+        thread = self._thread.detach()
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        while True:
+            queued = [self._queue.get()]
+            while len(queued) < self.batch_size and queued[-1] is not None:
+                try:
+                    queued.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = queued[-1] is None
+            if stop:
+                queued.pop()
+            close_old_connections()
+            for write, batch in groupby(queued, key=itemgetter(0)):
+                self._write(write, list(batch))
+            if stop:
+                connections.close_all()
+                return
+
+    def _write(self, write, batch):
+        try:
+            with transaction.atomic(using=self.using):
+                results = write([(context, item) for _, context, item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        else:
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+        for (*_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(using):
+    with _writers_lock:
+        if using not in _writers:
+            _writers[using] = SingleWriter(using, batch_size=_settings["BATCH_SIZE"])
+    return _writers[using]
+
+
+def close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
+
+
+def use_writer(using):
+    """
+    Whether writes to `using` should go through its SingleWriter: SQLite only,
+    and not from inside a transaction of the caller, the writer would wait for
+    the lock that transaction holds.
+    """
+    connection = connections[using]
+    return (
+        _settings["ENABLED"]
+        and connection.vendor == "sqlite"
+        and not connection.in_atomic_block
+    )
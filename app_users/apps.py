@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_in
+from django.db.backends.signals import connection_created
 
 
 class AppUsersConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
-    name = 'app_users'
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "app_users"
+
+    def ready(self):
+        from app_users.db import configure_sqlite
+
+        connection_created.connect(configure_sqlite, dispatch_uid="configure_sqlite")
+
+        from app_users.api.write_behind import update_last_login
+
+        # Session logins (admin) update last_login through the write-behind buffer
+        user_logged_in.disconnect(dispatch_uid="update_last_login")
+        user_logged_in.connect(update_last_login, dispatch_uid="update_last_login")
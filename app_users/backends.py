@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from app_users.sharding import first_in_shards, for_user_shard, sharding_enabled
+
+
+UserModel = get_user_model()
+
+
+class ShardedModelBackend(ModelBackend):
+    """
+    ModelBackend that finds the user on its shard when USER_SHARDS is set,
+    by email on every shard and by id on the one it hashes to.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if not sharding_enabled():
+            return super().authenticate(request, username, password, **kwargs)
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        user = first_in_shards(
+            UserModel._default_manager.filter(**{UserModel.USERNAME_FIELD: username})
+        )
+        if user is None:
+            # Keep the timing of unknown emails close to a wrong password
+            UserModel().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        if not sharding_enabled():
+            return super().get_user(user_id)
+        queryset = UserModel._default_manager.filter(pk=user_id)
+        user = for_user_shard(queryset, user_id).first()
+        return user if user is not None and self.user_can_authenticate(user) else None
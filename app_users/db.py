@@ -0,0 +1,36 @@
+from django.conf import settings
+
+
+"""
+SQLite tuning applied to every new connection through connection_created
+(connected in AppUsersConfig.ready).
+WAL lets readers run next to the single writer instead of waiting for it,
+synchronous=NORMAL is durable enough with WAL and skips an fsync per commit,
+busy_timeout makes a writer wait for the lock instead of failing at once with
+"database is locked". mmap_size / cache_size keep hot pages out of read().
+benchmarks/bench_sqlite_concurrency.py compares this against the defaults.
+"""
+
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,  # ms
+    "cache_size": -20000,  # negative is KiB, ~20 MB per connection
+    "mmap_size": 268435456,  # 256 MB
+    "temp_store": "memory",
+}
+
+
+def get_sqlite_pragmas():
+    # SQLITE_PRAGMAS in settings overrides the defaults, None skips a pragma
+    pragmas = {**DEFAULT_SQLITE_PRAGMAS, **getattr(settings, "SQLITE_PRAGMAS", {})}
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in get_sqlite_pragmas().items():
+            # In-memory databases (the test runner) just keep journal_mode=memory
+            cursor.execute(f"PRAGMA {name} = {value}")
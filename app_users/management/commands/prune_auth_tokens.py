@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from app_users.api import signals  # noqa: F401, evicts the cached tokens
+from app_users.api.tokens import get_prune_after, token_use_buffer
+from app_users.sharding import get_user_databases
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the DRF auth tokens not used to authenticate a request for "
+        "AUTH_TOKENS['PRUNE_AFTER_DAYS'] days, never used ones included, e.g. "
+        "the tokens made at signup while tokens were eager. Their users get a "
+        "new one from their next token login."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Unused for this many days, PRUNE_AFTER_DAYS by default.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Print how many tokens would be deleted, change nothing.",
+        )
+
+    def handle(self, *args, days, batch_size, dry_run, **options):
+        prune_after = get_prune_after() if days is None else timedelta(days=days)
+        cutoff = timezone.now() - prune_after
+        # Uses recorded by this process are written first, the ones other
+        # processes still hold are at most FLUSH_INTERVAL seconds old
+        token_use_buffer.flush()
+
+        total = 0
+        for using in get_user_databases():
+            keys = list(
+                Token.objects.using(using)
+                .filter(created__lt=cutoff)
+                .filter(
+                    Q(user__token_use__isnull=True)
+                    | Q(user__token_use__last_used__lt=cutoff)
+                )
+                .values_list("key", flat=True)
+            )
+            self.stdout.write(f"{using}: {len(keys)} unused tokens")
+            total += len(keys)
+            if dry_run:
+                continue
+            # Deleting sends the Token signals, the token caches forget them
+            for start in range(0, len(keys), batch_size):
+                with transaction.atomic(using=using):
+                    Token.objects.using(using).filter(
+                        key__in=keys[start : start + batch_size]
+                    ).delete()
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS(f"Deleted {total} tokens"))
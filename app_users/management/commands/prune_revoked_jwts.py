@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from app_users.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the revoked JWTs (RevokedToken) past their expiry, the tokens "
+        "are rejected as expired anyway. The revocation filters drop them at "
+        "their next rebuild."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Print how many rows would be deleted, change nothing.",
+        )
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        expired = RevokedToken.objects.using(DEFAULT_DB_ALIAS).filter(
+            expires_at__lte=timezone.now()
+        )
+        ids = list(expired.values_list("id", flat=True))
+        self.stdout.write(f"{len(ids)} expired revoked tokens")
+        if dry_run:
+            return
+        for start in range(0, len(ids), batch_size):
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                RevokedToken.objects.using(DEFAULT_DB_ALIAS).filter(
+                    id__in=ids[start : start + batch_size]
+                ).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {len(ids)} rows"))
@@ -0,0 +1,144 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.authtoken.models import Token
+
+from app_users.api import signals  # noqa: F401, evicts the caches of moved users
+from app_users.models import (
+    AppUser,
+    OutboxEvent,
+    TokenUse,
+    UserShardBucket,
+    UserUniqueValue,
+)
+from app_users.sharding import (
+    UNIQUE_FIELDS,
+    bucket_for_id,
+    get_bucket_map,
+    get_map_ttl,
+    get_shards,
+    get_user_databases,
+    plan_buckets,
+    reset_bucket_map,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Spread the user id buckets evenly over USER_SHARDS and move the users "
+        "(and their tokens) whose bucket changed shard. Also moves users off "
+        "databases that are no longer shards, e.g. 'default' when sharding is "
+        "turned on for an existing database, and claims the emails and usernames "
+        "of users that have none yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Print how many users would move, change nothing.",
+        )
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        shards = get_shards()
+        if not shards:
+            raise CommandError("No shards configured, set USER_SHARDS")
+
+        reset_bucket_map()
+        target = plan_buckets(get_bucket_map(), shards)
+        sources = list(dict.fromkeys([*get_user_databases(), DEFAULT_DB_ALIAS]))
+        moves = self.plan_moves(sources, target)
+
+        for (source, destination), user_ids in moves.items():
+            self.stdout.write(f"{source} -> {destination}: {len(user_ids)} users")
+        if dry_run:
+            return
+
+        for source in sources:
+            self.claim_unique_values(source, batch_size)
+        # Copy first, switch the map, give every process MAP_TTL to pick it up,
+        # then copy the users created on the old shard meanwhile and delete.
+        # Updates made to moving users during the run are not carried over.
+        for (source, destination), user_ids in moves.items():
+            self.copy_users(source, destination, user_ids, batch_size)
+        self.save_map(target)
+        if moves:
+            time.sleep(get_map_ttl())
+            for (source, destination), user_ids in self.plan_moves(
+                sources, target
+            ).items():
+                self.copy_users(source, destination, user_ids, batch_size)
+                self.delete_users(source, user_ids, batch_size)
+        self.stdout.write(self.style.SUCCESS("Shards rebalanced"))
+
+    def plan_moves(self, sources, target):
+        # (source, destination) -> ids of the users to move
+        moves = defaultdict(list)
+        for source in sources:
+            user_ids = (
+                AppUser.objects.using(source)
+                .values_list("id", flat=True)
+                .iterator(chunk_size=5000)
+            )
+            for user_id in user_ids:
+                destination = target[bucket_for_id(user_id)]
+                if destination != source:
+                    moves[source, destination].append(user_id)
+        return moves
+
+    def claim_unique_values(self, source, batch_size):
+        # Users saved before sharding was turned on have no UserUniqueValue rows
+        rows = AppUser.objects.using(source).values_list("id", *UNIQUE_FIELDS)
+        claims = (
+            UserUniqueValue(field=field, value=value, user_id=user_id)
+            for user_id, *values in rows.iterator(chunk_size=5000)
+            for field, value in zip(UNIQUE_FIELDS, values)
+        )
+        UserUniqueValue.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            claims, batch_size=batch_size, ignore_conflicts=True
+        )
+
+    def copy_users(self, source, destination, user_ids, batch_size):
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start : start + batch_size]
+            users = list(AppUser.objects.using(source).filter(pk__in=batch))
+            tokens = list(Token.objects.using(source).filter(user_id__in=batch))
+            uses = list(TokenUse.objects.using(source).filter(user_id__in=batch))
+            events = list(OutboxEvent.objects.using(source).filter(user_id__in=batch))
+            for event in events:
+                event.pk = None  # ids are per database, `key` identifies the event
+            # Rows already copied by an earlier, interrupted run are skipped
+            with transaction.atomic(using=destination):
+                AppUser.objects.using(destination).bulk_create(
+                    users, ignore_conflicts=True
+                )
+                Token.objects.using(destination).bulk_create(
+                    tokens, ignore_conflicts=True
+                )
+                TokenUse.objects.using(destination).bulk_create(
+                    uses, ignore_conflicts=True
+                )
+                OutboxEvent.objects.using(destination).bulk_create(
+                    events, ignore_conflicts=True
+                )
+
+    def save_map(self, target):
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            UserShardBucket.objects.using(DEFAULT_DB_ALIAS).all().delete()
+            UserShardBucket.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+                UserShardBucket(bucket=bucket, database=alias)
+                for bucket, alias in enumerate(target)
+            )
+        reset_bucket_map()
+
+    def delete_users(self, source, user_ids, batch_size):
+        # Deleting sends the Token / AppUser signals, the shared caches forget them
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start : start + batch_size]
+            with transaction.atomic(using=source):
+                Token.objects.using(source).filter(user_id__in=batch).delete()
+                OutboxEvent.objects.using(source).filter(user_id__in=batch).delete()
+                AppUser.objects.using(source).filter(pk__in=batch).delete()
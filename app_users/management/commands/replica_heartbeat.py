@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_users.routers import write_heartbeat
+
+
+class Command(BaseCommand):
+    help = (
+        "Bump the heartbeat row on the primary every --interval seconds. "
+        "Replicas report their lag as the age of the row they have."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=1.0)
+        parser.add_argument("--once", action="store_true")
+
+    def handle(self, *args, interval, once, **options):
+        while True:
+            write_heartbeat()
+            if once:
+                break
+            time.sleep(interval)
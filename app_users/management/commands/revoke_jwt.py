@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import UntypedToken
+
+from app_users.api.revocation import get_jti, revoke
+
+
+class Command(BaseCommand):
+    help = (
+        "Revoke JWTs, e.g. a stolen refresh token. Every process rejects them "
+        "within JWT_REVOCATION['SYNC_INTERVAL'] seconds. To revoke all the "
+        "tokens of a user, change their password or auth_version instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("tokens", nargs="+", help="Encoded access or refresh JWTs.")
+
+    def handle(self, *args, tokens, **options):
+        for raw in tokens:
+            try:
+                token = UntypedToken(raw)
+            except TokenError as e:
+                # Expired ones included, there is nothing left to revoke
+                raise CommandError(f"Not a valid token: {e}")
+            state = "revoked" if revoke(token) else "already revoked"
+            self.stdout.write(f"{get_jti(token)}: {state}")
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from app_users.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the side effects queued in the outbox (OutboxEvent) with a pool of "
+        "worker threads until interrupted. Start as many processes as needed, "
+        "batches are leased so no event runs twice at the same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=2)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Events leased at once, OUTBOX['BATCH_SIZE'] by default.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the events due now in this thread and exit, e.g. from cron.",
+        )
+
+    def handle(self, *args, threads, batch_size, once, **options):
+        worker = OutboxWorker(threads=threads, batch_size=batch_size)
+        if once:
+            processed = worker.drain()
+            self.stdout.write(self.style.SUCCESS(f"Ran {processed} outbox events"))
+            return
+
+        worker.start()
+        self.stdout.write(f"Outbox worker running with {threads} threads")
+        try:
+            # Handlers run on the worker threads, this one only waits for ^C
+            worker.wait()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping, waiting for the current batches")
+            worker.stop()
+        self.stdout.write(self.style.SUCCESS(f"Ran {worker.processed} outbox events"))
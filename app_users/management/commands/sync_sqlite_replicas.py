@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from app_users.routers import get_replicas, write_heartbeat
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database onto the local replica files "
+        "(SQLITE_REPLICAS=N), standing in for replication during development."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Sync again every INTERVAL seconds, 0 syncs once.",
+        )
+
+    def handle(self, *args, interval, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError("Only SQLite databases can be copied this way")
+        replicas = get_replicas()
+        if not replicas:
+            raise CommandError("No replicas configured, set SQLITE_REPLICAS=N")
+
+        while True:
+            # The copied heartbeat is what the router measures the lag from
+            write_heartbeat()
+            primary.ensure_connection()
+            for alias in replicas:
+                replica = connections[alias]
+                replica.ensure_connection()
+                primary.connection.backup(replica.connection)
+                self.stdout.write(f"Synced {alias}")
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0001_initial'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appuser',
+            index=models.Index(fields=['date_joined', 'id'], name='app_users_joined_id_idx'),
+        ),
+    ]
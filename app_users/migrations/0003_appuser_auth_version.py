@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0002_appuser_joined_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='auth_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.4 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0003_appuser_auth_version'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appuser',
+            index=models.Index(condition=models.Q(('is_staff', True)), fields=['date_joined', 'id'], name='app_users_staff_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appuser',
+            index=models.Index(condition=models.Q(('is_active', False)), fields=['date_joined', 'id'], name='app_users_inactive_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appuser',
+            index=models.Index(fields=['mobile'], name='app_users_mobile_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Full-text search index for AppUser, kept in sync by triggers (SQLite only)
+
+from django.db import migrations
+
+
+SEARCH_COLUMNS = 'email, username, first_name, last_name, mobile'
+NEW_VALUES = 'new.id, new.email, new.username, new.first_name, new.last_name, new.mobile'
+OLD_VALUES = 'old.id, old.email, old.username, old.first_name, old.last_name, old.mobile'
+
+CREATE_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE app_users_appuser_fts USING fts5(
+        {SEARCH_COLUMNS},
+        content='app_users_appuser',
+        content_rowid='id',
+        tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER app_users_appuser_fts_ai AFTER INSERT ON app_users_appuser BEGIN
+        INSERT INTO app_users_appuser_fts(rowid, {SEARCH_COLUMNS}) VALUES ({NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER app_users_appuser_fts_ad AFTER DELETE ON app_users_appuser BEGIN
+        INSERT INTO app_users_appuser_fts(app_users_appuser_fts, rowid, {SEARCH_COLUMNS})
+        VALUES ('delete', {OLD_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER app_users_appuser_fts_au AFTER UPDATE ON app_users_appuser
+    WHEN old.email IS NOT new.email OR old.username IS NOT new.username
+        OR old.first_name IS NOT new.first_name OR old.last_name IS NOT new.last_name
+        OR old.mobile IS NOT new.mobile
+    BEGIN
+        INSERT INTO app_users_appuser_fts(app_users_appuser_fts, rowid, {SEARCH_COLUMNS})
+        VALUES ('delete', {OLD_VALUES});
+        INSERT INTO app_users_appuser_fts(rowid, {SEARCH_COLUMNS}) VALUES ({NEW_VALUES});
+    END
+    """,
+    "INSERT INTO app_users_appuser_fts(app_users_appuser_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS app_users_appuser_fts_au',
+    'DROP TRIGGER IF EXISTS app_users_appuser_fts_ad',
+    'DROP TRIGGER IF EXISTS app_users_appuser_fts_ai',
+    'DROP TABLE IF EXISTS app_users_appuser_fts',
+]
+
+
+def run_sql(statements):
+    def operation(apps, schema_editor):
+        # Other backends fall back to icontains search, see app_users.api.search
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0004_appuser_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(CREATE_SQL), run_sql(DROP_SQL)),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-17 18:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0006_replicaheartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserIdSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserShardBucket',
+            fields=[
+                ('bucket', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('database', models.CharField(max_length=100)),
+            ],
+        ),
+    ]
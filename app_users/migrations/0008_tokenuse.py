@@ -0,0 +1,22 @@
+# Generated by Django 5.0.4 on 2026-10-17 19:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0007_usersharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenUse',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='token_use', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_used', models.DateTimeField()),
+            ],
+        ),
+    ]
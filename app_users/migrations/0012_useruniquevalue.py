@@ -0,0 +1,26 @@
+# Generated by Django 5.0.4 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_users', '0011_revokedtoken_revoked_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserUniqueValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=255)),
+                ('user_id', models.BigIntegerField(db_index=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='useruniquevalue',
+            constraint=models.UniqueConstraint(fields=('field', 'value'), name='app_users_unique_value'),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+import uuid
+
+from django.db import DEFAULT_DB_ALIAS, models, transaction
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -8,6 +10,14 @@ from django.core.validators import RegexValidator
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 
+from app_users.sharding import (
+    UNIQUE_FIELDS,
+    claim_unique_values,
+    new_user_id,
+    sharding_enabled,
+    update_unique_values,
+)
+
 
 class CustomUserManager(BaseUserManager):
     """
@@ -63,18 +73,185 @@ class AppUser(AbstractBaseUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     date_joined = models.DateTimeField(default=timezone.now)
+    # Bumped whenever credentials or privileges change, carried in the JWT "ver" claim
+    auth_version = models.PositiveIntegerField(default=0, editable=False)
 
     USERNAME_FIELD = "email"
+    AUTH_VERSION_FIELDS = ("password", "is_active", "is_staff", "is_superuser")
 
     objects = CustomUserManager()
 
     class Meta:
         verbose_name = "user"
         verbose_name_plural = "users"
+        indexes = [
+            # Backs the keyset pagination of the users list
+            models.Index(fields=["date_joined", "id"], name="app_users_joined_id_idx"),
+            # Partial indexes for the selective list filters, already in cursor order
+            models.Index(
+                fields=["date_joined", "id"],
+                condition=models.Q(is_staff=True),
+                name="app_users_staff_joined_idx",
+            ),
+            models.Index(
+                fields=["date_joined", "id"],
+                condition=models.Q(is_active=False),
+                name="app_users_inactive_joined_idx",
+            ),
+            models.Index(fields=["mobile"], name="app_users_mobile_idx"),
+        ]
 
     def __str__(self):
         return self.email
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_auth_state = instance._get_auth_state()
+        return instance
+
+    def _get_auth_state(self):
+        # Deferred fields are left out, they can't have been changed
+        return {
+            field: self.__dict__[field]
+            for field in self.AUTH_VERSION_FIELDS
+            if field in self.__dict__
+        }
+
+    def auth_state_changed(self):
+        loaded_auth_state = getattr(self, "_loaded_auth_state", None) or {}
+        return any(
+            self.__dict__.get(field, value) != value
+            for field, value in loaded_auth_state.items()
+        )
+
+    def save(self, *args, **kwargs):
+        if self.pk is None and sharding_enabled():
+            # The id picks the shard, it must exist before the INSERT
+            self.pk = new_user_id()
+            kwargs["force_insert"] = True
+        update_fields = kwargs.get("update_fields")
+        if self.auth_state_changed():
+            self.auth_version += 1
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "auth_version"}
+        if sharding_enabled() and (
+            update_fields is None or set(UNIQUE_FIELDS) & set(update_fields)
+        ):
+            # Email and username claimed across the shards in the same go
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                if self._state.adding:
+                    claim_unique_values([self])
+                else:
+                    update_unique_values(self, update_fields)
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+        self._loaded_auth_state = self._get_auth_state()
+
+
+class ReplicaHeartbeat(models.Model):
+    """
+    Single row bumped on the primary. Its age on a read replica is that
+    replica's lag, see app_users.routers.
+    """
+
+    beat = models.DateTimeField()
+
+
+class UserIdSequence(models.Model):
+    """
+    Single row on the default database, next user id not handed out yet when
+    users are sharded. Reserved in blocks, see app_users.sharding.
+    """
+
+    next_id = models.BigIntegerField()
+
+
+class UserShardBucket(models.Model):
+    """
+    Shard holding a bucket of user ids, written by `manage.py rebalance_user_shards`.
+    Buckets without a row keep their round robin placement.
+    """
+
+    bucket = models.PositiveIntegerField(primary_key=True)
+    database = models.CharField(max_length=100)
+
+
+class UserUniqueValue(models.Model):
+    """
+    Email or username of a sharded user, on the default database. The unique
+    constraints of AppUser only cover its shard, this one covers every shard.
+    See app_users.sharding.
+    """
+
+    field = models.CharField(max_length=20)
+    value = models.CharField(max_length=255)
+    user_id = models.BigIntegerField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["field", "value"], name="app_users_unique_value"
+            ),
+        ]
+
+
+class TokenUse(models.Model):
+    """
+    Last time the user's DRF auth token authenticated a request, at most
+    USE_RESOLUTION seconds old. No row means never used, see app_users.api.tokens.
+    """
+
+    # Written behind, the user may be deleted by then
+    user = models.OneToOneField(
+        AppUser,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        db_constraint=False,
+        related_name="token_use",
+    )
+    last_used = models.DateTimeField()
+
+
+class OutboxEvent(models.Model):
+    """
+    Side effect still to run, written in the transaction of the change it
+    follows and run later by `manage.py run_outbox_worker`, one row per
+    handler. Done rows are deleted, FAILED ones stay for inspection.
+    Kept on the shard of `user_id`, see app_users.outbox.
+    """
+
+    PENDING = "pending"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (FAILED, "Failed")]
+
+    # Idempotency key handed to the handler, kept when the row changes shard
+    key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    topic = models.CharField(max_length=100)
+    handler = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict)
+    user_id = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Not claimable before, pushed back by retries and by a worker's lease
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.UUIDField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available_at", "id"],
+                condition=models.Q(status="pending"),
+                name="outbox_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} -> {self.handler}"
+
 
 # class AppUser(AbstractUser):
 #     pass
@@ -148,3 +325,15 @@ class AppUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 """
+
+
+class RevokedToken(models.Model):
+    """
+    `jti` of a JWT that must no longer be accepted, e.g. a rotated refresh
+    token. Rows past `expires_at` are useless, the token expired anyway, and
+    are deleted by `manage.py prune_revoked_jwts`. See app_users.api.revocation.
+    """
+
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(default=timezone.now, db_index=True)
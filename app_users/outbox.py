@@ -0,0 +1,217 @@
+import logging
+import threading
+import uuid
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    DatabaseError,
+    close_old_connections,
+    connections,
+)
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from app_users.models import OutboxEvent
+from app_users.sharding import get_user_databases
+
+
+"""
+Transactional outbox for the side effects of user changes (welcome mail,
+analytics, search indexing). publish() writes one OutboxEvent per handler of
+a topic in the caller's transaction, the events exist exactly when the change
+committed and the request doesn't wait for the handlers.
+`manage.py run_outbox_worker` runs them on a pool of threads. A worker leases a
+batch (claimed_by, available_at pushed CLAIM_TIMEOUT ahead), calls each handler
+with its event and deletes the done rows. A failing handler is retried with
+exponential backoff, after MAX_ATTEMPTS the event is marked FAILED.
+A worker dying mid-batch lets its lease run out and the events run again, so
+delivery is at least once: handlers stay idempotent with `event.key`.
+"""
+
+logger = logging.getLogger(__name__)
+
+_settings = {
+    "HANDLERS": {},
+    "BATCH_SIZE": 100,
+    "MAX_ATTEMPTS": 8,
+    "RETRY_BACKOFF": 2,  # seconds, doubled on every attempt
+    "MAX_BACKOFF": 3600,
+    "CLAIM_TIMEOUT": 300,
+    "POLL_INTERVAL": 1,
+    **getattr(settings, "OUTBOX", {}),
+}
+
+USER_CREATED = "user.created"
+
+
+def get_handlers(topic):
+    """Dotted paths of the callables run for `topic`, from OUTBOX["HANDLERS"]."""
+    return _settings["HANDLERS"].get(topic, [])
+
+
+@lru_cache(maxsize=None)
+def _load_handler(path):
+    return import_string(path)
+
+
+def user_payload(user):
+    return {"user_id": user.pk, "email": user.email, "username": user.username}
+
+
+def publish(topic, payloads, using):
+    """
+    Queue `topic` for every payload (JSON-able dicts, "user_id" keeps the event
+    on that user's shard) and every handler of it, on database `using` in its
+    current transaction. Topics without handlers write nothing.
+    """
+    handlers = get_handlers(topic)
+    if not handlers:
+        return []
+    return OutboxEvent.objects.using(using).bulk_create(
+        OutboxEvent(
+            topic=topic,
+            handler=handler,
+            payload=payload,
+            user_id=payload.get("user_id"),
+        )
+        for payload in payloads
+        for handler in handlers
+    )
+
+
+def get_outbox_databases():
+    # The user databases, and default for events not about a user
+    return list(dict.fromkeys([*get_user_databases(), DEFAULT_DB_ALIAS]))
+
+
+def claim(using, batch_size):
+    """Lease up to `batch_size` due events of `using` for the calling worker."""
+    now = timezone.now()
+    lease = uuid.uuid4()
+    due = OutboxEvent.objects.using(using).filter(
+        status=OutboxEvent.PENDING, available_at__lte=now
+    )
+    ids = list(
+        due.order_by("available_at", "id").values_list("id", flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    # Rows another worker leased meanwhile are no longer due, they don't match
+    due.filter(id__in=ids).update(
+        claimed_by=lease,
+        available_at=now + timedelta(seconds=_settings["CLAIM_TIMEOUT"]),
+    )
+    return list(OutboxEvent.objects.using(using).filter(claimed_by=lease))
+
+
+def run_events(events, using):
+    """Run the handlers of leased `events`, returns how many succeeded."""
+    done = []
+    for event in events:
+        try:
+            _load_handler(event.handler)(event)
+        except Exception as e:
+            _retry_later(event, e, using)
+        else:
+            done.append(event.pk)
+    # Only while the lease is ours, an expired one may have been taken over
+    OutboxEvent.objects.using(using).filter(
+        pk__in=done, claimed_by=events[0].claimed_by
+    ).delete()
+    return len(done)
+
+
+def _retry_later(event, error, using):
+    attempts = event.attempts + 1
+    failed = attempts >= _settings["MAX_ATTEMPTS"]
+    delay = min(
+        _settings["MAX_BACKOFF"], _settings["RETRY_BACKOFF"] * 2 ** (attempts - 1)
+    )
+    logger.warning(
+        "Outbox handler %s failed on event %s (attempt %d)%s",
+        event.handler,
+        event.key,
+        attempts,
+        ", giving up" if failed else "",
+        exc_info=error,
+    )
+    OutboxEvent.objects.using(using).filter(
+        pk=event.pk, claimed_by=event.claimed_by
+    ).update(
+        attempts=attempts,
+        status=OutboxEvent.FAILED if failed else OutboxEvent.PENDING,
+        available_at=timezone.now() + timedelta(seconds=delay),
+        claimed_by=None,
+        last_error=repr(error),
+    )
+
+
+class OutboxWorker:
+    """
+    `threads` threads draining the outbox of every database, a batch of
+    `batch_size` events at a time, polling every POLL_INTERVAL seconds when
+    nothing is due.
+    """
+
+    def __init__(self, threads=1, batch_size=None):
+        self.threads = threads
+        self.batch_size = batch_size or _settings["BATCH_SIZE"]
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.processed = 0
+
+    def run_once(self):
+        """One batch per database, returns the number of events claimed."""
+        claimed = 0
+        for using in get_outbox_databases():
+            try:
+                events = claim(using, self.batch_size)
+                if events:
+                    done = run_events(events, using)
+                    with self._lock:
+                        self.processed += done
+            except DatabaseError:
+                # e.g. "database is locked", the batch is claimed again later
+                logger.warning("Outbox batch on %s failed", using, exc_info=True)
+                continue
+            claimed += len(events)
+        return claimed
+
+    def drain(self):
+        """Run what is due now until nothing is left, in the calling thread."""
+        while self.run_once():
+            pass
+        return self.processed
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"outbox-{index}", daemon=True)
+            for index in range(self.threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def wait(self):
+        for thread in self._threads:
+            thread.join()
+
+    def stop(self):
+        self._stop.set()
+        self.wait()
+
+    def _run(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            if not self.run_once():
+                self._stop.wait(_settings["POLL_INTERVAL"])
+        connections.close_all()
+
+
+def log_event(event):
+    """Handler that only logs the event, e.g. to try the outbox out."""
+    logger.info("Outbox event %s %s: %s", event.topic, event.key, event.payload)
@@ -0,0 +1,233 @@
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import LazyObject, empty
+
+from app_users.api.caches import LRUCache
+
+
+"""
+Read/write splitting for the user tables.
+Reads of REPLICATED_MODELS go to a random replica from DATABASE_REPLICAS whose
+heartbeat (ReplicaHeartbeat) is at most MAX_LAG seconds old, everything else and
+every write goes to the primary.
+A request stays on the primary once it wrote, for unsafe methods and inside
+transactions. After a write, the same credentials and the written / acting users
+keep reading from the primary for STICKY seconds so people see their own updates.
+Authentication pins sticky users from the token's user id before reading them,
+and asks the primary again when a replica is missing the user or its token.
+"""
+
+REPLICATED_MODELS = {"app_users.appuser", "authtoken.token"}
+
+_settings = {
+    "MAX_LAG": 5,
+    "LAG_CHECK_INTERVAL": 1,
+    "STICKY": 10,
+    "CACHE": "default",
+    **getattr(settings, "REPLICA_ROUTING", {}),
+}
+
+
+def get_replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class RoutingState:
+    """Per request, shared by reference with the threads a request hops through."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.user_ids = set()
+
+
+_state = ContextVar("replica_routing_state", default=None)
+
+
+def pin():
+    """Send the rest of the current request to the primary."""
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+
+
+def note_user_write(user_id):
+    # Called from the AppUser post_save receiver, that user becomes sticky too
+    state = _state.get()
+    if state is not None and user_id is not None:
+        state.user_ids.add(user_id)
+
+
+def _sticky_cache():
+    return caches[_settings["CACHE"]]
+
+
+def _credentials_key(request):
+    credentials = request.headers.get("Authorization") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode()).hexdigest()
+    return f"replica-sticky:credentials:{digest}"
+
+
+def _user_key(user_id):
+    return f"replica-sticky:user:{user_id}"
+
+
+def pin_for_user(user):
+    """Pin the request when `user` wrote within the last STICKY seconds."""
+    if getattr(user, "is_authenticated", False):
+        pin_for_user_id(user.pk)
+
+
+def pin_for_user_id(user_id):
+    """pin_for_user() before the user is read, returns whether it pinned."""
+    if not get_replicas() or user_id is None:
+        return False
+    if _sticky_cache().get(_user_key(user_id)):
+        pin()
+        return True
+    return False
+
+
+def read_database(queryset):
+    """
+    `queryset` bound to the database the routers pick for its reads now, so
+    is_replica(queryset.db) tells where its rows came from.
+    """
+    return queryset.using(queryset.db)
+
+
+def is_replica(alias):
+    return alias in get_replicas()
+
+
+_lags = LRUCache(maxsize=128, ttl=_settings["LAG_CHECK_INTERVAL"])
+
+
+def replica_lag(alias):
+    """Seconds since the heartbeat seen on `alias`, cached for LAG_CHECK_INTERVAL."""
+    lag = _lags.get(alias)
+    if lag is None:
+        from app_users.models import ReplicaHeartbeat
+
+        try:
+            beat = (
+                ReplicaHeartbeat.objects.using(alias)
+                .values_list("beat", flat=True)
+                .first()
+            )
+        except DatabaseError:
+            beat = None  # unreachable or not synced yet, treated as lagging
+        lag = (timezone.now() - beat).total_seconds() if beat else float("inf")
+        _lags.set(alias, lag)
+    return lag
+
+
+def write_heartbeat(using=DEFAULT_DB_ALIAS):
+    from app_users.models import ReplicaHeartbeat
+
+    ReplicaHeartbeat.objects.using(using).update_or_create(
+        pk=1, defaults={"beat": timezone.now()}
+    )
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower not in REPLICATED_MODELS:
+            return None
+        state = _state.get()
+        if state is not None and state.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        healthy = [
+            alias
+            for alias in get_replicas()
+            if replica_lag(alias) <= _settings["MAX_LAG"]
+        ]
+        return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        # Instances read from a replica must still be saved on the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in get_replicas():
+            return False
+        return None
+
+
+def _start(request):
+    key = _credentials_key(request)
+    pinned = request.method not in ("GET", "HEAD", "OPTIONS")
+    if not pinned and key is not None:
+        pinned = bool(_sticky_cache().get(key))
+    return _state.set(RoutingState(pinned=pinned)), key
+
+
+def _finish(request, token, key):
+    state = _state.get()
+    _state.reset(token)
+    if not state.wrote:
+        return
+    user = getattr(request, "user", None)
+    if isinstance(user, LazyObject) and user._wrapped is empty:
+        user = None  # never resolved, don't run a session lookup for it
+    user_ids = set(state.user_ids)
+    if getattr(user, "is_authenticated", False):
+        user_ids.add(user.pk)
+    keys = [_user_key(user_id) for user_id in user_ids]
+    if key is not None:
+        keys.append(key)
+    _sticky_cache().set_many(
+        {key: time.time() for key in keys}, timeout=_settings["STICKY"]
+    )
+
+
+@sync_and_async_middleware
+def ReplicaRoutingMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            if not get_replicas():
+                return await get_response(request)
+            token, key = _start(request)
+            try:
+                return await get_response(request)
+            finally:
+                _finish(request, token, key)
+
+    else:
+
+        def middleware(request):
+            if not get_replicas():
+                return get_response(request)
+            token, key = _start(request)
+            try:
+                return get_response(request)
+            finally:
+                _finish(request, token, key)
+
+    return middleware
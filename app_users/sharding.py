@@ -0,0 +1,374 @@
+import hashlib
+import heapq
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import Max
+
+from app_users.api.caches import LRUCache
+
+
+"""
+Optional hash sharding of AppUser and its Token across the USER_SHARDS databases.
+A user id hashes (blake2b) into one of BUCKETS fixed buckets and the bucket map
+says which shard holds each bucket: UserShardBucket rows on the default database
+over a round robin placement. `manage.py rebalance_user_shards` moves buckets,
+so adding a shard never rehashes anyone.
+Ids are allocated from UserIdSequence on the default database so they stay
+unique across shards. A user's Token, TokenUse and OutboxEvents live next to it.
+The unique constraints of AppUser only cover one shard, every email and username
+is also claimed in UserUniqueValue on the default database, whose own unique
+constraint covers them all. user_transaction() commits the claims with the users.
+
+UserShardRouter routes saves, deletes and related lookups from the instance in
+the hints. Queries without an instance pick the shard with for_user_shard() or
+fan out with shard_querysets() and merge with merge_streams().
+With USER_SHARDS empty every helper falls back to the plain queryset.
+"""
+
+SHARDED_MODELS = {
+    "app_users.appuser",
+    "authtoken.token",
+    "app_users.tokenuse",
+    "app_users.outboxevent",
+}
+# Bookkeeping of the sharding itself, kept on the default database
+DIRECTORY_MODELS = {"useridsequence", "usershardbucket", "useruniquevalue"}
+# AppUser fields unique across every shard
+UNIQUE_FIELDS = ("email", "username")
+
+_settings = {
+    "BUCKETS": 1024,
+    "ID_BLOCK": 100,
+    "MAP_TTL": 5,
+    **getattr(settings, "USER_SHARDING", {}),
+}
+
+
+def get_shards():
+    return getattr(settings, "USER_SHARDS", [])
+
+
+def sharding_enabled():
+    return bool(get_shards())
+
+
+def bucket_for_id(user_id):
+    # Not hash(), that one changes between processes
+    digest = hashlib.blake2b(str(int(user_id)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % _settings["BUCKETS"]
+
+
+def default_bucket_map(shards):
+    return [shards[bucket % len(shards)] for bucket in range(_settings["BUCKETS"])]
+
+
+_bucket_maps = LRUCache(maxsize=1, ttl=_settings["MAP_TTL"])
+
+
+def get_bucket_map():
+    """Shard of every bucket, re-read every MAP_TTL seconds."""
+    mapping = _bucket_maps.get("map")
+    if mapping is None:
+        from app_users.models import UserShardBucket
+
+        mapping = default_bucket_map(get_shards())
+        rows = UserShardBucket.objects.using(DEFAULT_DB_ALIAS).values_list(
+            "bucket", "database"
+        )
+        for bucket, alias in rows:
+            mapping[bucket] = alias
+        _bucket_maps.set("map", mapping)
+    return mapping
+
+
+def reset_bucket_map():
+    _bucket_maps.clear()
+
+
+def get_map_ttl():
+    # How long other processes may keep routing with an old bucket map
+    return _settings["MAP_TTL"]
+
+
+def shard_for_id(user_id):
+    return get_bucket_map()[bucket_for_id(user_id)]
+
+
+def get_user_databases():
+    # Every database holding users, the shards no longer in USER_SHARDS included
+    # while rebalance_user_shards hasn't moved their buckets away yet
+    if not sharding_enabled():
+        return [DEFAULT_DB_ALIAS]
+    return list(dict.fromkeys(get_bucket_map()))
+
+
+def user_database(user_id):
+    """Database a user is written to, the default one without sharding."""
+    if user_id is None or not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    return shard_for_id(user_id)
+
+
+def for_user_shard(queryset, user_id):
+    """`queryset` on the shard of `user_id`, unchanged without sharding."""
+    if not sharding_enabled():
+        return queryset
+    try:
+        return queryset.using(shard_for_id(user_id))
+    except (TypeError, ValueError):
+        return queryset  # not an id, the lookup itself reports it
+
+
+def shard_querysets(queryset):
+    """One copy of `queryset` per shard, or just `queryset` without sharding."""
+    if not sharding_enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in get_user_databases()]
+
+
+def first_in_shards(queryset):
+    # For unique lookups (token key, email), shards are tried one after another
+    for shard in shard_querysets(queryset):
+        for obj in shard[:1]:
+            return obj
+    return None
+
+
+async def afirst_in_shards(queryset):
+    for shard in shard_querysets(queryset):
+        async for obj in shard[:1]:
+            return obj
+    return None
+
+
+def merge_streams(streams, key, reverse=False):
+    """Merge rows already sorted by `key` on every shard into one sorted stream."""
+    if len(streams) == 1:
+        return iter(streams[0])
+    return heapq.merge(*streams, key=key, reverse=reverse)
+
+
+def max_user_id():
+    from app_users.models import AppUser
+
+    return max(
+        (
+            AppUser.objects.using(alias).aggregate(max_id=Max("id"))["max_id"] or 0
+            for alias in {DEFAULT_DB_ALIAS, *get_user_databases(), *get_shards()}
+        ),
+        default=0,
+    )
+
+
+class UserIdAllocator:
+    """
+    Hands out ids from blocks of ID_BLOCK reserved in UserIdSequence, one UPDATE
+    per block. Ids are unique across processes and only roughly increasing.
+    Blocks are reserved on a connection of their own, they must stay taken even
+    when the transaction that asked for an id rolls back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def allocate(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._end = self._reserve(_settings["ID_BLOCK"])
+                self._next = self._end - _settings["ID_BLOCK"]
+            user_id = self._next
+            self._next += 1
+        return user_id
+
+    def _reserve(self, size):
+        from app_users.models import UserIdSequence
+
+        connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        table = connection.ops.quote_name(UserIdSequence._meta.db_table)
+        try:
+            while True:
+                connection.set_autocommit(False)
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            f"UPDATE {table} SET next_id = next_id + %s WHERE id = 1",
+                            [size],
+                        )
+                        if cursor.rowcount == 0:
+                            # First block ever, start above the ids in use
+                            cursor.execute(
+                                f"INSERT INTO {table} (id, next_id) VALUES (1, %s)",
+                                [max_user_id() + 1 + size],
+                            )
+                        cursor.execute(f"SELECT next_id FROM {table} WHERE id = 1")
+                        end = cursor.fetchone()[0]
+                    connection.commit()
+                    return end
+                except IntegrityError:
+                    # Another process created the row first, take a block from it
+                    connection.rollback()
+                except Exception:
+                    connection.rollback()
+                    raise
+        finally:
+            connection.close()
+
+    def reset(self):
+        with self._lock:
+            self._next = self._end = 0
+
+
+user_id_allocator = UserIdAllocator()
+
+
+def new_user_id():
+    """Id for a user about to be created, None (autoincrement) without sharding."""
+    if not sharding_enabled():
+        return None
+    return user_id_allocator.allocate()
+
+
+def user_transaction(using):
+    """
+    transaction.atomic for writing users to `using`. With sharding it runs inside
+    one on the default database, the UserUniqueValue rows claimed meanwhile
+    commit right after the users and are rolled back with them.
+    """
+    if not sharding_enabled() or using == DEFAULT_DB_ALIAS:
+        return transaction.atomic(using=using)
+    return _directory_and_shard_atomic(using)
+
+
+@contextmanager
+def _directory_and_shard_atomic(using):
+    with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=using):
+        yield
+
+
+def _unique_values(user, fields=UNIQUE_FIELDS):
+    from app_users.models import UserUniqueValue
+
+    return [
+        UserUniqueValue(field=field, value=getattr(user, field), user_id=user.pk)
+        for field in fields
+    ]
+
+
+def claim_unique_values(users):
+    """
+    Claim the emails and usernames of new `users` across the shards, an
+    IntegrityError when one is taken. Nothing to do without sharding.
+    """
+    from app_users.models import UserUniqueValue
+
+    if not sharding_enabled():
+        return
+    UserUniqueValue.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+        [value for user in users for value in _unique_values(user)]
+    )
+
+
+def update_unique_values(user, update_fields=None):
+    """Move the claims of the saved `user` to its current email and username."""
+    from app_users.models import UserUniqueValue
+
+    if not sharding_enabled():
+        return
+    # Deferred fields can't have been changed
+    fields = [
+        field
+        for field in UNIQUE_FIELDS
+        if field in user.__dict__ and (update_fields is None or field in update_fields)
+    ]
+    if not fields:
+        return
+    claims = UserUniqueValue.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user.pk)
+    claimed = dict(claims.filter(field__in=fields).values_list("field", "value"))
+    changed = [field for field in fields if claimed.get(field) != getattr(user, field)]
+    if changed:
+        claims.filter(field__in=changed).delete()
+        UserUniqueValue.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            _unique_values(user, changed)
+        )
+
+
+def release_unique_values(user_id, using):
+    """Drop the claims of a user deleted from `using`, kept when it only moved."""
+    from app_users.models import UserUniqueValue
+
+    if not sharding_enabled() or user_database(user_id) != using:
+        return
+    UserUniqueValue.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).delete()
+
+
+def get_claimed_values(field, values, exclude_user_id=None):
+    """The `values` of a unique `field` claimed by some user on any shard."""
+    from app_users.models import UserUniqueValue
+
+    claims = UserUniqueValue.objects.using(DEFAULT_DB_ALIAS).filter(
+        field=field, value__in=values
+    )
+    if exclude_user_id is not None:
+        claims = claims.exclude(user_id=exclude_user_id)
+    return set(claims.values_list("value", flat=True))
+
+
+def plan_buckets(current, shards):
+    """
+    Bucket map spreading the buckets evenly over `shards`, moving as few as
+    possible away from their `current` shard.
+    """
+    quota, extra = divmod(len(current), len(shards))
+    room = {alias: quota + (index < extra) for index, alias in enumerate(shards)}
+    target = [None] * len(current)
+    for bucket, alias in enumerate(current):
+        if room.get(alias, 0) > 0:
+            target[bucket] = alias
+            room[alias] -= 1
+    free = (alias for alias in shards for _ in range(room[alias]))
+    return [alias if alias is not None else next(free) for alias in target]
+
+
+def _user_id(instance):
+    from app_users.models import AppUser
+
+    if isinstance(instance, AppUser):
+        return instance.pk
+    # From __dict__, a deferred user_id must not be loaded through the router
+    return getattr(instance, "__dict__", {}).get("user_id")
+
+
+class UserShardRouter:
+    def _db_for_hints(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS or not sharding_enabled():
+            return None
+        user_id = _user_id(hints.get("instance"))
+        if user_id is None:
+            return None
+        return shard_for_id(user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_hints(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_hints(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not sharding_enabled():
+            return None
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if not labels <= SHARDED_MODELS:
+            return None
+        user_ids = {_user_id(obj1), _user_id(obj2)}
+        if None in user_ids:
+            return None
+        return len({shard_for_id(user_id) for user_id in user_ids}) == 1
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == "app_users" and model_name in DIRECTORY_MODELS:
+            return db == DEFAULT_DB_ALIAS
+        return None
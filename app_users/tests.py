@@ -1,3 +1,1606 @@
-from django.test import TestCase
+import csv
+import itertools
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlencode, urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import MD5PasswordHasher
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from app_users import outbox
+from app_users.api import authentication
+from app_users.api.authentication import (
+    CachedBasicAuthentication,
+    CachedTokenAuthentication,
+    VersionedJWTAuthentication,
+    auth_versions,
+    get_auth_version,
+    basic_auth_cache,
+    token_cache,
+)
+from app_users.api.availability import availability_index
+from app_users.api.caches import BackgroundThread, LRUCache
+from app_users.api.exports import stream_csv, stream_ndjson
+from app_users.api.filters import UserOrderingFilter
+from app_users.api.hashing import HashingPool, HashingPoolSaturated
+from app_users.api.read_serializers import compile_read_serializer
+from app_users.api.renderers import FastJSONRenderer, msgpack
+from app_users.api.revocation import RevocationFilter, revoked_jtis
+from app_users.api.serializers import (
+    AppUserSerializers,
+    CustomTokenObtainPairSerializer,
+    save_new_user,
+)
+from app_users.api.tokens import token_use_buffer
+from app_users.api.views import UserViewSet
+from app_users.api.writer import SingleWriter, use_writer
+from app_users.api.write_behind import last_login_buffer, update_last_login
+from app_users.db import get_sqlite_pragmas
+from app_users.models import (
+    AppUser,
+    OutboxEvent,
+    RevokedToken,
+    UserShardBucket,
+    UserUniqueValue,
+)
+from app_users import routers
+from app_users.routers import ReadReplicaRouter, ReplicaRoutingMiddleware
+from app_users.sharding import (
+    UserShardRouter,
+    bucket_for_id,
+    default_bucket_map,
+    get_user_databases,
+    merge_streams,
+    new_user_id,
+    plan_buckets,
+    reset_bucket_map,
+    shard_for_id,
+    shard_querysets,
+    user_database,
+)
+
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+def setUpModule():
+    # Their threads would use the test database outside the test's transaction,
+    # lookups go to the database like before the first build / sync and the
+    # write-behind buffers are flushed by the tests that need it
+    for target, name in [
+        (availability_index, "_rebuild_in_background"),
+        (revoked_jtis._syncer, "ensure_started"),
+        (last_login_buffer._flusher, "ensure_started"),
+        (token_use_buffer._flusher, "ensure_started"),
+    ]:
+        patcher = mock.patch.object(target, name)
+        patcher.start()
+        unittest.addModuleCleanup(patcher.stop)
+    for buffer in (last_login_buffer, token_use_buffer):
+        # Their exit flush would run after the test database is gone
+        unittest.addModuleCleanup(lambda buffer=buffer: buffer._pending.clear())
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class AdminSearchTests(TestCase):
+    def setUp(self):
+        admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        AppUser.objects.create_user("alice@example.com", "pw", username="alice")
+        AppUser.objects.create_user("bob@example.com", "pw", username="bobby")
+        self.client.force_login(admin)
+
+    def search(self, query):
+        response = self.client.get("/admin/app_users/appuser/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return {user.email for user in response.context["cl"].result_list}
+
+    def test_uses_the_full_text_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search("alic"), {"alice@example.com"})
+        self.assertTrue(
+            any("app_users_appuser_fts" in query["sql"] for query in queries)
+        )
+
+    def test_short_terms_fall_back_to_search_fields(self):
+        self.assertEqual(self.search("bo"), {"bob@example.com"})
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class ResponseCacheTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        caches["default"].clear()
+        self.user = AppUser.objects.create_user(
+            "owner@example.com", "pw", username="owner"
+        )
+        self.other = AppUser.objects.create_user(
+            "other@example.com", "pw", username="other"
+        )
+        self.admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+
+    def get_detail(self, user, **headers):
+        self.client.force_authenticate(user)
+        return self.client.get(f"/users/{self.user.pk}", headers=headers)
+
+    def test_detail_cache_holds_no_model_or_password(self):
+        self.get_detail(self.user)
+        cached = caches["default"].get(f"user-detail:{self.user.pk}")
+        self.assertIsNotNone(cached)
+        self.assertNotIn(self.user.password, pickle.dumps(cached).decode("latin-1"))
+        self.assertFalse(any(isinstance(value, AppUser) for value in cached))
+
+    def test_cached_detail_keeps_the_owner_check(self):
+        self.assertEqual(self.get_detail(self.user).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_detail(self.user).status_code, 200)
+        # Denied like before caching, in the view's error envelope
+        denied = self.get_detail(self.other)
+        self.assertFalse(denied.data["success"])
+        self.assertEqual(denied.data["data"], [])
+        self.assertEqual(self.get_detail(self.admin).status_code, 200)
+
+    def test_conditional_get(self):
+        etag = self.get_detail(self.user)["ETag"]
+        response = self.get_detail(self.user, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_save_evicts_detail_and_lists(self):
+        etag = self.get_detail(self.user)["ETag"]
+        self.client.force_authenticate(self.admin)
+        list_etag = self.client.get("/users")["ETag"]
+
+        self.user.first_name = "Changed"
+        self.user.save()
+
+        response = self.get_detail(self.user, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["data"][0]["first_name"], "Changed")
+        self.client.force_authenticate(self.admin)
+        self.assertNotEqual(self.client.get("/users")["ETag"], list_etag)
+
+    def test_bulk_registration_evicts_lists(self):
+        self.client.force_authenticate(self.admin)
+        list_etag = self.client.get("/users")["ETag"]
+
+        response = self.client.post(
+            "/users/bulk",
+            [{"email": "new@example.com", "username": "new", "password": "Pw-12345!"}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get("/users", headers={"if_none_match": list_etag})
+        self.assertEqual(response.status_code, 200)
+        emails = [row["email"] for row in response.data["data"]]
+        self.assertIn("new@example.com", emails)
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class BulkRegistrationTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        self.client.force_authenticate(admin)
+
+    def register(self, items):
+        return self.client.post("/users/bulk", items, format="json")
+
+    def test_reports_each_item(self):
+        AppUser.objects.create_user("taken@example.com", "pw", username="taken")
+        response = self.register(
+            [
+                {"email": "a@example.com", "username": "a1", "password": "Pw-12345!"},
+                {"email": "taken@example.com", "username": "b1", "password": "x"},
+                {"email": "c@example.com", "username": "a1", "password": "Pw-12345!"},
+                {"email": "not-an-email", "username": "d1", "password": "Pw-12345!"},
+            ]
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [result["success"] for result in response.data["data"]],
+            [True, False, False, False],
+        )
+        self.assertIn("email", response.data["data"][1]["errors"])
+        self.assertIn("username", response.data["data"][2]["errors"])
+        self.assertTrue(AppUser.objects.filter(username="a1").exists())
+
+    def test_concurrent_registration_fails_only_its_item(self):
+        # Committed after the uniqueness checks of the batch ran
+        AppUser.objects.create_user("late@example.com", "pw", username="late")
+        with mock.patch("app_users.api.bulk._existing_values", return_value=set()):
+            response = self.register(
+                [
+                    {"email": "ok@example.com", "username": "ok", "password": "P-1x"},
+                    {"email": "late@example.com", "username": "l2", "password": "P"},
+                ]
+            )
+        self.assertEqual(response.status_code, 201)
+        ok, late = response.data["data"]
+        self.assertTrue(ok["success"])
+        self.assertEqual(
+            late["errors"], {"email": ["user with this email address already exists."]}
+        )
+        self.assertTrue(AppUser.objects.filter(email="ok@example.com").exists())
+        self.assertFalse(AppUser.objects.filter(username="l2").exists())
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class AsyncLoginTests(TestCase):
+    def setUp(self):
+        self.user = AppUser.objects.create_user(
+            "login@example.com", "pw-secret", username="login"
+        )
+
+    async def test_takes_the_sync_view_fields_as_json(self):
+        response = await self.async_client.post(
+            "/async/api-token-auth/",
+            {"username": "login@example.com", "password": "pw-secret"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"][0]["userId"], self.user.pk)
+
+    async def test_takes_form_bodies(self):
+        credentials = {"username": "login@example.com", "password": "pw-secret"}
+        urlencoded = await self.async_client.post(
+            "/async/api-token-auth/",
+            urlencode(credentials),
+            content_type="application/x-www-form-urlencoded",
+        )
+        self.assertEqual(urlencoded.status_code, 200)
+        multipart = await self.async_client.post("/async/api-token-auth/", credentials)
+        self.assertEqual(multipart.status_code, 200)
+
+    async def test_rejects_wrong_passwords(self):
+        response = await self.async_client.post(
+            "/async/api-token-auth/",
+            {"username": "login@example.com", "password": "wrong"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()["success"])
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class JWTVersionTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.user = AppUser.objects.create_user("jwt@example.com", "pw", username="jwt")
+        self.pair = CustomTokenObtainPairSerializer.get_token_pair(
+            self.user, record_login=False
+        )
+
+    def change_password(self):
+        self.user.set_password("new-pw")
+        self.user.save()
+
+    def verify(self, prefix=""):
+        return self.client.post(
+            f"{prefix}/api/token/verify/", {"token": self.pair["access"]}
+        )
+
+    def refresh(self, prefix=""):
+        return self.client.post(
+            f"{prefix}/api/token/refresh/", {"refresh": self.pair["refresh"]}
+        )
+
+    def test_verify_rejects_tokens_of_an_old_password(self):
+        for prefix in ("", "/async"):
+            self.assertEqual(self.verify(prefix).status_code, 200, prefix)
+        self.change_password()
+        for prefix in ("", "/async"):
+            self.assertEqual(self.verify(prefix).status_code, 400, prefix)
+
+    def test_refresh_rejects_tokens_of_an_old_password(self):
+        self.change_password()
+        for prefix in ("", "/async"):
+            self.assertEqual(self.refresh(prefix).status_code, 400, prefix)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.pair['access']}")
+        self.assertEqual(self.client.get(f"/users/{self.user.pk}").status_code, 401)
+
+    def test_users_come_from_the_claims(self):
+        caches["default"].clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.pair['access']}")
+        self.assertEqual(self.client.get(f"/users/{self.user.pk}").status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/users/{self.user.pk}")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            any("app_users_appuser" in query["sql"] for query in queries), queries
+        )
+
+    def test_tokens_without_the_claim_load_the_user(self):
+        access = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        del access["ver"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(self.client.get(f"/users/{self.user.pk}").status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(f"/users/{self.user.pk}").status_code, 401)
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class JWTRevocationTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        user = AppUser.objects.create_user("rot@example.com", "pw", username="rot")
+        self.pair = CustomTokenObtainPairSerializer.get_token_pair(
+            user, record_login=False
+        )
+
+    def refresh(self, token, prefix=""):
+        return self.client.post(f"{prefix}/api/token/refresh/", {"refresh": token})
+
+    def test_refresh_tokens_are_single_use(self):
+        for prefix in ("", "/async"):
+            first = self.refresh(self.pair["refresh"], prefix)
+            self.assertEqual(first.status_code, 200, prefix)
+            rotated = first.json()["data"][0]["refresh"]
+            self.assertNotEqual(rotated, self.pair["refresh"])
+            self.assertEqual(
+                self.refresh(self.pair["refresh"], prefix).status_code, 400
+            )
+            self.pair["refresh"] = rotated
+
+    def test_revoke_jwt_command(self):
+        call_command("revoke_jwt", self.pair["access"], stdout=StringIO())
+        response = self.client.post(
+            "/api/token/verify/", {"token": self.pair["access"]}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.pair['access']}")
+        self.assertEqual(self.client.get("/users").status_code, 401)
+        out = StringIO()
+        call_command("revoke_jwt", self.pair["access"], stdout=out)
+        self.assertIn("already revoked", out.getvalue())
+
+
+class RevocationFilterTests(TestCase):
+    def make_filter(self):
+        return RevocationFilter(
+            capacity=1000,
+            error_rate=0.001,
+            sync_interval=5,
+            sync_overlap=60,
+            rebuild_interval=3600,
+        )
+
+    def revoke(self, jti, **fields):
+        fields.setdefault("expires_at", timezone.now() + timedelta(hours=1))
+        return RevokedToken.objects.create(jti=jti, **fields)
+
+    def test_sync_adds_rows_committed_out_of_id_order(self):
+        revoked = self.make_filter()
+        self.revoke("first", id=10)
+        revoked.rebuild()
+        # e.g. a lower sequence value whose transaction committed later
+        self.revoke("late", id=5)
+        self.assertNotIn("late", revoked._filter)
+        revoked._add_new_rows()
+        self.assertIn("late", revoked._filter)
+        self.assertIn("first", revoked._filter)
+
+    def test_sync_adds_each_row_once(self):
+        revoked = self.make_filter()
+        revoked.rebuild()
+        self.revoke("new")
+        revoked._add_new_rows()
+        revoked._add_new_rows()
+        self.assertEqual(revoked._filter.count, 1)
+
+    def test_rebuild_drops_expired_rows(self):
+        self.revoke("expired", expires_at=timezone.now() - timedelta(seconds=1))
+        revoked = self.make_filter()
+        revoked.rebuild()
+        self.assertNotIn("expired", revoked._filter)
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN QUERY PLAN of the page query GET /users runs, for every supported
+    filter value and ordering, on the first page and the one after a cursor.
+    Filtered queries must search an index or walk one in cursor order, and
+    only point lookups may sort in a temp b-tree.
+    """
+
+    FILTERS = {
+        "is_staff": ["true", "false"],
+        "is_active": ["true", "false"],
+        "date_joined_after": ["2024-01-01T00:00:00Z"],
+        "date_joined_before": ["2025-01-01T00:00:00Z"],
+        "email": ["user1@example.com"],
+        "username": ["user1"],
+        "mobile": ["0000000001"],
+    }
+    # Unique or near-unique columns, sorting what they return is fine
+    POINT_LOOKUPS = {"email", "username", "mobile"}
+    # Partial indexes holding exactly the rows of a selective filter value
+    PARTIAL_INDEXES = {
+        ("is_staff", "true"): "app_users_staff_joined_idx",
+        ("is_active", "false"): "app_users_inactive_joined_idx",
+    }
+    # Values matching almost every row, walking the cursor index finds a page fast
+    COMMON_VALUES = {("is_staff", "false"), ("is_active", "true")}
+
+    @classmethod
+    def setUpTestData(cls):
+        # Realistic distribution for the planner: few staff, few inactive users
+        now = timezone.now()
+        AppUser.objects.bulk_create(
+            AppUser(
+                email=f"user{i}@example.com",
+                username=f"user{i}",
+                password="!",
+                mobile=f"{i:010d}",
+                is_staff=i % 50 == 0,
+                is_active=i % 10 != 0,
+                date_joined=now - timedelta(minutes=i),
+            )
+            for i in range(2000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def page_queryset(self, params):
+        # The steps of UserViewSet.list up to the fetch
+        view = UserViewSet(action="list", kwargs={}, format_kwarg=None)
+        view.request = Request(APIRequestFactory().get("/users", params))
+        read_serializer = compile_read_serializer(view.get_serializer_class())
+        queryset = read_serializer.values(
+            view.filter_queryset(view.get_queryset()),
+            extra=[field.lstrip("-") for field in view.paginator.ordering],
+        )
+        [page] = view.paginator.get_page_querysets(queryset, view.request, view)
+        return view.paginator, page
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def problems(self, plan, filters):
+        scannable = {
+            self.PARTIAL_INDEXES[item]
+            for item in filters
+            if item in self.PARTIAL_INDEXES
+        }
+        if set(filters) <= self.COMMON_VALUES:
+            scannable.add("app_users_joined_id_idx")
+        names = {name for name, value in filters}
+        found = []
+        for detail in plan:
+            if detail.startswith("SCAN"):
+                index = detail.split(" USING ")[-1].split()[-1]
+                if " USING " not in detail or index not in scannable:
+                    found.append(detail)
+            if "TEMP B-TREE" in detail and not self.POINT_LOOKUPS & names:
+                found.append(detail)
+        return found
+
+    def filter_combinations(self):
+        choices = [
+            [None, *((name, value) for value in values)]
+            for name, values in self.FILTERS.items()
+        ]
+        for combination in itertools.product(*choices):
+            yield [item for item in combination if item is not None]
+
+    def test_every_filter_value_reads_an_index(self):
+        for filters in self.filter_combinations():
+            for ordering in UserOrderingFilter.orderings:
+                params = {**dict(filters), "ordering": ordering}
+                paginator, page = self.page_queryset(params)
+                queries = [page]
+                paginator.set_page(list(page))
+                if paginator.has_next:
+                    next_params = parse_qs(urlsplit(paginator.get_next_link()).query)
+                    queries.append(self.page_queryset(next_params)[1])
+                for queryset in queries:
+                    with self.subTest(params=params, cursor=queryset is not page):
+                        plan = self.explain(queryset)
+                        self.assertEqual(self.problems(plan, filters), [], plan)
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class ExportTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        AppUser.objects.create_user("user@example.com", "pw", username="user")
+        self.client.force_authenticate(self.admin)
+
+    def export(self, export_type):
+        response = self.client.get("/users/export", {"type": export_type})
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson_matches_the_api(self):
+        listed = self.client.get("/users", {"ordering": "date_joined"}).data["data"]
+        lines = self.export("ndjson").splitlines()
+        self.assertEqual([json.loads(line) for line in lines], listed)
+
+    def test_csv_uses_the_api_formats(self):
+        listed = self.client.get("/users", {"ordering": "date_joined"}).json()
+        rows = list(csv.DictReader(StringIO(self.export("csv"))))
+        self.assertEqual(len(rows), 2)
+        for row, item in zip(rows, listed["data"]):
+            self.assertEqual(row["date_joined"], item["date_joined"])
+            self.assertEqual(row["is_active"], "true")
+            self.assertEqual(row["email"], item["email"])
+        self.assertNotIn("password", rows[0])
+
+    def test_formats_take_the_fields(self):
+        queryset = AppUser.objects.all()
+        ndjson = [json.loads(line) for line in stream_ndjson(queryset, ["email"])]
+        self.assertEqual(
+            ndjson, [{"email": "admin@example.com"}, {"email": "user@example.com"}]
+        )
+        csv_lines = "".join(stream_csv(queryset, ["id", "email"])).splitlines()
+        self.assertEqual(csv_lines[0], "id,email")
+        self.assertEqual(csv_lines[1], f"{self.admin.pk},admin@example.com")
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class AvailabilityTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        AppUser.objects.create_user("taken@example.com", "pw", username="taken")
+        self.addCleanup(availability_index.reset)
+
+    def check(self, **params):
+        response = self.client.get("/users/availability", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data["data"]
+
+    def test_lookups_never_wait_for_a_build(self):
+        availability_index.reset()
+        availability_index._rebuild_in_background.reset_mock()
+        self.assertIsNone(availability_index.get_filters())
+        availability_index._rebuild_in_background.assert_called()
+        # The database answers meanwhile
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                self.check(email="taken@example.com", username="free"),
+                {"email": False, "username": True},
+            )
+
+    def test_free_values_skip_the_database(self):
+        availability_index._filters = availability_index._build()
+        availability_index._built_at = time.monotonic()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.check(username="free"), {"username": True})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.check(username="taken"), {"username": False})
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class CursorPaginationTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        caches["default"].clear()
+        admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        # Pairs joined at the same moment, the id breaks the tie
+        joined = timezone.now() - timedelta(days=1)
+        AppUser.objects.bulk_create(
+            AppUser(
+                email=f"user{i}@example.com",
+                username=f"user{i}",
+                password="!",
+                date_joined=joined + timedelta(minutes=i // 2),
+            )
+            for i in range(7)
+        )
+        self.client.force_authenticate(admin)
+
+    def walk(self, **params):
+        ids = []
+        response = self.client.get("/users", {"page_size": 3, **params})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [row["id"] for row in response.data["data"]]
+            if response.data["next"] is None:
+                return ids, response
+            response = self.client.get(response.data["next"])
+
+    def expected_ids(self, *ordering):
+        return list(AppUser.objects.order_by(*ordering).values_list("id", flat=True))
+
+    def test_pages_follow_date_joined_and_id(self):
+        ids, last = self.walk()
+        self.assertEqual(ids, self.expected_ids("-date_joined", "-id"))
+        ids, last = self.walk(ordering="date_joined")
+        self.assertEqual(ids, self.expected_ids("date_joined", "id"))
+
+        # And back from the last page
+        previous = []
+        response = last
+        while response.data["previous"] is not None:
+            response = self.client.get(response.data["previous"])
+            previous = [row["id"] for row in response.data["data"]] + previous
+        self.assertEqual(previous + [row["id"] for row in last.data["data"]], ids)
+
+    def test_rows_written_meanwhile_do_not_shift_pages(self):
+        first = self.client.get("/users", {"page_size": 3})
+        AppUser.objects.create_user("newest@example.com", "pw", username="newest")
+        second = self.client.get(first.data["next"])
+        seen = [row["id"] for row in first.data["data"] + second.data["data"]]
+        self.assertEqual(seen, self.expected_ids("-date_joined", "-id")[1:7])
+
+    def test_never_counts(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.walk()
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+
+    def test_a_malformed_cursor_is_a_client_error(self):
+        response = self.client.get("/users", {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data["message"], "Invalid cursor")
+        self.assertFalse(response.data["success"])
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class JWTLoginTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        self.user = AppUser.objects.create_user(
+            "login@example.com", "pw-secret", username="login"
+        )
+
+    def login(self, password):
+        return self.client.post(
+            "/api/token/", {"email": "login@example.com", "password": password}
+        )
+
+    def test_verifies_the_password_once(self):
+        with mock.patch.object(
+            MD5PasswordHasher,
+            "verify",
+            autospec=True,
+            side_effect=MD5PasswordHasher.verify,
+        ) as verify:
+            response = self.login("pw-secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(response.data["data"]["email"], "login@example.com")
+
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.data['data']['access']}"
+        )
+        self.assertEqual(self.client.get(f"/users/{self.user.pk}").status_code, 200)
+
+    def test_rejects_wrong_passwords(self):
+        response = self.login("wrong")
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("access", response.data["data"])
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class RegistrationTests(TestCase):
+    client_class = APIClient
+
+    def register(self, **fields):
+        body = {"email": "new@example.com", "username": "new", "password": "Pw-12345!"}
+        return self.client.post("/users", {**body, **fields}, format="json")
+
+    def test_tokens_come_from_the_created_user(self):
+        with mock.patch.object(
+            MD5PasswordHasher,
+            "verify",
+            autospec=True,
+            side_effect=MD5PasswordHasher.verify,
+        ) as verify:
+            response = self.register()
+        self.assertEqual(response.status_code, 201)
+        # No second authentication against the hash that was just made
+        verify.assert_not_called()
+        self.assertNotIn("password", response.data["data"])
+
+        user = AppUser.objects.get(email="new@example.com")
+        self.assertIsNotNone(user.last_login)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.data['data']['access']}"
+        )
+        self.assertEqual(self.client.get(f"/users/{user.pk}").status_code, 200)
+
+    def test_rejects_taken_values(self):
+        self.assertEqual(self.register().status_code, 201)
+        response = self.register(username="other")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("email", response.data["message"])
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class AsyncHashingTests(TestCase):
+    def setUp(self):
+        AppUser.objects.create_user("login@example.com", "pw-secret", username="login")
+
+    async def post(self, path, body):
+        return await self.async_client.post(path, body, content_type="application/json")
+
+    async def test_jwt_login(self):
+        body = {"email": "login@example.com", "password": "pw-secret"}
+        response = await self.post("/async/api/token/", body)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("access", response.json()["data"])
+        body["password"] = "wrong"
+        self.assertEqual((await self.post("/async/api/token/", body)).status_code, 404)
+
+    async def test_registration_hashes_on_the_pool(self):
+        body = {"email": "new@example.com", "username": "new", "password": "Pw-12345!"}
+        response = await self.post("/async/users", body)
+        self.assertEqual(response.status_code, 201)
+        user = await AppUser.objects.aget(email="new@example.com")
+        self.assertTrue(user.password.startswith("md5$"))
+        self.assertTrue(await sync_to_async(user.check_password)("Pw-12345!"))
+
+    async def test_saturated_pool_answers_503(self):
+        with mock.patch(
+            "app_users.api.async_views.acheck_password",
+            side_effect=HashingPoolSaturated,
+        ):
+            response = await self.post(
+                "/async/api-token-auth/",
+                {"username": "login@example.com", "password": "pw-secret"},
+            )
+        self.assertEqual(response.status_code, 503)
+
+
+class HashingPoolTests(unittest.TestCase):
+    def test_rejects_jobs_beyond_its_backlog(self):
+        pool = HashingPool(workers=1, queue_depth=1)
+        self.addCleanup(pool.executor.shutdown)
+        running = [pool.submit(time.sleep, 0.5) for _ in range(2)]
+        with self.assertRaises(HashingPoolSaturated):
+            pool.submit(time.sleep, 0)
+        for future in running:
+            future.result()
+        self.assertEqual(pool.metrics()["rejected"], 1)
+        pool.submit(time.sleep, 0).result()
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class CachedTokenAuthenticationTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        caches["default"].clear()
+        token_cache.clear()
+        self.user = AppUser.objects.create_user(
+            "token@example.com", "pw", username="token"
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def get_detail(self):
+        return self.client.get(f"/users/{self.user.pk}")
+
+    def test_cached_token_needs_no_query(self):
+        self.assertEqual(self.get_detail().status_code, 200)
+        # The response is cached too, nothing left to query
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_detail().status_code, 200)
+
+    def test_deactivating_the_user_evicts_its_token(self):
+        self.assertEqual(self.get_detail().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_detail().status_code, 401)
+
+    def test_deleting_the_token_evicts_it(self):
+        self.assertEqual(self.get_detail().status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.get_detail().status_code, 401)
+
+    @mock.patch.dict(authentication._token_settings, {"SHARED_CACHE": "default"})
+    def test_deactivating_the_user_evicts_the_shared_entry(self):
+        # Cached by another process, this one never saw the token
+        token = Token.objects.select_related("user").get(pk=self.token.pk)
+        caches["default"].set(f"auth-token:{token.key}", (token.user, token))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_detail().status_code, 401)
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class CachedBasicAuthenticationTests(TestCase):
+    def setUp(self):
+        basic_auth_cache.clear()
+        self.user = AppUser.objects.create_user(
+            "basic@example.com", "pw-secret", username="basic"
+        )
+        self.authentication = CachedBasicAuthentication()
+
+    def authenticate(self, password):
+        return self.authentication.authenticate_credentials(
+            "basic@example.com", password
+        )
+
+    def test_verifies_the_password_once(self):
+        with mock.patch.object(
+            MD5PasswordHasher,
+            "verify",
+            autospec=True,
+            side_effect=MD5PasswordHasher.verify,
+        ) as verify:
+            for _ in range(3):
+                user, auth = self.authenticate("pw-secret")
+                self.assertEqual(user, self.user)
+        self.assertEqual(verify.call_count, 1)
+
+    def test_holds_no_credentials(self):
+        self.authenticate("pw-secret")
+        cached = pickle.dumps(list(basic_auth_cache._data)).decode("latin-1")
+        self.assertNotIn("pw-secret", cached)
+        self.assertNotIn("basic@example.com", cached)
+
+    def test_password_change_invalidates(self):
+        self.authenticate("pw-secret")
+        self.user.set_password("new-pw")
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate("pw-secret")
+        self.assertEqual(self.authenticate("new-pw")[0], self.user)
+
+    def test_wrong_passwords_are_not_cached(self):
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate("wrong")
+        self.assertEqual(len(basic_auth_cache), 0)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class CompiledReadSerializerTests(TestCase):
+    def setUp(self):
+        AppUser.objects.create_user("one@example.com", "pw", username="one")
+        AppUser.objects.create_user(
+            "two@example.com", "pw", username="two", last_login=timezone.now()
+        )
+        self.compiled = compile_read_serializer(AppUserSerializers)
+
+    def assertMatchesDRF(self):
+        queryset = AppUser.objects.order_by("id")
+        expected = AppUserSerializers(queryset, many=True).data
+        self.assertEqual(self.compiled.serialize_queryset(queryset), expected)
+        rows = self.compiled.values(queryset)
+        self.assertEqual(self.compiled.serialize_rows(rows), expected)
+
+    def test_matches_the_serializer(self):
+        self.assertMatchesDRF()
+        self.assertNotIn("password", self.compiled.names)
+
+    def test_follows_the_active_timezone(self):
+        with timezone.override("Asia/Kolkata"):
+            self.assertMatchesDRF()
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class RendererTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        caches["default"].clear()
+        admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin", first_name="Zo\u00eb\u2028"
+        )
+        self.client.force_authenticate(admin)
+
+    def test_json_matches_drf(self):
+        response = self.client.get("/users")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_renderer_matches_drf_for_other_types(self):
+        data = {"when": timezone.now().replace(microsecond=0), "amount": Decimal("1.5")}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_columnar(self):
+        listed = self.client.get("/users").data["data"]
+        response = self.client.get("/users", {"format": "columnar"})
+        data = json.loads(response.content)["data"]
+        self.assertEqual(data["header"], list(listed[0]))
+        self.assertEqual(data["rows"], [list(row.values()) for row in listed])
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        listed = self.client.get("/users").data["data"]
+        response = self.client.get("/users", headers={"accept": "application/msgpack"})
+        self.assertEqual(msgpack.unpackb(response.content)["data"], listed)
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class SparseFieldsetTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        caches["default"].clear()
+        self.admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        self.client.force_authenticate(self.admin)
+
+    def select_of(self, queries):
+        return next(
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("SELECT") and "app_users_appuser" in query["sql"]
+        )
+
+    def test_list_selects_only_the_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/users", {"fields": "email,username"})
+        self.assertEqual(
+            response.data["data"],
+            [{"email": "admin@example.com", "username": "admin"}],
+        )
+        self.assertIsNone(response.data["next"])
+        select = self.select_of(queries).split(" FROM ")[0]
+        self.assertNotIn("first_name", select)
+        self.assertNotIn("password", select)
+
+    def test_retrieve_and_exclude(self):
+        response = self.client.get(
+            f"/users/{self.admin.pk}", {"exclude": "date_joined,last_login"}
+        )
+        self.assertEqual(response.status_code, 200)
+        row = response.data["data"][0]
+        self.assertIn("email", row)
+        self.assertNotIn("date_joined", row)
+        self.assertNotIn("last_login", row)
+
+    def test_cached_responses_keep_their_fieldset(self):
+        self.client.get("/users")
+        response = self.client.get("/users", {"fields": "id"})
+        self.assertEqual(response.data["data"], [{"id": self.admin.pk}])
+
+    def test_rejects_unknown_fields(self):
+        response = self.client.get("/users", {"fields": "email,password"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", str(response.data["message"]))
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class SearchTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        self.alice = AppUser.objects.create_user(
+            "alice@example.com", "pw", username="alice", mobile="5550001"
+        )
+        AppUser.objects.create_user(
+            "alicia@example.org", "pw", username="alicia", last_name="Keys"
+        )
+        self.client.force_authenticate(admin)
+
+    def search(self, q, **params):
+        response = self.client.get("/users/search", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def emails(self, q):
+        return {row["email"] for row in self.search(q).data["data"]}
+
+    def test_matches_substrings_of_every_field(self):
+        self.assertEqual(
+            self.emails("lic"), {"alice@example.com", "alicia@example.org"}
+        )
+        self.assertEqual(self.emails("0001"), {"alice@example.com"})
+        self.assertEqual(self.emails("keys"), {"alicia@example.org"})
+        # Every term must match
+        self.assertEqual(self.emails("lic example.org"), {"alicia@example.org"})
+
+    def test_index_follows_updates_and_deletes(self):
+        self.alice.last_name = "Liddell"
+        self.alice.save()
+        self.assertEqual(self.emails("liddell"), {"alice@example.com"})
+        self.alice.delete()
+        self.assertEqual(self.emails("liddell"), set())
+
+    def test_pages(self):
+        first = self.search("lic", page_size=1)
+        self.assertEqual(len(first.data["data"]), 1)
+        second = self.client.get(first.data["next"])
+        self.assertIsNone(second.data["next"])
+        self.assertNotEqual(first.data["data"], second.data["data"])
+
+    def test_rejects_short_terms(self):
+        response = self.client.get("/users/search", {"q": "al"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class AsyncUserViewTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        self.user = AppUser.objects.create_user(
+            "owner@example.com", "pw", username="owner"
+        )
+        self.other = AppUser.objects.create_user(
+            "other@example.com", "pw", username="other"
+        )
+
+    def headers(self, user):
+        access = CustomTokenObtainPairSerializer.get_token(user).access_token
+        return {"authorization": f"Bearer {access}"}
+
+    def test_list_matches_the_sync_view(self):
+        params = {"page_size": 2, "fields": "id,email"}
+        sync = self.client.get("/users", params, headers=self.headers(self.admin))
+        response = self.client.get(
+            "/async/users", params, headers=self.headers(self.admin)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"], sync.json()["data"])
+        next_page = self.client.get(
+            response.json()["next"], headers=self.headers(self.admin)
+        )
+        self.assertEqual(len(next_page.json()["data"]), 1)
+        self.assertEqual(
+            self.client.get(
+                "/async/users", headers=self.headers(self.user)
+            ).status_code,
+            403,
+        )
+        self.assertEqual(self.client.get("/async/users").status_code, 401)
+        garbage = self.client.get(
+            "/async/users", {"cursor": "garbage"}, headers=self.headers(self.admin)
+        )
+        self.assertEqual(garbage.status_code, 404)
+        self.assertEqual(garbage.json()["message"], "Invalid cursor")
+
+    def test_detail_permissions_and_etag(self):
+        path = f"/async/users/{self.user.pk}"
+        response = self.client.get(path, headers=self.headers(self.user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"][0]["email"], "owner@example.com")
+        conditional = self.client.get(
+            path, headers={**self.headers(self.user), "if-none-match": response["ETag"]}
+        )
+        self.assertEqual(conditional.status_code, 304)
+        self.assertEqual(
+            self.client.get(path, headers=self.headers(self.other)).status_code, 403
+        )
+        missing = self.client.get(
+            "/async/users/999999", headers=self.headers(self.admin)
+        )
+        self.assertEqual(missing.status_code, 404)
+
+    def test_update_and_delete(self):
+        path = f"/async/users/{self.user.pk}"
+        response = self.client.patch(
+            path,
+            {"first_name": "Changed"},
+            content_type="application/json",
+            headers=self.headers(self.user),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Changed")
+
+        response = self.client.delete(path, headers=self.headers(self.admin))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(AppUser.objects.filter(pk=self.user.pk).exists())
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    def open(self, name):
+        wrapper = DatabaseWrapper({**connection.settings_dict, "NAME": name}, "tuned")
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_new_connections_are_tuned(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        wrapper = self.open(os.path.join(directory.name, "db.sqlite3"))
+        self.assertEqual(self.pragma(wrapper, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(wrapper, "synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma(wrapper, "busy_timeout"), 5000)
+
+    @override_settings(SQLITE_PRAGMAS={"mmap_size": None, "busy_timeout": 100})
+    def test_settings_override_the_defaults(self):
+        pragmas = get_sqlite_pragmas()
+        self.assertNotIn("mmap_size", pragmas)
+        self.assertEqual(pragmas["busy_timeout"], 100)
+        self.assertEqual(pragmas["journal_mode"], "wal")
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+class ReadReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.router = ReadReplicaRouter()
+        self.lags = {"replica1": 0, "replica2": 60}
+        self.enterContext(
+            mock.patch("app_users.routers.replica_lag", side_effect=self.lags.get)
+        )
+
+    def test_reads_go_to_fresh_replicas(self):
+        self.assertEqual(self.router.db_for_read(AppUser), "replica1")
+        self.assertEqual(self.router.db_for_write(AppUser), "default")
+        # Only the user tables are replicated
+        self.assertIsNone(self.router.db_for_read(RevokedToken))
+        self.lags["replica1"] = 60
+        self.assertEqual(self.router.db_for_read(AppUser), "default")
+
+    def route(self, method, headers=None):
+        """Where the request's read goes, PATCH requests then write."""
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(AppUser))
+            if request.method == "PATCH":
+                self.router.db_for_write(AppUser)
+            return HttpResponse()
+
+        request = RequestFactory().generic(method, "/users/1", headers=headers)
+        ReplicaRoutingMiddleware(view)(request)
+        return seen[0]
+
+    def test_writers_stay_on_the_primary(self):
+        headers = {"authorization": "Token abc"}
+        self.assertEqual(self.route("GET", headers), "replica1")
+        self.assertEqual(self.route("PATCH", headers), "default")
+        # Sticky for the same credentials, not for others
+        self.assertEqual(self.route("GET", headers), "default")
+        self.assertEqual(
+            self.route("GET", {"authorization": "Token other"}), "replica1"
+        )
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"], PASSWORD_HASHERS=FAST_HASHERS)
+class LaggingReplicaAuthTests(TestCase):
+    """Auth reads with a replica none of the test's rows have reached yet."""
+
+    def setUp(self):
+        caches["default"].clear()
+        token_cache.clear()
+        self.user = AppUser.objects.create_user(
+            "replica@example.com", "pw", username="replica"
+        )
+        auth_versions.clear()
+        self.enterContext(mock.patch("app_users.routers.replica_lag", return_value=0))
+        # Outside the test's transaction as far as the router can tell
+        self.enterContext(
+            mock.patch.object(
+                routers,
+                "connections",
+                {"default": SimpleNamespace(in_atomic_block=False)},
+            )
+        )
+        fetch_all = QuerySet._fetch_all
+
+        def lagging_fetch_all(queryset):
+            if queryset.db == "replica1":
+                queryset._result_cache = []
+            else:
+                fetch_all(queryset)
+
+        self.enterContext(mock.patch.object(QuerySet, "_fetch_all", lagging_fetch_all))
+
+    def test_a_user_missing_on_the_replica_is_read_from_the_primary(self):
+        self.assertEqual(get_auth_version(self.user.pk), self.user.auth_version)
+        self.assertEqual(auth_versions.get(self.user.pk), self.user.auth_version)
+
+    def test_a_token_missing_on_the_replica_is_read_from_the_primary(self):
+        token = Token.objects.create(user=self.user)
+        user, _ = CachedTokenAuthentication().authenticate_credentials(token.key)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_sticky_users_are_pinned_before_their_auth_read(self):
+        caches["default"].set(f"replica-sticky:user:{self.user.pk}", time.time())
+        access = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        seen = []
+
+        def view(request):
+            VersionedJWTAuthentication().authenticate(request)
+            seen.append(ReadReplicaRouter().db_for_read(AppUser))
+            return HttpResponse()
+
+        request = RequestFactory().get(
+            "/users", headers={"authorization": f"Bearer {access}"}
+        )
+        ReplicaRoutingMiddleware(view)(request)
+        self.assertEqual(seen, ["default"])
+
+
+class ShardingTests(TestCase):
+    def setUp(self):
+        reset_bucket_map()
+        self.addCleanup(reset_bucket_map)
+
+    def test_plan_moves_only_what_the_new_shard_needs(self):
+        current = default_bucket_map(["shard1", "shard2"])
+        target = plan_buckets(current, ["shard1", "shard2", "shard3"])
+        counts = Counter(target)
+        self.assertLessEqual(max(counts.values()) - min(counts.values()), 1)
+        moved = [
+            bucket for bucket, alias in enumerate(target) if alias != current[bucket]
+        ]
+        self.assertTrue(all(target[bucket] == "shard3" for bucket in moved))
+        self.assertEqual(len(moved), counts["shard3"])
+
+    def test_merge_keeps_the_shard_order(self):
+        merged = merge_streams([[1, 4, 9], [2, 3], [5]], key=lambda value: value)
+        self.assertEqual(list(merged), [1, 2, 3, 4, 5, 9])
+        merged = merge_streams([[9, 1], [5, 2]], key=lambda value: value, reverse=True)
+        self.assertEqual(list(merged), [9, 5, 2, 1])
+
+    @override_settings(USER_SHARDS=[])
+    def test_without_shards_everything_stays_on_default(self):
+        self.assertIsNone(new_user_id())
+        self.assertEqual(user_database(123), "default")
+        queryset = AppUser.objects.all()
+        self.assertEqual(shard_querysets(queryset), [queryset])
+
+    @override_settings(USER_SHARDS=["shard1", "shard2"])
+    def test_users_and_their_rows_share_a_shard(self):
+        router = UserShardRouter()
+        user = AppUser(pk=1234)
+        shard = shard_for_id(1234)
+        self.assertIn(shard, ["shard1", "shard2"])
+        self.assertEqual(shard, user_database(1234))
+        self.assertEqual(router.db_for_write(AppUser, instance=user), shard)
+        token = Token(user_id=1234)
+        self.assertEqual(router.db_for_write(Token, instance=token), shard)
+        self.assertTrue(router.allow_relation(user, token))
+        # The bookkeeping tables only live on the default database
+        self.assertFalse(router.allow_migrate("shard1", "app_users", "usershardbucket"))
+
+    @override_settings(USER_SHARDS=["shard1", "shard2"])
+    def test_moved_buckets_route_to_their_new_shard(self):
+        bucket = bucket_for_id(1234)
+        UserShardBucket.objects.create(bucket=bucket, database="shard3")
+        self.assertEqual(shard_for_id(1234), "shard3")
+        self.assertIn("shard3", get_user_databases())
+
+
+# Aliases added by SQLITE_SHARDS=2, the tests needing them are skipped otherwise
+TEST_SHARDS = {"shard1", "shard2"} & set(settings.DATABASES)
+
+
+@unittest.skipUnless(len(TEST_SHARDS) == 2, "needs SQLITE_SHARDS=2")
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, USER_SHARDS=["shard1", "shard2"])
+class ShardedRegistrationTests(TestCase):
+    databases = {"default", *TEST_SHARDS}
+
+    def setUp(self):
+        reset_bucket_map()
+        self.addCleanup(reset_bucket_map)
+        # First ids of each shard, set by hand like new_user_id() would
+        ids = {}
+        for user_id in itertools.count(1):
+            ids.setdefault(shard_for_id(user_id), user_id)
+            if len(ids) == 2:
+                break
+        self.first_id, self.second_id = ids["shard1"], ids["shard2"]
+
+    def register(self, user_id, email, username):
+        user = AppUser(pk=user_id, email=email, username=username)
+        user.set_password("secret-password")
+        return save_new_user(user)
+
+    def test_an_email_taken_on_another_shard_is_rejected(self):
+        self.register(self.first_id, "dup@example.com", "first")
+        # Past the validator, like a registration racing the first one
+        with self.assertRaises(ValidationError) as raised:
+            self.register(self.second_id, "dup@example.com", "second")
+        self.assertEqual(list(raised.exception.detail), ["email"])
+        self.assertFalse(AppUser.objects.using("shard2").exists())
+        self.assertEqual(UserUniqueValue.objects.count(), 2)
+
+    def test_the_validator_sees_every_shard(self):
+        self.register(self.first_id, "dup@example.com", "first")
+        serializer = AppUserSerializers(
+            data={
+                "email": "dup@example.com",
+                "username": "first",
+                "password": "secret-password",
+            }
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(set(serializer.errors), {"email", "username"})
+
+    def test_renamed_and_deleted_users_free_their_values(self):
+        user = self.register(self.first_id, "old@example.com", "first")
+        user.email = "new@example.com"
+        user.save()
+        self.register(self.second_id, "old@example.com", "second")
+        third_id = max(self.first_id, self.second_id) + 1
+        with self.assertRaises(ValidationError):
+            self.register(third_id, "new@example.com", "third")
+        user.delete()
+        self.assertEqual(
+            set(UserUniqueValue.objects.values_list("value", flat=True)),
+            {"old@example.com", "second"},
+        )
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        last_login_buffer._pending.clear()
+        self.user = AppUser.objects.create_user("wb@example.com", "pw", username="wb")
+
+    def stored_last_login(self):
+        return AppUser.objects.values_list("last_login", flat=True).get(pk=self.user.pk)
+
+    def test_logins_are_written_on_flush(self):
+        self.client.login(email="wb@example.com", password="pw")
+        self.assertIsNone(self.stored_last_login())
+        logged_in_at = last_login_buffer._pending[self.user.pk]["last_login"]
+        self.assertEqual(last_login_buffer.flush(), 1)
+        self.assertEqual(self.stored_last_login(), logged_in_at)
+
+    def test_values_only_move_forward(self):
+        newer = timezone.now()
+        AppUser.objects.filter(pk=self.user.pk).update(last_login=newer)
+        last_login_buffer.set(self.user.pk, last_login=newer - timedelta(hours=1))
+        last_login_buffer.flush()
+        self.assertEqual(self.stored_last_login(), newer)
+
+    def test_flush_evicts_cached_responses(self):
+        admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        etag = client.get(f"/users/{self.user.pk}")["ETag"]
+        update_last_login(None, self.user)
+        last_login_buffer.flush()
+        response = client.get(f"/users/{self.user.pk}", headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.data["data"][0]["last_login"])
+
+
+class SingleWriterTests(SimpleTestCase):
+    databases = {"default"}
+
+    def setUp(self):
+        self.writer = SingleWriter("default", batch_size=10)
+        self.addCleanup(self.writer.close)
+        self.batches = []
+
+    def write(self, jobs):
+        items = [item for context, item in jobs]
+        self.batches.append(items)
+        return [ValueError(item) if item == "bad" else item.upper() for item in items]
+
+    def test_queued_items_share_a_commit(self):
+        release = threading.Event()
+
+        def blocking_write(jobs):
+            release.wait(5)
+            return [None for _ in jobs]
+
+        first = self.writer.submit(blocking_write, "first")
+        futures = [self.writer.submit(self.write, item) for item in ("a", "b", "c")]
+        release.set()
+        first.result(5)
+        self.assertEqual([future.result(5) for future in futures], ["A", "B", "C"])
+        self.assertEqual(self.batches, [["a", "b", "c"]])
+        self.assertEqual(self.writer.batches, 2)
+
+    def test_failures_stay_with_their_item(self):
+        futures = [self.writer.submit(self.write, item) for item in ("ok", "bad")]
+        self.assertEqual(futures[0].result(5), "OK")
+        with self.assertRaises(ValueError):
+            futures[1].result(5)
+
+    def test_a_failed_batch_fails_every_item(self):
+        def broken_write(jobs):
+            raise RuntimeError("boom")
+
+        with self.assertRaises(RuntimeError):
+            self.writer.run(broken_write, "item")
+        self.assertEqual(self.writer.run(self.write, "next"), "NEXT")
+
+    def test_not_used_inside_the_caller_s_transaction(self):
+        self.assertTrue(use_writer("default"))
+        with transaction.atomic():
+            # The writer would wait for the lock the caller holds
+            self.assertFalse(use_writer("default"))
+
+
+class BackgroundThreadTests(unittest.TestCase):
+    def test_one_thread_per_process(self):
+        runs = []
+        thread = BackgroundThread(lambda: runs.append(os.getpid()), name="test")
+        thread.ensure_started()
+        thread.ensure_started()
+        thread.detach().join(5)
+        self.assertEqual(runs, [os.getpid()])
+        # Started again once detached, as in a forked worker
+        thread.ensure_started()
+        thread.detach().join(5)
+        self.assertEqual(len(runs), 2)
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class LazyTokenTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        token_cache.clear()
+        token_use_buffer._pending.clear()
+
+    def test_created_on_the_first_token_login(self):
+        response = self.client.post(
+            "/users",
+            {"email": "lazy@example.com", "username": "lazy", "password": "Pw-12345!"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Token.objects.exists())
+
+        keys = []
+        for _ in range(2):
+            response = self.client.post(
+                "/api-token-auth/",
+                {"username": "lazy@example.com", "password": "Pw-12345!"},
+            )
+            self.assertEqual(response.status_code, 200)
+            keys.append(response.data["data"][0]["token"])
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(Token.objects.get().key, keys[0])
+
+    def test_prune_deletes_unused_tokens(self):
+        old = timezone.now() - timedelta(days=60)
+        unused, used, new = (
+            Token.objects.create(
+                user=AppUser.objects.create_user(
+                    f"{name}@example.com", "pw", username=name
+                )
+            )
+            for name in ("unused", "used", "new")
+        )
+        Token.objects.filter(pk__in=[unused.pk, used.pk]).update(created=old)
+        # Ids repeat between tests, a use recorded by another one must not hide this
+        with mock.patch("app_users.api.tokens._recent_uses", LRUCache()):
+            self.client.credentials(HTTP_AUTHORIZATION=f"Token {used.key}")
+            self.assertEqual(self.client.get(f"/users/{used.user_id}").status_code, 200)
+
+        call_command("prune_auth_tokens", stdout=StringIO())
+        self.assertEqual(
+            set(Token.objects.values_list("key", flat=True)), {used.key, new.key}
+        )
+        # Its cached entry went with it
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {unused.key}")
+        self.assertEqual(self.client.get(f"/users/{unused.user_id}").status_code, 401)
+
+
+handled_events = []
+
+
+def record_event(event):
+    handled_events.append(event.payload)
+
+
+def failing_handler(event):
+    raise RuntimeError("unavailable")
+
+
+@override_settings(ALLOWED_HOSTS=["*"], PASSWORD_HASHERS=FAST_HASHERS)
+class OutboxTests(TestCase):
+    client_class = APIClient
+
+    def setUp(self):
+        handled_events.clear()
+        handlers = {outbox.USER_CREATED: [f"{__name__}.record_event"]}
+        self.enterContext(mock.patch.dict(outbox._settings, {"HANDLERS": handlers}))
+
+    def register(self, email="new@example.com", username="new"):
+        body = {"email": email, "username": username, "password": "Pw-12345!"}
+        return self.client.post("/users", body, format="json")
+
+    def test_registration_queues_the_side_effects(self):
+        self.assertEqual(self.register().status_code, 201)
+        user = AppUser.objects.get(email="new@example.com")
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.user_id, user.pk)
+        self.assertEqual(handled_events, [])
+
+        self.assertEqual(outbox.OutboxWorker().drain(), 1)
+        self.assertEqual(
+            handled_events,
+            [{"user_id": user.pk, "email": "new@example.com", "username": "new"}],
+        )
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_bulk_registration_queues_one_event_per_user(self):
+        admin = AppUser.objects.create_superuser(
+            "admin@example.com", "pw", username="admin"
+        )
+        OutboxEvent.objects.all().delete()
+        self.client.force_authenticate(admin)
+        items = [
+            {"email": f"u{i}@example.com", "username": f"u{i}", "password": "Pw-12345!"}
+            for i in range(3)
+        ]
+        self.assertEqual(
+            self.client.post("/users/bulk", items, format="json").status_code, 201
+        )
+        self.assertEqual(OutboxEvent.objects.count(), 3)
+
+    def test_rolled_back_changes_queue_nothing(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            AppUser.objects.create_user("gone@example.com", "pw", username="gone")
+            raise RuntimeError
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_failures_back_off_then_give_up(self):
+        handlers = {outbox.USER_CREATED: [f"{__name__}.failing_handler"]}
+        outbox._settings["HANDLERS"] = handlers
+        self.assertEqual(self.register().status_code, 201)
+        worker = outbox.OutboxWorker()
+        with self.assertLogs("app_users.outbox", "WARNING"):
+            self.assertEqual(worker.run_once(), 1)
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.attempts, 1)
+        self.assertEqual(event.status, OutboxEvent.PENDING)
+        self.assertGreater(event.available_at, timezone.now())
+        # Not due yet
+        self.assertEqual(worker.run_once(), 0)
+
+        OutboxEvent.objects.update(
+            attempts=outbox._settings["MAX_ATTEMPTS"] - 1, available_at=timezone.now()
+        )
+        with self.assertLogs("app_users.outbox", "WARNING"):
+            worker.run_once()
+        self.assertEqual(OutboxEvent.objects.get().status, OutboxEvent.FAILED)
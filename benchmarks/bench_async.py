@@ -0,0 +1,111 @@
+"""
+Load test of the user endpoints under three setups, at rising concurrency:
+sync WSGI (DRF views, one thread per in-flight request), sync under ASGI (DRF
+views through Django's sync_to_async hop) and native async (async_views.py).
+
+Requests go through Django's own WSGI / ASGI handlers in process, so the numbers
+include routing, middleware, auth and the ORM but no server or network. Every
+list request has a unique query string so the response cache never answers.
+Pass --requests / --concurrency to change the load.
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import test_database
+
+from django.test import AsyncClient, Client
+from rest_framework.authtoken.models import Token
+
+import app_users.api.urls  # noqa: F401, connects the signals
+from app_users.models import AppUser
+
+
+PASSWORD = "pbkdf2_sha256$720000$bench$0000000000000000000000000000000000000000000="
+SCENARIOS = {
+    # name -> (sync path, async path), {i} makes every URI unique
+    "retrieve": ("/users/{pk}", "/async/users/{pk}"),
+    "list": ("/users?page_size=20&n={i}", "/async/users?page_size=20&n={i}"),
+}
+
+
+def populate(count):
+    AppUser.objects.bulk_create(
+        [
+            AppUser(
+                email=f"user{i}@example.com", username=f"user{i}", password=PASSWORD
+            )
+            for i in range(count)
+        ],
+        batch_size=1000,
+    )
+    return AppUser.objects.create_superuser("bench@example.com", "bench-password")
+
+
+def run_wsgi(path, headers, requests, concurrency):
+    client = Client(headers=headers)
+
+    def call(i):
+        response = client.get(path.format(i=i))
+        assert response.status_code == 200, response.content
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        list(executor.map(call, range(requests)))
+        return time.perf_counter() - start
+
+
+async def run_asgi(path, headers, requests, concurrency):
+    # Default headers of AsyncClient are not applied in Django 5.0, pass them per call
+    client = AsyncClient()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def call(i):
+        async with slots:
+            response = await client.get(path.format(i=i), headers=headers)
+            assert response.status_code == 200, response.content
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(requests)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    args = parser.parse_args()
+
+    with test_database():
+        admin = populate(1000)
+        token = Token.objects.get_or_create(user=admin)[0].key
+        headers = {"Authorization": f"Token {token}"}
+
+        for name, (sync_path, async_path) in SCENARIOS.items():
+            sync_path = sync_path.replace("{pk}", str(admin.pk))
+            async_path = async_path.replace("{pk}", str(admin.pk))
+            for concurrency in args.concurrency:
+                results = {
+                    "sync WSGI": run_wsgi(
+                        sync_path, headers, args.requests, concurrency
+                    ),
+                    "sync under ASGI": asyncio.run(
+                        run_asgi(sync_path, headers, args.requests, concurrency)
+                    ),
+                    "native async": asyncio.run(
+                        run_asgi(async_path, headers, args.requests, concurrency)
+                    ),
+                }
+                print(
+                    f"{name:>8} c={concurrency:<4}"
+                    + "".join(
+                        f" {label}: {args.requests / elapsed:7.1f} req/s"
+                        for label, elapsed in results.items()
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
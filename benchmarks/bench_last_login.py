@@ -0,0 +1,129 @@
+"""
+JWT logins (POST /api/token/) with SIMPLE_JWT["UPDATE_LAST_LOGIN"] on, next to
+writers registering users, against a file-backed SQLite database with the
+production profile of bench_sqlite_concurrency.py.
+Compares saving last_login during the login with the write-behind buffer
+(app_users/api/write_behind.py). Prints logins/s, the login latency
+percentiles and the "database is locked" errors.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_sqlite_concurrency import profile, request, serve
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.wsgi import get_wsgi_application
+from rest_framework_simplejwt.settings import api_settings
+
+import app_users.api.urls  # noqa: F401, connects the signals
+from app_users.api import write_behind
+from app_users.models import AppUser
+
+
+USERS = 200
+
+
+def run_load(port, logins, writers, duration):
+    stats = {"logins": [], "writes": 0, "locked": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    headers = {"Content-Type": "application/json"}
+
+    def record(status, body, expected):
+        if status == expected:
+            return True
+        with lock:
+            if b"database is locked" in body:
+                stats["locked"] += 1
+            else:
+                stats["errors"] += 1
+        return False
+
+    def login(worker):
+        i = 0
+        while time.monotonic() < deadline:
+            body = json.dumps(
+                {
+                    "email": f"user{(worker * 7 + i) % USERS}@example.com",
+                    "password": "pw",
+                }
+            )
+            start = time.perf_counter()
+            status, content = request(port, "POST", "/api/token/", headers, body)
+            if record(status, content, 200):
+                with lock:
+                    stats["logins"].append(time.perf_counter() - start)
+            i += 1
+
+    def writer(worker):
+        i = 0
+        while time.monotonic() < deadline:
+            body = json.dumps(
+                {
+                    "email": f"w{worker}-{i}@example.com",
+                    "username": f"w{worker}-{i}",
+                    "password": "bench-password",
+                }
+            )
+            if record(*request(port, "POST", "/users", headers, body), 201):
+                with lock:
+                    stats["writes"] += 1
+            i += 1
+
+    threads = [threading.Thread(target=login, args=(n,)) for n in range(logins)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    application = get_wsgi_application()
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    settings.ALLOWED_HOSTS = ["*"]
+    api_settings.UPDATE_LAST_LOGIN = True
+    password = make_password("pw", "bench", "md5")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, enabled in (("on login", False), ("write-behind", True)):
+            write_behind._settings["ENABLED"] = enabled
+            with profile("production", Path(directory) / "db.sqlite3"):
+                AppUser.objects.bulk_create(
+                    AppUser(
+                        email=f"user{i}@example.com",
+                        username=f"user{i}",
+                        password=password,
+                    )
+                    for i in range(USERS)
+                )
+                with serve(application, args.logins + args.writers) as port:
+                    stats = run_load(port, args.logins, args.writers, args.duration)
+                write_behind.last_login_buffer.flush()
+                latencies = sorted(stats["logins"]) or [0]
+                print(
+                    f"{name:>12}: {len(stats['logins']) / args.duration:7.1f} logins/s"
+                    f" p50 {statistics.median(latencies) * 1000:6.1f} ms"
+                    f" p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms"
+                    f" {stats['writes'] / args.duration:6.1f} writes/s"
+                    f" {stats['locked']:4d} locked {stats['errors']:4d} other errors"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Hashes per login and logins per second for POST /api/token/,
+before (authenticate() + serializer.is_valid()) and after (single pass).
+"""
+
+from common import count_calls, test_database, timed
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework.test import APIClient
+
+from app_users.api.serializers import (
+    AppUserSerializers,
+    CustomTokenObtainPairSerializer,
+)
+from app_users.models import AppUser
+
+
+ITERATIONS = 20
+CREDENTIALS = {"email": "bench@example.com", "password": "bench-password"}
+
+
+def legacy_login():
+    # The previous CustomJWTPairToken.post flow
+    user = authenticate(**CREDENTIALS)
+    serializer = CustomTokenObtainPairSerializer(data=CREDENTIALS)
+    if user is not None and serializer.is_valid():
+        return {**serializer.validated_data, **AppUserSerializers(user).data}
+
+
+def main():
+    with test_database():
+        AppUser.objects.create_user(username="bench", **CREDENTIALS)
+        client = APIClient()
+
+        def current_login():
+            response = client.post("/api/token/", CREDENTIALS, format="json")
+            assert response.status_code == 200, response.content
+
+        for name, login in (("before", legacy_login), ("after", current_login)):
+            with count_calls(PBKDF2PasswordHasher, "verify") as calls:
+                login()
+            rate = timed(login, ITERATIONS)
+            print(
+                f"{name:>6}: {calls['count']} hash(es) per login, {rate:.2f} logins/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Concurrent registrations (POST /users) with a slow side effect per new user
+(--delay ms, e.g. a welcome mail), once run inline by a post_save receiver and
+once queued in the outbox (app_users/outbox.py) and run by an OutboxWorker
+with --threads threads in this process. File-backed SQLite, production profile.
+Prints registrations/s, the latency percentiles, the side effects run during
+the load and how long the worker took to run the ones left afterwards.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_sqlite_concurrency import profile, request, serve
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save
+
+import app_users.api.urls  # noqa: F401, connects the signals
+from app_users import outbox
+from app_users.api import writer as single_writer
+from app_users.models import AppUser, OutboxEvent
+
+DELAY = 0.02
+side_effects = 0
+side_effects_lock = threading.Lock()
+
+
+def slow_side_effect(event=None):
+    global side_effects
+    time.sleep(DELAY)
+    with side_effects_lock:
+        side_effects += 1
+
+
+def inline_side_effect(sender, instance=None, created=False, **kwargs):
+    if created:
+        slow_side_effect()
+
+
+def run_load(port, writers, duration):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def writer(worker):
+        nonlocal errors
+        i = 0
+        while time.monotonic() < deadline:
+            body = json.dumps(
+                {
+                    "email": f"w{worker}-{i}@example.com",
+                    "username": f"w{worker}-{i}",
+                    "password": "bench-password",
+                }
+            )
+            headers = {"Content-Type": "application/json"}
+            start = time.perf_counter()
+            try:
+                status, _ = request(port, "POST", "/users", headers, body)
+            except OSError:
+                status = None  # e.g. reset, the server's listen backlog is full
+            with lock:
+                if status == 201:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def pending_events():
+    return OutboxEvent.objects.using(DEFAULT_DB_ALIAS).count()
+
+
+def main():
+    global DELAY, side_effects
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=4, help="outbox workers")
+    parser.add_argument("--delay", type=float, default=20, help="ms")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rounds", type=int, default=2, help="even")
+    args = parser.parse_args()
+    DELAY = args.delay / 1000
+
+    application = get_wsgi_application()
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    logging.getLogger("app_users.outbox").setLevel(logging.CRITICAL)
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    settings.ALLOWED_HOSTS = ["*"]
+    handlers = {outbox.USER_CREATED: [f"{__name__}.slow_side_effect"]}
+    modes = [("inline", False), ("outbox", True)]
+    with tempfile.TemporaryDirectory() as directory:
+        # Later runs come out slower on a busy machine, alternate the order
+        for name, queued in (modes + modes[::-1]) * (args.rounds // 2):
+            outbox._settings["HANDLERS"] = handlers if queued else {}
+            if not queued:
+                post_save.connect(
+                    inline_side_effect, sender=AppUser, dispatch_uid="bench_inline"
+                )
+            worker = outbox.OutboxWorker(threads=args.threads)
+            side_effects = 0
+            with profile("production", Path(directory) / "db.sqlite3"):
+                if queued:
+                    worker.start()
+                with serve(application, args.writers) as port:
+                    latencies, errors = run_load(port, args.writers, args.duration)
+                during = side_effects
+                start = time.perf_counter()
+                while queued and pending_events():
+                    time.sleep(0.05)
+                drain = time.perf_counter() - start
+                if queued:
+                    worker.stop()
+                # Their connections must not outlive the test database
+                single_writer.close_writers()
+            post_save.disconnect(sender=AppUser, dispatch_uid="bench_inline")
+            latencies = sorted(latencies) or [0]
+            print(
+                f"{name:>6}: {len(latencies) / args.duration:7.1f} signups/s"
+                f" p50 {statistics.median(latencies) * 1000:6.1f} ms"
+                f" p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms"
+                f" {errors:4d} errors"
+                f" {during:6d} side effects during the load,"
+                f" {side_effects - during:6d} after in {drain:5.1f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
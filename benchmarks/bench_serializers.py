@@ -0,0 +1,73 @@
+"""
+DRF AppUserSerializers(many=True) against the compiled read path, at 1k / 10k / 100k
+rows. The rendered JSON of both must be byte-identical.
+"""
+
+import time
+from datetime import timedelta
+
+from common import test_database
+
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from app_users.api.read_serializers import compile_read_serializer
+from app_users.api.serializers import AppUserSerializers
+from app_users.models import AppUser
+
+
+SIZES = (1_000, 10_000, 100_000)
+# Any valid hash will do, the benchmark never checks passwords
+PASSWORD = "pbkdf2_sha256$720000$bench$0000000000000000000000000000000000000000000="
+
+
+def populate(count):
+    now = timezone.now()
+    existing = AppUser.objects.count()
+    AppUser.objects.bulk_create(
+        [
+            AppUser(
+                email=f"user{i}@example.com",
+                username=f"user{i}",
+                password=PASSWORD,
+                first_name="Bench",
+                last_login=now if i % 2 else None,
+                date_joined=now - timedelta(seconds=i),
+            )
+            for i in range(existing, count)
+        ],
+        batch_size=1000,
+    )
+
+
+def measure(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    renderer = JSONRenderer()
+    read_serializer = compile_read_serializer(AppUserSerializers)
+
+    with test_database():
+        for size in SIZES:
+            populate(size)
+            queryset = AppUser.objects.order_by("id")
+
+            drf, drf_time = measure(
+                lambda: renderer.render(AppUserSerializers(queryset, many=True).data)
+            )
+            fast, fast_time = measure(
+                lambda: renderer.render(read_serializer.serialize_queryset(queryset))
+            )
+            assert drf == fast, f"output differs at {size} rows"
+            print(
+                f"{size:>7} rows: drf {drf_time * 1000:8.1f} ms, "
+                f"compiled {fast_time * 1000:8.1f} ms, "
+                f"{drf_time / fast_time:4.1f}x, identical"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Concurrent registrations (POST /users) against one file-backed SQLite database
+and against the user shards, each shard a SQLite file with its own write lock.
+Run with SQLITE_SHARDS=N in the environment, e.g.
+
+    SQLITE_SHARDS=4 python benchmarks/bench_sharding.py --writers 16
+
+Served over HTTP by the pooled WSGI server of bench_sqlite_concurrency.py with
+the production SQLite profile. Passwords use the MD5 hasher so the writers are
+bound by the database. Also times a full users list and export, which fan out
+to every shard.
+"""
+
+import argparse
+import json
+import logging
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from bench_sqlite_concurrency import request, serve
+from common import test_database
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from rest_framework.authtoken.models import Token
+
+import app_users.api.urls  # noqa: F401, connects the signals
+from app_users.api.availability import availability_index
+from app_users.models import AppUser
+from app_users.sharding import reset_bucket_map, user_id_allocator
+
+
+@contextmanager
+def profile(shards, directory):
+    settings.USER_SHARDS = shards
+    # Threads build their connections from settings.DATABASES
+    for alias in settings.DATABASES:
+        name = str(Path(directory) / f"{alias}.sqlite3")
+        settings.DATABASES[alias]["TEST"]["NAME"] = name
+        connections[alias].settings_dict["TEST"]["NAME"] = name
+    reset_bucket_map()
+    user_id_allocator.reset()
+    availability_index.reset()
+    with test_database():
+        yield
+
+
+def run_writes(port, writers, duration):
+    stats = {"writes": 0, "locked": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def writer(worker):
+        i = 0
+        while time.monotonic() < deadline:
+            body = json.dumps(
+                {
+                    "email": f"w{worker}-{i}@example.com",
+                    "username": f"w{worker}-{i}",
+                    "password": "bench-password",
+                }
+            )
+            headers = {"Content-Type": "application/json"}
+            status, content = request(port, "POST", "/users", headers, body)
+            with lock:
+                if status == 201:
+                    stats["writes"] += 1
+                elif b"database is locked" in content:
+                    stats["locked"] += 1
+                else:
+                    stats["errors"] += 1
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def time_reads(port, token):
+    auth = {"Authorization": f"Token {token}"}
+    start = time.perf_counter()
+    request(port, "GET", "/users?page_size=1000", auth)
+    listed = time.perf_counter() - start
+    start = time.perf_counter()
+    request(port, "GET", "/users/export", auth)
+    exported = time.perf_counter() - start
+    return listed, exported
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    shards = [alias for alias in settings.DATABASES if alias.startswith("shard")]
+    if not shards:
+        parser.error("set SQLITE_SHARDS=N in the environment")
+
+    application = get_wsgi_application()
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    settings.ALLOWED_HOSTS = ["*"]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, profile_shards in [("single", []), (f"{len(shards)} shards", shards)]:
+            with profile(profile_shards, directory):
+                admin = AppUser.objects.create_superuser(
+                    "bench@example.com", "bench-password"
+                )
+                token = (
+                    Token.objects.using(admin._state.db)
+                    .get_or_create(user=admin)[0]
+                    .key
+                )
+                with serve(application, args.writers) as port:
+                    stats = run_writes(port, args.writers, args.duration)
+                    listed, exported = time_reads(port, token)
+                print(
+                    f"{name:>10}: {stats['writes'] / args.duration:7.1f} writes/s"
+                    f" {stats['locked']:5d} locked {stats['errors']:5d} other errors"
+                    f" | list 1000 {listed * 1000:6.1f} ms"
+                    f" export {exported * 1000:6.1f} ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
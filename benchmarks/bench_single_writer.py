@@ -0,0 +1,130 @@
+"""
+Concurrent registrations (POST /users) against a file-backed SQLite database
+with the production profile of bench_sqlite_concurrency.py, each request
+running its own transaction versus the INSERTs group committed by the single
+writer (app_users/api/writer.py). Readers (GET /users) keep the database busy
+meanwhile. --busy-timeout lowers the pragma to make lock errors show sooner.
+Prints registrations/s, the latency percentiles, the "database is locked"
+errors and the mean number of registrations per COMMIT.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_sqlite_concurrency import profile, request, serve
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authtoken.models import Token
+
+import app_users.api.urls  # noqa: F401, connects the signals
+from app_users.api import writer as single_writer
+from app_users.models import AppUser
+
+
+def run_load(port, token, readers, writers, duration):
+    stats = {"writes": [], "reads": 0, "locked": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    auth = {"Authorization": f"Token {token}"}
+
+    def record(status, body, expected):
+        if status == expected:
+            return True
+        with lock:
+            if b"database is locked" in body:
+                stats["locked"] += 1
+            else:
+                stats["errors"] += 1
+        return False
+
+    def reader(worker):
+        i = 0
+        while time.monotonic() < deadline:
+            # Unique query string, the response cache must not answer
+            path = f"/users?page_size=20&r={worker}-{i}"
+            if record(*request(port, "GET", path, auth), 200):
+                with lock:
+                    stats["reads"] += 1
+            i += 1
+
+    def writer(worker):
+        i = 0
+        while time.monotonic() < deadline:
+            body = json.dumps(
+                {
+                    "email": f"w{worker}-{i}@example.com",
+                    "username": f"w{worker}-{i}",
+                    "password": "bench-password",
+                }
+            )
+            headers = {"Content-Type": "application/json"}
+            start = time.perf_counter()
+            if record(*request(port, "POST", "/users", headers, body), 201):
+                with lock:
+                    stats["writes"].append(time.perf_counter() - start)
+            i += 1
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--busy-timeout", type=int, default=None, help="ms")
+    parser.add_argument("--rounds", type=int, default=2, help="even")
+    args = parser.parse_args()
+
+    application = get_wsgi_application()
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    settings.ALLOWED_HOSTS = ["*"]
+    if args.busy_timeout is not None:
+        settings.SQLITE_PRAGMAS = {"busy_timeout": args.busy_timeout}
+    modes = [("per request", False), ("single writer", True)]
+    with tempfile.TemporaryDirectory() as directory:
+        # Later runs come out slower on a busy machine, alternate the order
+        for name, enabled in (modes + modes[::-1]) * (args.rounds // 2):
+            single_writer._settings["ENABLED"] = enabled
+            with profile("production", Path(directory) / "db.sqlite3"):
+                admin = AppUser.objects.create_superuser(
+                    "bench@example.com", "bench-password"
+                )
+                token = Token.objects.get_or_create(user=admin)[0].key
+                writer = single_writer.get_writer(DEFAULT_DB_ALIAS)
+                batches, jobs = writer.batches, writer.items
+                with serve(application, args.readers + args.writers) as port:
+                    stats = run_load(
+                        port, token, args.readers, args.writers, args.duration
+                    )
+                # Its connection must not outlive the test database
+                single_writer.close_writers()
+                latencies = sorted(stats["writes"]) or [0]
+                batches, jobs = writer.batches - batches, writer.items - jobs
+                print(
+                    f"{name:>13}: {len(stats['writes']) / args.duration:7.1f} writes/s"
+                    f" p50 {statistics.median(latencies) * 1000:6.1f} ms"
+                    f" p99 {latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms"
+                    f" {stats['reads'] / args.duration:7.1f} reads/s"
+                    f" {stats['locked']:4d} locked {stats['errors']:4d} other errors"
+                    f" {jobs / batches if batches else 1:5.1f} per commit"
+                )
+
+
+if __name__ == "__main__":
+    main()
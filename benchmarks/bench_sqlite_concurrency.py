@@ -0,0 +1,201 @@
+"""
+N readers (GET /users) and M writers (POST /users) against a file-backed
+SQLite database, once with SQLite / Django defaults and once with the
+production profile (app_users/db.py pragmas + persistent connections).
+
+The app is served over real HTTP by a WSGI server with a fixed thread pool,
+like gunicorn's gthread worker, so connections can be reused between requests.
+Passwords use the MD5 hasher here so writers are bound by the database, not PBKDF2.
+Prints requests/s and the "database is locked" errors per profile.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from common import test_database
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.authtoken.models import Token
+
+import app_users.api.urls  # noqa: F401, connects the signals
+from app_users.db import configure_sqlite
+from app_users.models import AppUser
+
+
+PROFILES = {
+    # name -> (pragmas applied on connect, CONN_MAX_AGE)
+    "defaults": (False, 0),
+    "production": (True, 600),
+}
+PASSWORD = "md5$bench$00000000000000000000000000000000"
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """Requests run on a fixed pool of threads, each keeps its DB connection."""
+
+    def __init__(self, address, threads):
+        super().__init__(address, QuietHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+@contextmanager
+def serve(application, threads):
+    server = PooledWSGIServer(("127.0.0.1", 0), threads)
+    server.set_app(application)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.pool.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def profile(name, database):
+    pragmas, conn_max_age = PROFILES[name]
+    if not pragmas:
+        connection_created.disconnect(dispatch_uid="configure_sqlite")
+    # New threads build their connection from settings.DATABASES
+    for settings_dict in (
+        settings.DATABASES["default"],
+        connections["default"].settings_dict,
+    ):
+        settings_dict["CONN_MAX_AGE"] = conn_max_age
+        settings_dict["TEST"]["NAME"] = str(database)
+    try:
+        with test_database():
+            yield
+    finally:
+        connection_created.connect(configure_sqlite, dispatch_uid="configure_sqlite")
+
+
+def request(port, method, path, headers, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def run_load(port, token, readers, writers, duration):
+    stats = {"reads": 0, "writes": 0, "locked": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    auth = {"Authorization": f"Token {token}"}
+
+    def record(kind, status, body):
+        with lock:
+            if status in (200, 201):
+                stats[kind] += 1
+            elif b"database is locked" in body:
+                stats["locked"] += 1
+            else:
+                stats["errors"] += 1
+
+    def reader(worker):
+        i = 0
+        while time.monotonic() < deadline:
+            # Unique query string, the response cache must not answer
+            path = f"/users?page_size=20&r={worker}-{i}"
+            record("reads", *request(port, "GET", path, auth))
+            i += 1
+
+    def writer(worker):
+        i = 0
+        while time.monotonic() < deadline:
+            body = json.dumps(
+                {
+                    "email": f"w{worker}-{i}@example.com",
+                    "username": f"w{worker}-{i}",
+                    "password": "bench-password",
+                }
+            )
+            headers = {"Content-Type": "application/json"}
+            record("writes", *request(port, "POST", "/users", headers, body))
+            i += 1
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    # get_wsgi_application() configures logging again, silence it afterwards
+    application = get_wsgi_application()
+    # Every lock error is a 500, counted below instead of logged
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    settings.ALLOWED_HOSTS = ["*"]
+    with tempfile.TemporaryDirectory() as directory:
+        for name in PROFILES:
+            database = Path(directory) / f"{name}.sqlite3"
+            with profile(name, database):
+                AppUser.objects.bulk_create(
+                    [
+                        AppUser(
+                            email=f"user{i}@example.com",
+                            username=f"user{i}",
+                            password=PASSWORD,
+                        )
+                        for i in range(1000)
+                    ]
+                )
+                admin = AppUser.objects.create_superuser(
+                    "bench@example.com", "bench-password"
+                )
+                token = Token.objects.get_or_create(user=admin)[0].key
+                with serve(application, args.readers + args.writers) as port:
+                    stats = run_load(
+                        port, token, args.readers, args.writers, args.duration
+                    )
+                print(
+                    f"{name:>10}: {stats['reads'] / args.duration:7.1f} reads/s"
+                    f" {stats['writes'] / args.duration:7.1f} writes/s"
+                    f" {stats['locked']:5d} locked {stats['errors']:5d} other errors"
+                )
+
+
+if __name__ == "__main__":
+    main()
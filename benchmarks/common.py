@@ -0,0 +1,62 @@
+"""
+Shared setup for the benchmark scripts.
+
+Run them from the project root, e.g. `python benchmarks/bench_login.py`.
+They build a throwaway test database, the real db.sqlite3 is never touched.
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "demo.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test.runner import DiscoverRunner  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+
+@contextmanager
+def test_database():
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+def timed(func, iterations):
+    """Run func `iterations` times, return calls per second."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.perf_counter() - start)
+
+
+@contextmanager
+def count_calls(cls, method_name):
+    """Count calls to cls.method_name while the block runs."""
+    calls = {"count": 0}
+    original = getattr(cls, method_name)
+
+    def wrapper(*args, **kwargs):
+        calls["count"] += 1
+        return original(*args, **kwargs)
+
+    setattr(cls, method_name, wrapper)
+    try:
+        yield calls
+    finally:
+        setattr(cls, method_name, original)
@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'demo.settings')
 
 application = get_asgi_application()
+
+from app_users.api.availability import availability_index  # noqa: E402
+
+availability_index.warm()
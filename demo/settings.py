@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
+from importlib.util import find_spec
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
     "rest_framework",
     "rest_framework.authtoken",
     "rest_framework_simplejwt",
+    "django_filters",
 ]
 
 MIDDLEWARE = [
@@ -52,6 +55,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "app_users.routers.ReplicaRoutingMiddleware",
 ]
 
 ROOT_URLCONF = "demo.urls"
@@ -82,9 +86,75 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections between requests, checked before reuse.
+        # Django advises 0 when serving demo/asgi.py.
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Read replicas, aliases of DATABASES used by app_users.routers.ReadReplicaRouter.
+# SQLITE_REPLICAS=N in the environment adds N local SQLite files standing in for
+# replicas, refreshed from the primary with `manage.py sync_sqlite_replicas`.
+DATABASE_REPLICAS = []
+for index in range(1, int(os.environ.get("SQLITE_REPLICAS", 0)) + 1):
+    DATABASES[f"replica{index}"] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / f"db.replica{index}.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(f"replica{index}")
+
+# Hash sharding of AppUser / Token rows over these aliases of DATABASES, see
+# app_users/sharding.py. Empty keeps every user on "default", which always holds
+# the bucket map and the id sequence. SQLITE_SHARDS=N adds N local SQLite files.
+# Run `manage.py migrate --database=<alias>` for each shard, then
+# `manage.py rebalance_user_shards` after changing the list.
+# The admin site and read replicas only see the users of "default".
+USER_SHARDS = []
+for index in range(1, int(os.environ.get("SQLITE_SHARDS", 0)) + 1):
+    DATABASES[f"shard{index}"] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / f"db.shard{index}.sqlite3",
+    }
+    USER_SHARDS.append(f"shard{index}")
+
+# BUCKETS is fixed once users are sharded, ids are reserved ID_BLOCK at a time
+# and bucket map changes reach other processes within MAP_TTL seconds.
+USER_SHARDING = {
+    "BUCKETS": 1024,
+    "ID_BLOCK": 100,
+    "MAP_TTL": 5,
+}
+
+DATABASE_ROUTERS = [
+    "app_users.sharding.UserShardRouter",
+    "app_users.routers.ReadReplicaRouter",
+]
+
+# Looks users up on every shard, same as ModelBackend without sharding
+AUTHENTICATION_BACKENDS = ["app_users.backends.ShardedModelBackend"]
+
+# Replicas whose heartbeat is older than MAX_LAG seconds get no reads, users that
+# wrote keep reading from the primary for STICKY seconds (kept in CACHE).
+REPLICA_ROUTING = {
+    "MAX_LAG": 5,
+    "LAG_CHECK_INTERVAL": 1,
+    "STICKY": 10,
+    "CACHE": "default",
+}
+
+# Applied on every new SQLite connection, see app_users/db.py for the defaults.
+# e.g. {"mmap_size": 0} turns memory mapping off, None drops a pragma.
+SQLITE_PRAGMAS = {}
+
+# Registrations on a SQLite database are written by one thread per database,
+# the ones queued meanwhile are committed together, up to BATCH_SIZE at a time.
+SQLITE_SINGLE_WRITER = {
+    "ENABLED": True,
+    "BATCH_SIZE": 64,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -127,22 +197,132 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = "app_users.AppUser"
+
+# Process pool used by the async login / registration views and bulk registration.
+# None means one worker per CPU, requests beyond workers + queue depth get a 503.
+PASSWORD_HASHING_WORKERS = None
+PASSWORD_HASHING_QUEUE_DEPTH = 64
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.BasicAuthentication",
-        "rest_framework.authentication.TokenAuthentication",
+        "app_users.api.authentication.CachedTokenAuthentication",
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "app_users.api.authentication.VersionedJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "app_users.api.renderers.FastJSONRenderer",
+        "app_users.api.renderers.ColumnarJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
+# MessagePack output is only offered when the optional package is installed
+if find_spec("msgpack") is not None:
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"].insert(
+        2, "app_users.api.renderers.MessagePackRenderer"
+    )
+
+# URL names served by the native async views of app_users/api/async_views.py
+# instead of the DRF ones, e.g. ["users-list", "users-detail", "token_obtain_pair"].
+# Only worth it under ASGI (demo/asgi.py), the async views are always reachable
+# under /async/ as well.
+ASYNC_ROUTES = []
+
+# token key -> user cache for CachedTokenAuthentication.
+# Set SHARED_CACHE to a CACHES alias to share entries between processes.
+AUTH_TOKEN_CACHE = {
+    "MAXSIZE": 10000,
+    "TTL": 60,
+    "SHARED_CACHE": None,
+}
+
+# Successful Basic auth checks remembered by CachedBasicAuthentication (opt-in,
+# swap it for BasicAuthentication above to skip PBKDF2 on repeat API client calls)
+BASIC_AUTH_CACHE = {
+    "MAXSIZE": 10000,
+    "TTL": 30,
+}
+
+# Cached retrieve / list responses of UserViewSet, served with strong ETags.
+# Point CACHE at a shared backend to keep several workers consistent.
+USER_RESPONSE_CACHE = {
+    "CACHE": "default",
+    "TTL": 300,
+}
+
+# Bloom filters behind /users/availability and the email / username uniqueness
+# checks. Rebuilt every REFRESH seconds to pick up other processes' writes, until
+# then a value they took may still read as available (the constraints decide).
+AVAILABILITY_INDEX = {
+    "CAPACITY": 1000000,
+    "ERROR_RATE": 0.001,
+    "REFRESH": 300,
+}
+
+# last_login of logins (UPDATE_LAST_LOGIN below, session logins) is kept in memory
+# and written at most FLUSH_INTERVAL seconds later, BATCH_SIZE rows per UPDATE, or
+# as soon as MAX_PENDING users wait. ENABLED False saves it during the login.
+LAST_LOGIN_WRITE_BEHIND = {
+    "ENABLED": True,
+    "FLUSH_INTERVAL": 5,
+    "MAX_PENDING": 1000,
+    "BATCH_SIZE": 500,
+}
+
+# DRF auth tokens: "lazy" creates one on the first token login instead of at
+# signup ("eager"). Token uses are recorded at most once per USE_RESOLUTION
+# seconds, `manage.py prune_auth_tokens` deletes the ones unused for
+# PRUNE_AFTER_DAYS.
+AUTH_TOKENS = {
+    "CREATE": "lazy",
+    "USE_RESOLUTION": 3600,
+    "FLUSH_INTERVAL": 5,
+    "PRUNE_AFTER_DAYS": 30,
+}
+
+# Side effects of user changes, queued in the registration transaction and run
+# by `manage.py run_outbox_worker`. Topic -> dotted paths of the handlers, e.g.
+# "app_users.outbox.log_event"; a topic without handlers queues nothing.
+OUTBOX = {
+    "HANDLERS": {
+        "user.created": [],
+    },
+    "BATCH_SIZE": 100,
+    "MAX_ATTEMPTS": 8,
+    "RETRY_BACKOFF": 2,
+    "MAX_BACKOFF": 3600,
+    "CLAIM_TIMEOUT": 300,
+    "POLL_INTERVAL": 1,
+}
+
+# Revoked JWTs (rotated refresh tokens, `manage.py revoke_jwt`), checked against
+# a per-process Bloom filter synced every SYNC_INTERVAL seconds, see
+# app_users/api/revocation.py. `manage.py prune_revoked_jwts` deletes the
+# expired ones. Rotation replaces the simplejwt blacklist app, so
+# BLACKLIST_AFTER_ROTATION stays off.
+JWT_REVOCATION = {
+    "CAPACITY": 100000,
+    "ERROR_RATE": 0.001,
+    "SYNC_INTERVAL": 5,
+    # Seconds each sync reads again, covers commit delays and clock skew
+    "SYNC_OVERLAP": 60,
+    "REBUILD_INTERVAL": 3600,
+}
+
+# user id -> auth_version map checked by VersionedJWTAuthentication
+AUTH_VERSION_CACHE = {
+    "MAXSIZE": 100000,
+    "TTL": 300,
 }
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
-    "ROTATE_REFRESH_TOKENS": False,
+    "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": False,
     "UPDATE_LAST_LOGIN": False,
     "ALGORITHM": "HS256",
@@ -160,14 +340,14 @@ SIMPLE_JWT = {
     "USER_AUTHENTICATION_RULE": "rest_framework_simplejwt.authentication.default_user_authentication_rule",
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
-    "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_USER_CLASS": "app_users.api.authentication.ClaimsUser",
     "JTI_CLAIM": "jti",
     "SLIDING_TOKEN_REFRESH_EXP_CLAIM": "refresh_exp",
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
     "TOKEN_OBTAIN_SERIALIZER": "app_users.api.serializers.CustomTokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
-    "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
+    "TOKEN_REFRESH_SERIALIZER": "app_users.api.serializers.RotatingTokenRefreshSerializer",
+    "TOKEN_VERIFY_SERIALIZER": "app_users.api.serializers.RevocableTokenVerifySerializer",
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",